@@ -0,0 +1,167 @@
+"""
+Batched fetch stage for the fundamentals the a1 factors are computed from.
+
+Every ticker is requested once, by a bounded pool of threads. Requests sharing a rate key (all of the Yahoo
+requests by default) are spaced out by a rate limiter and failed requests are retried with an exponential backoff.
+All of the responses of a ticker are kept in a single TickerFundamentals object that all the factors read from
+"""
+import logging  # Logging class for logging in the case of an error, makes debugging easier
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+# How to get each item from a YahooFinancials client
+ITEMS = {
+    'balance': lambda client: client.get_financial_stmts('quarterly', 'balance'),
+    'cashflow': lambda client: client.get_financial_stmts('quarterly', 'cash'),
+    'pe_ratio': lambda client: client.get_pe_ratio(),
+    'ebit': lambda client: client.get_ebit(),
+    'book_value': lambda client: client.get_book_value(),
+    'market_cap': lambda client: client.get_market_cap(),
+}
+
+
+class RateLimiter(object):
+    """
+    Spaces out the requests sharing a key, shared by all the threads of a fetch
+    """
+
+    def __init__(self, requests_per_second):
+        """
+        :param requests_per_second: The maximum rate of requests for a single key
+        """
+        self.interval = 1.0 / requests_per_second
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, key):
+        """
+        Blocks until a request under key may be made
+        :param key: The key the request is limited under, e.g. the provider it goes to
+        """
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next_slot.get(key, now))
+            self._next_slot[key] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class TickerFundamentals(object):
+    """
+    All the responses fetched for a single ticker
+    """
+
+    def __init__(self, ticker):
+        self.ticker = ticker
+        self.items = {}
+        self.errors = {}
+
+    def get(self, item):
+        """
+        :param item: The name of the item, see ITEMS
+        :return: The response, or None if it could not be fetched
+        """
+        return self.items.get(item)
+
+
+def _yahoo_financials(ticker):
+    from yahoofinancials import YahooFinancials
+    return YahooFinancials(ticker)
+
+
+class FundamentalsFetcher(object):
+    """
+    Fetches the fundamentals of many tickers concurrently
+    """
+
+    def __init__(self, client_factory=_yahoo_financials, rate_key='finance.yahoo.com', max_workers=8,
+                 requests_per_second=4.0, retries=3, backoff=0.5, retry_on=(IOError,)):
+        """
+        :param client_factory: callable(ticker) returning a client with the methods used in ITEMS
+        :param rate_key: The key the requests are rate limited under. It does not change where they go, which is up
+                         to the clients made by client_factory
+        :param max_workers: The number of threads fetching at once
+        :param requests_per_second: The maximum rate of requests under rate_key
+        :param retries: How many times a failed request is retried
+        :param backoff: Delay before the first retry in seconds, doubled after every retry
+        :param retry_on: The exceptions that are worth a retry, any other one means the item is not available
+        """
+        self.client_factory = client_factory
+        self.rate_key = rate_key
+        self.max_workers = max_workers
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.retries = retries
+        self.backoff = backoff
+        self.retry_on = retry_on
+
+    def _request(self, client, item):
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            self.rate_limiter.wait(self.rate_key)
+            try:
+                return ITEMS[item](client)
+            except self.retry_on:
+                if attempt == self.retries:
+                    raise
+                logging.info('Retrying %s in %.1f seconds' % (item, delay))
+                time.sleep(delay)
+                delay *= 2
+
+    def _fetch_ticker(self, job):
+        ticker, items = job
+        fundamentals = TickerFundamentals(ticker)
+        client = self.client_factory(ticker)
+        for item in items:
+            try:
+                fundamentals.items[item] = self._request(client, item)
+            except Exception as e:
+                logging.info('Could not fetch %s for %s: %s' % (item, ticker, str(e)))
+                fundamentals.errors[item] = e
+        return fundamentals
+
+    def fetch(self, tickers, items=None, fundamentals=None):
+        """
+        Fetches the items of every ticker, each ticker is requested only once
+        :param tickers: List of tickers
+        :param items: The items to fetch, all of ITEMS by default
+        :param fundamentals: dict of already fetched TickerFundamentals, only the missing items are fetched
+        :return: dict - ticker => TickerFundamentals
+        """
+        items = sorted(ITEMS) if items is None else list(items)
+        fundamentals = {} if fundamentals is None else fundamentals
+        jobs = []
+        for ticker in tickers:
+            known = fundamentals.get(ticker)
+            missing = [item for item in items if known is None or (item not in known.items and
+                                                                   item not in known.errors)]
+            if missing:
+                jobs.append((ticker, missing))
+        if not jobs:
+            return fundamentals
+
+        pool = ThreadPool(min(self.max_workers, len(jobs)))
+        try:
+            for index, fetched in enumerate(pool.imap_unordered(self._fetch_ticker, jobs)):
+                print('Fetched fundamentals for %d out of %d' % (index + 1, len(jobs)))
+                known = fundamentals.setdefault(fetched.ticker, TickerFundamentals(fetched.ticker))
+                known.items.update(fetched.items)
+                known.errors.update(fetched.errors)
+        finally:
+            pool.close()
+            pool.join()
+        return fundamentals
+
+
+def fetch_fundamentals(tickers, items=None, fundamentals=None, fetcher=None):
+    """
+    Fetches the fundamentals of the tickers with the default fetcher
+    :param tickers: List of tickers
+    :param items: The items to fetch, all of ITEMS by default
+    :param fundamentals: dict of already fetched TickerFundamentals, which is completed in place
+    :param fetcher: The FundamentalsFetcher to use
+    :return: dict - ticker => TickerFundamentals
+    """
+    if fetcher is None:
+        fetcher = FundamentalsFetcher()
+    return fetcher.fetch(tickers, items, fundamentals)
@@ -0,0 +1,227 @@
+"""
+Versioned on-disk cache of the fundamentals, replacing the ad-hoc pickle files.
+
+Entries are keyed by (ticker, statement, period, as-of date) and each one is stored as a small JSON file under the
+ticker's directory, so reading one ticker never touches the others. An index keeps when each entry was stored and
+last used: entries older than the TTL are stale, and the least recently used ones are evicted once the cache grows
+past its size limit
+"""
+import datetime
+import json
+import logging  # Logging class for logging in the case of an error, makes debugging easier
+import os
+import re
+import time
+from fundamentals import fetch_fundamentals, TickerFundamentals
+
+# The period of each item fetched by fundamentals.FundamentalsFetcher
+ITEM_PERIODS = {
+    'balance': 'quarterly',
+    'cashflow': 'quarterly',
+    'pe_ratio': 'current',
+    'ebit': 'current',
+    'book_value': 'current',
+    'market_cap': 'current',
+}
+
+# The pickles a1 used to ship, and the item each of them holds
+LEGACY_PICKLES = {
+    'balance.p': 'balance',
+    'fcf_raw.p': 'cashflow',
+    'earnings_yield.p': 'earnings_yield',
+    'ebita.p': 'ebit',
+}
+
+DEFAULT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.fundamentals_cache')
+
+
+def _safe(name):
+    return re.sub(r'[^A-Za-z0-9_.\-]', '_', str(name))
+
+
+class FundamentalsCache(object):
+    """
+    Keyed cache of fundamentals with TTL based freshness and LRU size eviction
+    """
+
+    def __init__(self, root=DEFAULT_ROOT, ttl=datetime.timedelta(days=30), max_bytes=256 * 1024 * 1024):
+        """
+        :param root: Directory of the cache
+        :param ttl: datetime.timedelta - How long an entry stays fresh
+        :param max_bytes: Size of the cache above which the least recently used entries are evicted
+        """
+        self.root = root
+        self.ttl = ttl.total_seconds()
+        self.max_bytes = max_bytes
+        self._index_path = os.path.join(root, 'index.json')
+        self._index = None
+        self._dirty = False
+
+    # ===== Index =====
+
+    @property
+    def index(self):
+        """
+        dict - entry path => {'key': [ticker, statement, period, as_of], 'stored': ..., 'used': ..., 'size': ...}
+        """
+        if self._index is None:
+            self._index = {}
+            if os.path.exists(self._index_path):
+                with open(self._index_path) as handle:
+                    self._index = json.load(handle)
+        return self._index
+
+    def flush(self):
+        """
+        Writes the index (access times included) back to disk
+        """
+        if not self._dirty:
+            return
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        temp = self._index_path + '.tmp'
+        with open(temp, 'w') as handle:
+            json.dump(self.index, handle)
+        if os.path.exists(self._index_path):
+            os.remove(self._index_path)
+        os.rename(temp, self._index_path)
+        self._dirty = False
+
+    def _path(self, ticker, statement, period, as_of):
+        return os.path.join(_safe(ticker), '%s.%s.%s.json' % (_safe(statement), _safe(period), _safe(as_of)))
+
+    def _versions(self, ticker, statement, period):
+        prefix = os.path.join(_safe(ticker), '%s.%s.' % (_safe(statement), _safe(period)))
+        return sorted(path for path in self.index if path.startswith(prefix))
+
+    # ===== Reads and writes =====
+
+    def get(self, ticker, statement, period, as_of=None, fresh_only=True):
+        """
+        :param ticker: The ticker symbol
+        :param statement: The statement or item, e.g. 'balance' or 'pe_ratio'
+        :param period: The period of the statement, e.g. 'quarterly'
+        :param as_of: str - The as-of date (YYYY-MM-DD), the latest version by default
+        :param fresh_only: Whether stale entries should be ignored
+        :return: tuple - (found, value), found is False on a miss
+        """
+        if as_of is None:
+            versions = self._versions(ticker, statement, period)
+            if not versions:
+                return False, None
+            path = versions[-1]
+        else:
+            path = self._path(ticker, statement, period, as_of)
+        entry = self.index.get(path)
+        if entry is None:
+            return False, None
+        now = time.time()
+        if fresh_only and now - entry['stored'] > self.ttl:
+            return False, None
+        try:
+            with open(os.path.join(self.root, path)) as handle:
+                value = json.load(handle)
+        except IOError:
+            logging.info('Cache entry %s is missing, dropping it' % path)
+            del self.index[path]
+            self._dirty = True
+            return False, None
+        entry['used'] = now
+        self._dirty = True
+        return True, value
+
+    def put(self, ticker, statement, period, value, as_of=None):
+        """
+        Stores a value, evicting the least recently used entries if the cache grows too large
+        :param value: Any JSON serializable value
+        :param as_of: str - The as-of date (YYYY-MM-DD), today by default
+        """
+        if as_of is None:
+            as_of = datetime.date.today().isoformat()
+        path = self._path(ticker, statement, period, as_of)
+        full_path = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(full_path)):
+            os.makedirs(os.path.dirname(full_path))
+        payload = json.dumps(value)
+        with open(full_path, 'w') as handle:
+            handle.write(payload)
+        now = time.time()
+        self.index[path] = {'key': [ticker, statement, period, as_of], 'stored': now, 'used': now,
+                            'size': len(payload)}
+        self._dirty = True
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits in max_bytes
+        """
+        total = sum(entry['size'] for entry in self.index.values())
+        if total <= self.max_bytes:
+            return
+        for path in sorted(self.index, key=lambda entry_path: self.index[entry_path]['used']):
+            if total <= self.max_bytes:
+                break
+            total -= self.index.pop(path)['size']
+            full_path = os.path.join(self.root, path)
+            if os.path.exists(full_path):
+                os.remove(full_path)
+            self._dirty = True
+
+
+def load_fundamentals(tickers, cache, items=None, fetcher=None):
+    """
+    Reads the fundamentals of the tickers from the cache, fetching only the missing or stale items
+    :param tickers: List of tickers
+    :param cache: FundamentalsCache
+    :param items: The items to load, all of ITEM_PERIODS by default
+    :param fetcher: The fundamentals.FundamentalsFetcher used on a miss
+    :return: dict - ticker => fundamentals.TickerFundamentals
+    """
+    items = sorted(ITEM_PERIODS) if items is None else list(items)
+    fundamentals = {}
+    for ticker in tickers:
+        fundamentals[ticker] = TickerFundamentals(ticker)
+        for item in items:
+            found, value = cache.get(ticker, item, ITEM_PERIODS[item])
+            if found:
+                fundamentals[ticker].items[item] = value
+    cached = dict((ticker, dict(known.items)) for ticker, known in fundamentals.items())
+
+    fundamentals = fetch_fundamentals(tickers, items, fundamentals, fetcher)
+    for ticker, known in fundamentals.items():
+        for item, value in known.items.items():
+            if item not in cached.get(ticker, {}):
+                cache.put(ticker, item, ITEM_PERIODS[item], value)
+    cache.flush()
+    return fundamentals
+
+
+def import_legacy_pickles(cache, directory):
+    """
+    One-off import of the pickle files a1 used to ship. Only run this on pickles you created yourself,
+    unpickling runs arbitrary code
+    :param cache: FundamentalsCache
+    :param directory: The directory holding the pickles
+    :return: int - The number of entries imported
+    """
+    import pickle
+    count = 0
+    for name, statement in LEGACY_PICKLES.items():
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            continue
+        as_of = datetime.date.fromtimestamp(os.path.getmtime(path)).isoformat()
+        with open(path, 'rb') as handle:
+            data = pickle.load(handle)
+        for ticker, value in data.items():
+            if statement == 'balance':
+                value = {'balanceSheetHistoryQuarterly': {ticker: value}}
+            cache.put(ticker, statement, ITEM_PERIODS.get(statement, 'current'), value, as_of)
+            count += 1
+    cache.flush()
+    return count
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(message)s: ')
+    print('Imported %d entries' % import_legacy_pickles(FundamentalsCache(), os.path.dirname(os.path.abspath(__file__))))
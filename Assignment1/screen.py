@@ -0,0 +1,74 @@
+"""
+Cross-sectional factor screen of the whole universe.
+
+Every ticker is ranked on every factor and put into deciles (optionally within its sector). Each decile is an
+equally weighted portfolio, so all of them can be stacked into one (portfolio x ticker) weight matrix and
+backtested with a single matrix product over the price panel
+"""
+import numpy as np
+import pandas as pd
+
+
+def assign_deciles(factors, sectors=None, buckets=10):
+    """
+    Ranks every ticker on every factor
+    :param factors: pd.DataFrame - one row per ticker, one column per factor
+    :param sectors: Optional pd.Series of the sector of each ticker, to rank within sectors
+    :param buckets: The number of buckets, 10 for deciles
+    :return: pd.DataFrame - same shape as factors, the bucket of each ticker (0 is the lowest), NaN if unknown
+    """
+    if sectors is None:
+        ranks = factors.rank(method='first', pct=True)
+    else:
+        ranks = factors.groupby(sectors.reindex(factors.index)).rank(method='first', pct=True)
+    return np.ceil(ranks * buckets) - 1
+
+
+def decile_weights(deciles, buckets=10):
+    """
+    Equal weights of the tickers of every (factor, decile) portfolio
+    :param deciles: The buckets from assign_deciles
+    :param buckets: The number of buckets
+    :return: pd.DataFrame - one row per (factor, decile), one column per ticker
+    """
+    factors = list(deciles.columns)
+    labels = deciles.values.T  # factor x ticker
+    members = (labels[:, np.newaxis, :] == np.arange(buckets)[np.newaxis, :, np.newaxis]).astype(np.float64)
+    counts = members.sum(axis=2, keepdims=True)
+    weights = np.divide(members, counts, out=np.zeros_like(members), where=counts > 0)
+    index = pd.MultiIndex.from_product([factors, range(buckets)], names=['factor', 'decile'])
+    return pd.DataFrame(weights.reshape(len(factors) * buckets, -1), index=index, columns=deciles.index)
+
+
+def backtest_portfolios(prices, weights, initial_investment=10000):
+    """
+    Values every portfolio through time in one matrix product. Tickers without a price at the start are left out
+    and the weights of each portfolio are spread over the remaining ones
+    :param prices: pd.DataFrame - date x ticker
+    :param weights: pd.DataFrame - portfolio x ticker, e.g. from decile_weights
+    :param initial_investment: The amount invested in each portfolio
+    :return: pd.DataFrame - date x portfolio of the portfolio values
+    """
+    prices = prices.reindex(columns=weights.columns).sort_index()
+    normalized = (prices / prices.bfill().iloc[0]).ffill()
+    tradable = normalized.iloc[0].notnull().values
+    matrix = weights.values * tradable
+    totals = matrix.sum(axis=1, keepdims=True)
+    matrix = np.divide(matrix, totals, out=np.zeros_like(matrix), where=totals > 0)
+    values = np.nan_to_num(normalized.values).dot(matrix.T) * initial_investment
+    return pd.DataFrame(values, index=prices.index, columns=weights.index)
+
+
+def run_screen(factors, prices, sectors=None, initial_investment=10000, buckets=10):
+    """
+    Deciles of every factor and the backtest of all of them
+    :param factors: pd.DataFrame - one row per ticker, one column per factor
+    :param prices: pd.DataFrame - date x ticker
+    :param sectors: Optional pd.Series of the sector of each ticker, to form the deciles within sectors
+    :param initial_investment: The amount invested in each portfolio
+    :param buckets: The number of buckets
+    :return: tuple - (deciles, portfolio values)
+    """
+    deciles = assign_deciles(factors, sectors, buckets)
+    values = backtest_portfolios(prices, decile_weights(deciles, buckets), initial_investment)
+    return deciles, values
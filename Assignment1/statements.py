@@ -0,0 +1,115 @@
+"""
+Tabular engine for the quarterly statements.
+
+The nested statement dicts returned by Yahoo Finance are normalized once into a long table with one row per
+(ticker, quarter, line item). Yearly aggregation and the fundamental ratios are then column operations over the
+whole universe, instead of per-ticker dict merging and lookups
+"""
+import numpy as np
+import pandas as pd
+
+LONG_COLUMNS = ['ticker', 'position', 'quarter', 'item', 'value']
+
+
+def statements_to_frame(statements):
+    """
+    Normalizes quarterly statements to a long table
+    :param statements: dict - ticker => list of {quarter date: {line item: value}}, in the order Yahoo lists them
+    :return: pd.DataFrame - columns ticker, position (in the list), quarter, item and value
+    """
+    rows = [(ticker, position, quarter, item, value)
+            for ticker, quarters in statements.items() if quarters
+            for position, listed in enumerate(quarters)
+            for quarter, line_items in listed.items()
+            for item, value in line_items.items()]
+    long = pd.DataFrame(rows, columns=LONG_COLUMNS)
+    long['quarter'] = pd.to_datetime(long['quarter'])
+    long['value'] = pd.to_numeric(long['value'], errors='coerce')
+    return long
+
+
+def combine_quarters(long, how='merge'):
+    """
+    Combines the quarters of each ticker into a single (ticker x line item) table
+    :param long: The long table from statements_to_frame
+    :param how: 'merge' - the value of the last quarter in Yahoo's listing that has the item, like merging the
+                          quarterly dicts one after the other
+                'latest' - the value of the most recent quarter that has the item
+                'ttm' - the sum of the four most recent quarters, for flows such as cash flow items
+    :return: pd.DataFrame - one row per ticker, one column per line item
+    """
+    if how == 'merge':
+        combined = long.sort_values('position', kind='mergesort').drop_duplicates(['ticker', 'item'], keep='last')
+    elif how == 'latest':
+        combined = long.sort_values('quarter', kind='mergesort').drop_duplicates(['ticker', 'item'], keep='last')
+    elif how == 'ttm':
+        recent = long['quarter'].groupby(long['ticker']).rank(method='dense', ascending=False) <= 4
+        grouped = long[recent].groupby(['ticker', 'item'])['value']
+        total = grouped.sum()
+        total[grouped.count() == 0] = np.nan
+        combined = total.reset_index()
+    else:
+        raise ValueError('Unknown way to combine quarters: %s' % how)
+    return combined.pivot(index='ticker', columns='item', values='value')
+
+
+def _column(table, item):
+    """
+    A line item of a combined table, all NaN if no ticker reports it
+    """
+    if item in table.columns:
+        return table[item]
+    return pd.Series(np.nan, index=table.index)
+
+
+def return_on_capital_employed(balance, ebit):
+    """
+    :param balance: Combined balance sheets (ticker x line item)
+    :param ebit: pd.Series of EBIT by ticker
+    :return: pd.Series - EBIT / (total assets - total current liabilities)
+    """
+    capital_employed = _column(balance, 'totalAssets') - _column(balance, 'totalCurrentLiabilities').fillna(0)
+    return pd.to_numeric(ebit, errors='coerce').reindex(balance.index) / capital_employed
+
+
+def free_cash_flow(cashflow):
+    """
+    :param cashflow: Combined cash flow statements (ticker x line item)
+    :return: pd.Series - operating cash flow - capital expenditures
+    """
+    return _column(cashflow, 'totalCashFromOperatingActivities') - _column(cashflow, 'capitalExpenditures').fillna(0)
+
+
+def compute_factors(fundamentals, tickers=None, how='merge'):
+    """
+    Computes every factor of the universe in one pass
+    :param fundamentals: dict - ticker => fundamentals.TickerFundamentals
+    :param tickers: The tickers to compute, all of fundamentals by default
+    :param how: How the quarters are combined, see combine_quarters
+    :return: pd.DataFrame - one row per ticker with earnings_yield, ebita, fcf, roce and b2m
+    """
+    if tickers is None:
+        tickers = sorted(fundamentals)
+    balance_sheets = {}
+    cashflows = {}
+    scalars = {}
+    for ticker in tickers:
+        known = fundamentals[ticker]
+        balance = known.get('balance')
+        cashflow = known.get('cashflow')
+        balance_sheets[ticker] = [] if not balance else balance['balanceSheetHistoryQuarterly'].get(ticker)
+        cashflows[ticker] = [] if not cashflow else cashflow['cashflowStatementHistoryQuarterly'].get(ticker)
+        scalars[ticker] = dict((item, known.get(item)) for item in ['pe_ratio', 'ebit', 'book_value', 'market_cap'])
+
+    scalars = pd.DataFrame.from_dict(scalars, orient='index').reindex(
+        index=tickers, columns=['pe_ratio', 'ebit', 'book_value', 'market_cap']).apply(pd.to_numeric, errors='coerce')
+    balance = combine_quarters(statements_to_frame(balance_sheets), how).reindex(tickers)
+    cashflow = combine_quarters(statements_to_frame(cashflows), how).reindex(tickers)
+
+    factors = pd.DataFrame(index=pd.Index(tickers, name='ticker'))
+    factors['earnings_yield'] = 1 / scalars['pe_ratio'].replace(0, np.nan)
+    factors['ebita'] = scalars['ebit']
+    factors['fcf'] = free_cash_flow(cashflow)
+    factors['roce'] = return_on_capital_employed(balance, scalars['ebit'])
+    factors['b2m'] = scalars['book_value'] / scalars['market_cap'].replace(0, np.nan)
+    return factors
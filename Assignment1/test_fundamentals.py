@@ -0,0 +1,140 @@
+"""
+Tests of the fetch pool of the fundamentals, against stub clients
+"""
+import threading
+import time
+import fundamentals
+from fundamentals import FundamentalsFetcher
+
+
+class StubClient(object):
+    """
+    Answers the ITEMS calls, failing the first few calls of some of them
+    """
+
+    def __init__(self, ticker, failures, log):
+        """
+        :param failures: dict - method name => list of exceptions raised by its first calls
+        :param log: list the (ticker, method, time) of every call is appended to
+        """
+        self.ticker = ticker
+        self.failures = dict((name, list(errors)) for name, errors in failures.items())
+        self.log = log
+
+    def _call(self, name, value):
+        self.log.append((self.ticker, name, time.time()))
+        if self.failures.get(name):
+            raise self.failures[name].pop(0)
+        return value
+
+    def get_financial_stmts(self, frequency, statement):
+        return self._call('get_financial_stmts', {'statement': statement})
+
+    def get_pe_ratio(self):
+        return self._call('get_pe_ratio', 20.0)
+
+    def get_ebit(self):
+        return self._call('get_ebit', 1000.0)
+
+    def get_book_value(self):
+        return self._call('get_book_value', 500.0)
+
+    def get_market_cap(self):
+        return self._call('get_market_cap', 5000.0)
+
+
+def stub_factory(failures=None):
+    """
+    :return: tuple - (client_factory, the tickers it was called for, the log of the client calls)
+    """
+    made = []
+    log = []
+    lock = threading.Lock()
+
+    def factory(ticker):
+        with lock:
+            made.append(ticker)
+        return StubClient(ticker, (failures or {}).get(ticker, {}), log)
+    return factory, made, log
+
+
+def record_sleeps(monkeypatch):
+    """
+    :return: list the duration of every time.sleep of the fetcher is appended to
+    """
+    sleeps = []
+    sleep = time.sleep
+
+    def recording(seconds):
+        sleeps.append(seconds)
+        sleep(seconds)
+    monkeypatch.setattr(fundamentals.time, 'sleep', recording)
+    return sleeps
+
+
+def test_every_ticker_is_requested_once():
+    factory, made, log = stub_factory()
+    tickers = ['T%d' % number for number in range(20)]
+    fetched = FundamentalsFetcher(factory, max_workers=4, requests_per_second=1e6).fetch(tickers, ['ebit', 'pe_ratio'])
+    assert sorted(made) == sorted(tickers)
+    assert len(log) == 2 * len(tickers)
+    assert all(fetched[ticker].get('ebit') == 1000.0 and fetched[ticker].get('pe_ratio') == 20.0 for ticker in tickers)
+
+    # Only the missing items are fetched again
+    FundamentalsFetcher(factory, requests_per_second=1e6).fetch(tickers, ['ebit', 'market_cap'], fetched)
+    assert len(log) == 3 * len(tickers)
+
+
+def test_failed_requests_are_retried_with_backoff(monkeypatch):
+    sleeps = record_sleeps(monkeypatch)
+    factory, made, log = stub_factory({'A': {'get_ebit': [IOError('reset'), IOError('reset')]}})
+    fetcher = FundamentalsFetcher(factory, requests_per_second=1e6, retries=3, backoff=0.01)
+    fetched = fetcher.fetch(['A'], ['ebit'])
+    assert fetched['A'].get('ebit') == 1000.0
+    assert not fetched['A'].errors
+    assert len(log) == 3
+    assert [seconds for seconds in sleeps if seconds >= 0.005] == [0.01, 0.02]
+
+
+def test_exhausted_and_fatal_errors_are_recorded(monkeypatch):
+    sleeps = record_sleeps(monkeypatch)
+    factory, made, log = stub_factory({'A': {'get_ebit': [IOError('down')] * 10,
+                                             'get_pe_ratio': [ValueError('no such field')]}})
+    fetcher = FundamentalsFetcher(factory, requests_per_second=1e6, retries=2, backoff=0.01)
+    fetched = fetcher.fetch(['A'], ['ebit', 'pe_ratio', 'book_value'])
+    assert isinstance(fetched['A'].errors['ebit'], IOError)
+    assert isinstance(fetched['A'].errors['pe_ratio'], ValueError)
+    assert fetched['A'].get('book_value') == 500.0
+    # The retries of ebit only, an error that is not in retry_on is not retried
+    assert [name for _, name, _ in log].count('get_ebit') == 3
+    assert [name for _, name, _ in log].count('get_pe_ratio') == 1
+    assert [seconds for seconds in sleeps if seconds >= 0.005] == [0.01, 0.02]
+
+
+def test_requests_are_rate_limited_across_threads():
+    factory, made, log = stub_factory()
+    tickers = ['T%d' % number for number in range(5)]
+    fetcher = FundamentalsFetcher(factory, max_workers=5, requests_per_second=20)
+    fetcher.fetch(tickers, ['ebit', 'book_value'])
+    times = sorted(called for _, _, called in log)
+    # 10 requests at 20 per second need at least 9 intervals of 50 ms, whatever the number of threads
+    assert len(times) == 10
+    assert times[-1] - times[0] >= 9 * 0.05 * 0.9
+
+
+def test_rate_keys_are_limited_separately():
+    first, _, first_log = stub_factory()
+    second, _, second_log = stub_factory()
+    shared = FundamentalsFetcher(first, requests_per_second=10, rate_key='a')
+    other = FundamentalsFetcher(second, requests_per_second=10, rate_key='b')
+    other.rate_limiter = shared.rate_limiter
+    threads = [threading.Thread(target=fetcher.fetch, args=(['T'], ['ebit', 'book_value', 'market_cap']))
+               for fetcher in (shared, other)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Each key gets its own slots: 3 requests take 2 intervals, not the 5 they would take together
+    assert time.time() - started < 0.45
+    assert len(first_log) == len(second_log) == 3
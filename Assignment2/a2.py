@@ -1,11 +1,16 @@
+import os
+import sys
 import warnings
 import pandas as pd
 import numpy as np
-from pandas_datareader import data as pdr  # The pandas Data Module used for fetching data from a Data Source
 import numpy as np
 import datetime
-import matplotlib.pyplot as plt
 import seaborn as sns
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))  # For the shared modules
+from common.market_data import default_store  # Local store of the daily bars
+from common.report import Report  # Figures rendered in the background into an HTML report
+from common.rsi import wilder_rsi  # Single pass RSI, see WilderRSI for live bars
+from common.signals import threshold_positions  # Threshold crossing signals
 with warnings.catch_warnings():
     warnings.simplefilter("ignore")
     from fix_yahoo_finance import pdr_override  # For overriding Pandas DataFrame Reader not connecting to YF
@@ -20,18 +25,13 @@ def yahoo_finance_bridge():
 
 
 def RSI(series, period):
-    delta = series.diff().dropna()
-    u = delta * 0
-    d = u.copy()
-    u[delta > 0] = delta[delta > 0]
-    d[delta < 0] = -delta[delta < 0]
-    u[u.index[period-1]] = np.mean( u[:period] ) #first value is sum of avg gains
-    u = u.drop(u.index[:(period-1)])
-    d[d.index[period-1]] = np.mean( d[:period] ) #first value is sum of avg losses
-    d = d.drop(d.index[:(period-1)])
-    rs = pd.stats.moments.ewma(u, com=period-1, adjust=False) / \
-         pd.stats.moments.ewma(d, com=period-1, adjust=False)
-    return 100 - 100 / (1 + rs)
+    """
+    RSI with Wilder's smoothing
+    :param series: pd.Series of prices
+    :param period: The RSI period
+    :return: pd.Series - NaN until period price changes are known
+    """
+    return pd.Series(wilder_rsi(series.values, period), index=series.index)
 
 
 def main():
@@ -43,33 +43,31 @@ def main():
     yahoo_finance_bridge()
     start = datetime.datetime(2007, 6, 1)
     end = datetime.datetime(2018, 1, 1)
+    # batch_backtest.py runs both strategies on a list of tickers without prompting
     ticker = raw_input('Please Enter a Valid (single) Ticker to fetch the data for. Example \'AAPL\'')
-    data = pdr.get_data_yahoo(ticker, start=start, end=end, auto_adjust=True)
+    data = default_store(auto_adjust=True).get(ticker, start, end)
     if data.empty:
         print('Please enter valid ticker')
         return 1
     data = pd.DataFrame(data['Open'])
     data.columns = [str(ticker)]
     data = data.sort_index(axis=0, ascending=True)
+    report = Report('Assignment 2 - %s' % ticker)
 
     # ====== Step 2: Calc. SMA =====
     data['SMA1'] = data.rolling(50).mean()
     data['SMA2'] = data[ticker].rolling(200).mean()
-    data.plot(title=ticker + ' stock price | 50 & 200 days SMAs', figsize=(10, 6))
-    plt.show()
-    plt.close()
+    report.plot('SMAs', data, title=ticker + ' stock price | 50 & 200 days SMAs', figsize=(10, 6))
 
     # ===== Construct Portfolio =====
     data['position'] = np.where(data['SMA1'] > data['SMA2'], 1, -1)
     data.dropna(inplace=True)
-    data['position'].plot(ylim=[-1.1, 1.1], title='Market Positioning')
-    data['returns'] = np.log(data['AAPL'] / data['AAPL'].shift(1))
-    data['returns'].hist(bins=35)
+    report.plot('Market Positioning', data['position'], ylim=[-1.1, 1.1], title='Market Positioning')
+    data['returns'] = np.log(data[ticker] / data[ticker].shift(1))
+    report.plot('Returns', data['returns'], kind='hist', bins=35)
     data['strategy'] = data['position'].shift(1) * data['returns']
     data[['returns', 'strategy']].sum()
-    data[['returns', 'strategy']].cumsum().apply(np.exp).plot(figsize=(10, 6))
-    plt.show()
-    plt.close()
+    report.plot('SMA Strategy', data[['returns', 'strategy']].cumsum().apply(np.exp), figsize=(10, 6))
 
     data['cumreturns'] = 1 + (data['strategy'].cumsum())
 
@@ -77,53 +75,32 @@ def main():
     # %pylab inline
     df_portfolio_value = data['cumreturns']
     perf = df_portfolio_value.calc_stats()
-    perf.plot()
-    plt.show()
-    plt.close()
-    ax = perf.prices.to_drawdown_series().plot()
-    plt.show()
-    plt.close()
+    report.plot('SMA Strategy Value', perf.prices, figsize=(15, 5))
+    report.plot('SMA Strategy Drawdown', perf.prices.to_drawdown_series())
     print perf.display()
 
     data['RSI'] = RSI(data[ticker], 14)
 
     # Let's see a historical view of the closing price
-    data.plot(legend=True, figsize=(15, 8))
-    plt.show()
-    plt.close()
-
-    # Create an "empty" column as placeholder for our /position signals
-    data['Position'] = None
-
-    # Fill our newly created position column - set to sell (-1) when the price hits the upper band, and set to buy (1) when it hits the lower band
-    for row in range(len(data)):
-
-        if (data['RSI'].iloc[row] > 69) and (data['RSI'].iloc[row - 1] < 69):
-            data['Position'].iloc[row] = 1
-
-        if (data['RSI'].iloc[row] < 30) and (data['RSI'].iloc[row - 1] > 30):
-            data['Position'].iloc[row] = -1
+    report.plot('Prices and RSI', data, legend=True, figsize=(15, 8))
 
-            # Forward fill our position column to replace the "None" values with the correct long/short positions to represent the "holding" of our position
-    # forward through time
-    data['Position'].fillna(method='ffill', inplace=True)
+    # Position column - set to 1 when the RSI crosses above the upper band, and set to -1 when it crosses below
+    # the lower band, then hold the position until the next crossing
+    data['Position'] = threshold_positions(data['RSI'], 69, 30, upper_state=1, lower_state=-1)
 
     # Calculate the daily market return and multiply that by the position to determine strategy returns
-    data['Market Return'] = np.log(data['AAPL'] / data['AAPL'].shift(1))
+    data['Market Return'] = np.log(data[ticker] / data[ticker].shift(1))
     data['Strategy Return'] = data['Market Return'] * data['Position']
 
     # Plot the strategy returns
-    data['Strategy Return'].cumsum().plot()
-    plt.show()
-    plt.close()
+    report.plot('RSI Strategy', data['Strategy Return'].cumsum())
 
     df2_portfolio_value = data['Strategy Return'].cumsum()
     perf2 = df2_portfolio_value.calc_stats()
     print perf2.display()
 
-    ax = perf2.prices.to_drawdown_series().plot()
-    plt.show()
-    plt.close()
+    report.plot('RSI Strategy Drawdown', perf2.prices.to_drawdown_series())
+    print('Report written to %s' % report.write())
 
 
 if __name__ == '__main__':
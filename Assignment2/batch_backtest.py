@@ -0,0 +1,126 @@
+"""
+Batch mode of the a2 strategies over a whole universe of tickers.
+
+The prices of every ticker are read from the local store straight into one (date x ticker) matrix. The 50 and 200
+day SMAs, the RSI and the positions of both strategies (SMA crossover and RSI bands) are then computed with array
+operations on the whole matrix, and the KPIs of every (strategy, ticker) are reported in a single table. As in a2,
+both strategies are evaluated from the first date where the 200 day SMA of the ticker is known
+"""
+# Some Metadata about the script
+__author__ = 'Osama Iqbal (iqbal.osama@icloud.com)'
+__license__ = 'MIT'
+__vcs_id__ = '$Id$'
+__version__ = '1.0.0'  # Versioning: http://www.python.org/dev/peps/pep-0386/
+
+import datetime
+import logging  # Logging class for logging in the case of an error, makes debugging easier
+import os
+import sys  # For gracefully notifying whether the script has ended or not
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))  # For the shared modules
+from common.kpi import compute_kpis  # KPIs of many strategies at once
+from common.indicators import sma  # Moving averages of every column
+from common.market_data import default_store  # Local store of the daily bars
+from common.rsi import wilder_rsi  # Single pass RSI of every column
+from common.signals import forward_fill, threshold_positions  # Threshold crossing signals
+
+STRATEGIES = ['sma', 'rsi']
+
+
+def read_tickers(source):
+    """
+    :param source: A list of tickers, or the path of a file with one ticker per line (the first column of a CSV)
+    :return: list of tickers, each one once, in the order given
+    """
+    if isinstance(source, str):
+        source = pd.read_csv(source, header=None)[0].astype(str).str.strip().tolist()
+    seen = set()
+    return [ticker for ticker in source if not (ticker in seen or seen.add(ticker))]
+
+
+def price_matrix(store, tickers, start, end, field='Open'):
+    """
+    Reads one field of many tickers into a (date x ticker) matrix, without a DataFrame per ticker
+    :param store: MarketDataStore
+    :param tickers: List of tickers
+    :param start: First date
+    :param end: Last date
+    :param field: The field to read
+    :return: pd.DataFrame - date x ticker on the union of the dates, NaN where a ticker has no bar
+    """
+    bars = [store.bars(ticker, start, end, [field]) for ticker in tickers]
+    dates = np.unique(np.concatenate([np.asarray(ticker_dates, dtype='datetime64[ns]')
+                                      for ticker_dates, _ in bars] + [np.array([], dtype='datetime64[ns]')]))
+    values = np.full((len(dates), len(tickers)), np.nan)
+    for column, (ticker_dates, columns) in enumerate(bars):
+        if field in columns:
+            values[np.searchsorted(dates, ticker_dates), column] = columns[field]
+    return pd.DataFrame(values, index=pd.DatetimeIndex(dates, name='Date'), columns=tickers)
+
+
+def run_batch(prices, fast=50, slow=200, rsi_period=14, upper=69, lower=30):
+    """
+    Both a2 strategies on every ticker
+    :param prices: pd.DataFrame - date x ticker
+    :param fast: The window of the fast SMA
+    :param slow: The window of the slow SMA
+    :param rsi_period: The RSI period
+    :param upper: Crossing above it the RSI strategy goes long
+    :param lower: Crossing below it the RSI strategy goes short
+    :return: tuple - (pd.DataFrame of the values of the strategies, date x (strategy, ticker) and starting at 1,
+             pd.DataFrame of their KPIs, one row per (strategy, ticker))
+    """
+    # Missing prices after the first one of a ticker are carried forward
+    values = forward_fill(prices.values)
+    fast_sma = sma(values, fast)
+    slow_sma = sma(values, slow)
+    values = np.where(np.isnan(slow_sma), np.nan, values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.full(values.shape, np.nan)
+        returns[1:] = np.log(values[1:] / values[:-1])
+
+        # SMA crossover: long above the slow SMA, short below it, traded on the next date
+        position = np.where(np.isnan(values), np.nan, np.where(fast_sma > slow_sma, 1.0, -1.0))
+        sma_returns = np.full(values.shape, np.nan)
+        sma_returns[1:] = position[:-1] * returns[1:]
+
+        # RSI bands: long after crossing above upper, short after crossing below lower
+        position = threshold_positions(wilder_rsi(values, rsi_period), upper, lower, upper_state=1, lower_state=-1)
+        rsi_returns = returns * position
+
+    # Both are valued as 1 plus the cumulative log returns, as in a2
+    strategy_values = []
+    for strategy_returns in [sma_returns, rsi_returns]:
+        cumulative = 1 + np.cumsum(np.nan_to_num(strategy_returns), axis=0)
+        strategy_values.append(np.where(np.isnan(strategy_returns), np.nan, cumulative))
+    columns = pd.MultiIndex.from_product([STRATEGIES, prices.columns], names=['strategy', 'ticker'])
+    strategy_values = pd.DataFrame(np.hstack(strategy_values), index=prices.index, columns=columns)
+    return strategy_values, compute_kpis(strategy_values)
+
+
+def main():
+    """
+    Runs both a2 strategies on a list of tickers, given on the command line or as a file, and prints their KPIs
+    :return: int - Return 0 or 1, which is used as the exist code, depending on successful or erroneous flow
+    """
+    arguments = sys.argv[1:] or ['AAPL']
+    source = arguments[0] if len(arguments) == 1 and os.path.isfile(arguments[0]) else arguments
+    tickers = read_tickers(source)
+    prices = price_matrix(default_store(auto_adjust=True), tickers, datetime.datetime(2007, 6, 1),
+                          datetime.datetime(2018, 1, 1))
+    missing = prices.columns[prices.isnull().all().values].tolist()
+    if missing:
+        print('No Data found for: %s' % ', '.join(missing))
+    prices = prices.drop(missing, axis=1)
+    if prices.empty:
+        return 1
+    _, kpis = run_batch(prices)
+    print(kpis.to_string())
+    return 0
+
+
+if __name__ == '__main__':
+    # Initialize Logger
+    logging.basicConfig(format='%(asctime)s %(message)s: ')
+    sys.exit(main())
@@ -21,14 +21,19 @@ __vcs_id__ = '$Id$'
 __version__ = '1.0.0'  # Versioning: http://www.python.org/dev/peps/pep-0386/
 
 import logging  # Logging class for logging in the case of an error, makes debugging easier
+import os
 import sys  # For gracefully notifying whether the script has ended or not
 import warnings  # For removing Deprecation Warning w.r.t. Yahoo Finance Fix
-from pandas_datareader import data as pdr  # The pandas Data Module used for fetching data from a Data Source
 import numpy as np
 import datetime
-import matplotlib.pyplot as plt  # For plotting charts
+import functools
+import pandas as pd
 import matplotlib.dates as mdates
-import matplotlib.cbook as cbook
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))  # For the shared modules
+from common.market_data import default_store  # Local store of the daily bars
+from common.report import Report  # Figures rendered in the background into an HTML report
+from common.signals import threshold_positions  # Threshold crossing signals
+from vol_signal import COLUMNS, compute_vol_ratio  # Volatility Ratio of many tickers, without side effects
 
 with warnings.catch_warnings():
     warnings.simplefilter("ignore")
@@ -51,7 +56,7 @@ def get_data_from_yahoo_finance(stock_ticker):
     """
     start = datetime.datetime(2007, 6, 1)
     end = datetime.datetime(2018, 1, 1)
-    data = pdr.get_data_yahoo(stock_ticker, start=start.strftime('%Y-%m-%d'), end=end.strftime('%Y-%m-%d'), auto_adjust=True)
+    data = default_store(auto_adjust=True).get(stock_ticker, start, end)
     if data.empty:
         logging.info('No Data found for Ticker %s. The ticker does not exist' % stock_ticker)
         raise ValueError('No Data found for Ticker %s. The ticker does not exist' % stock_ticker)
@@ -59,105 +64,92 @@ def get_data_from_yahoo_finance(stock_ticker):
         return data
 
 
-def compute_vol_ratio_and_aty(stock_data):
+def plot_vol_ratio(figure, vol_ratio):
     """
-    Computes the Vol Ratio and ATR5 for the given data
-    :param stock_data: The stock data dataframe for computing, and for storing the result
-    :return:
+    Draws the Vol Ratio with yearly ticks
+    :param figure: matplotlib.figure.Figure to draw on
+    :param vol_ratio: pd.Series of the Vol Ratio
+    :return: None
     """
-    # Compute the logarithmic returns using the Closing price
-    stock_data['Log_Ret'] = np.log(stock_data['Close'] / stock_data['Close'].shift(1))
-
-    # Compute Volatility using the pandas rolling standard deviation function
-    stock_data['Volatility'] = stock_data['Log_Ret'].rolling(window=252, center=False).std() * np.sqrt(252)
-    stock_data['ATR'] = abs(stock_data['High'] - stock_data['Low'])
-
-    # Plot the close, volatility and ATR to get a rough idea of what's happening
-    stock_data[['Close', 'Volatility', 'ATR']].plot(subplots=True, color='blue', figsize=(8, 6))
-    plt.show()
-    plt.close()
-
-    # Calculate ATR for a window of 5 days
-    stock_data['ATR5'] = (stock_data['ATR'].rolling(min_periods=1, window=5).sum()) / 4
-    # Calculate the Volatility Ratio
-    stock_data['VolRatio'] = (stock_data['ATR'] / stock_data['ATR5'])
-
     years = mdates.YearLocator()  # every year
     months = mdates.MonthLocator()  # every month
     yearsFmt = mdates.DateFormatter('%Y')
-    fig, ax = plt.subplots()
-    ax.plot(stock_data['VolRatio'])
+    ax = figure.add_subplot(1, 1, 1)
+    ax.plot(vol_ratio)
     # format the ticks
     ax.xaxis.set_major_locator(years)
     ax.xaxis.set_major_formatter(yearsFmt)
     ax.xaxis.set_minor_locator(months)
 
     # round to nearest years...
-    datemin = np.datetime64(stock_data.index[0], 'Y')
-    datemax = np.datetime64(stock_data.index[-1], 'Y') + np.timedelta64(1, 'Y')
+    datemin = np.datetime64(vol_ratio.index[0], 'Y')
+    datemax = np.datetime64(vol_ratio.index[-1], 'Y') + np.timedelta64(1, 'Y')
     ax.set_xlim(datemin, datemax)
-
-    # format the coords message box
-    def price(x):
-        return '$%1.2f' % x
-
     ax.format_xdata = mdates.DateFormatter('%Y-%m-%d')
-    ax.format_ydata = price
     ax.grid(True)
 
     # rotates and right aligns the x labels, and moves the bottom of the
     # axes up to make room for them
-    fig.autofmt_xdate()
+    figure.autofmt_xdate()
+
+
+def plot_vol_ratio_figures(report, close, results):
+    """
+    Plot hook of compute_vol_ratio, adds the figures of the Vol Ratio to a report
+    :param report: The Report the figures are added to
+    :param close: pd.Series of the Close prices
+    :param results: dict - the results of compute_vol_ratio
+    :return: None
+    """
+    # Plot the close, volatility and ATR to get a rough idea of what's happening
+    report.plot('Close, Volatility and ATR', pd.concat([close, results['Volatility'], results['ATR']], axis=1),
+                subplots=True, color='blue', figsize=(8, 6))
+    report.figure('VolRatio', plot_vol_ratio, results['VolRatio'])
 
-    plt.show()
-    plt.close()
+    # Plot the Vol Ratio
+    report.plot('Close and VolRatio', pd.concat([close, results['VolRatio']], axis=1), subplots=True, color='blue',
+                figsize=(16, 10))
 
-    # Plot the Vol Ratip
-    stock_data[['Close', 'VolRatio']].plot(subplots=True, color='blue', figsize=(16, 10))
-    plt.show()
-    plt.close()
 
-    return stock_data
+def compute_vol_ratio_and_aty(stock_data, report=None):
+    """
+    Computes the Vol Ratio and ATR5 for the given data, see vol_signal.compute_vol_ratio for many tickers at once
+    :param stock_data: The stock data dataframe, it is not modified
+    :param report: The Report the figures are added to, no figures without it
+    :return: pd.DataFrame - a copy of stock_data with the Log_Ret, Volatility, ATR, ATR5 and VolRatio columns
+    """
+    plot = None if report is None else functools.partial(plot_vol_ratio_figures, report)
+    results = compute_vol_ratio(stock_data['Close'], stock_data['High'], stock_data['Low'], window=252, periods=252,
+                                atr_window=5, plot=plot)
+    return pd.concat([stock_data] + [results[name] for name in COLUMNS], axis=1)
 
 
-def compute_buy_sell_on_vol(stock_data):
+def compute_buy_sell_on_vol(stock_data, report):
     """
     Compute Buy-Sell Signal based on volatility
     :param stock_data: The stock data
+    :param report: The Report the figures are added to
     :return:
     """
-    # Create an "empty" column as placeholder for our /position signals
-    stock_data['Position'] = None
-
-    # Fill our newly created position column - set to sell (-1) when the price hits the upper band, and set to buy (1) when it hits the lower band
-    for row in range(len(stock_data)):
-
-        if (stock_data['VolRatio'].iloc[row] > 1.4) and (stock_data['VolRatio'].iloc[row - 1] < 1.4):
-            stock_data['Position'].iloc[row] = 1
-
-        if (stock_data['VolRatio'].iloc[row] < 0.4) and (stock_data['VolRatio'].iloc[row - 1] > 0.4):
-            stock_data['Position'].iloc[row] = 0  # -1
-
-    # Forward fill our position column to replace the "None" values with the correct long/short positions to represent the "holding" of our position
-    # forward through time
-    stock_data['Position'].fillna(method='ffill', inplace=True)
+    # Position column - set to 1 when the Vol Ratio crosses above the upper band, and set to 0 (flat) when it crosses
+    # below the lower band, then hold the position until the next crossing
+    stock_data['Position'] = threshold_positions(stock_data['VolRatio'], 1.4, 0.4, upper_state=1, lower_state=0)
 
     # Calculate the daily market return and multiply that by the position to determine strategy returns
     stock_data['Market Return'] = np.log(stock_data['Close'] / stock_data['Close'].shift(1))
     stock_data['Strategy Return'] = stock_data['Market Return'] * stock_data['Position']
 
     # Plot the strategy returns
-    stock_data['Strategy Return'].cumsum().plot(subplots=True, color='blue', figsize=(16, 10))
-    plt.show()
-    plt.close()
+    report.plot('Strategy Return', stock_data['Strategy Return'].cumsum(), color='blue', figsize=(16, 10))
 
     return stock_data
 
 
-def calculate_kpis(stock_data):
+def calculate_kpis(stock_data, report):
     """
     Calculates KPIs and prints it
     :param stock_data: The data used to calculate KPIs
+    :param report: The Report the figures are added to
     :return:
     """
     import ffn
@@ -167,9 +159,7 @@ def calculate_kpis(stock_data):
     perf = stock_data['Strategy Return']
     print(perf2.display())
 
-    ax = perf.to_drawdown_series().plot(subplots=True, color='blue', figsize=(16, 10))
-    plt.show()
-    plt.close()
+    report.plot('Drawdown', perf.to_drawdown_series(), color='blue', figsize=(16, 10))
 
 
 def main():
@@ -187,15 +177,17 @@ def main():
         # ===== Step 1: Download the data for the Ticker =====
         # Get the data fetched from Yahoo Finance
         stock_data = get_data_from_yahoo_finance('AAPL')
+        report = Report('Assignment 3 - AAPL')
 
         # ===== Step 3: Compute Volatility and Average True Range =====
-        stock_data = compute_vol_ratio_and_aty(stock_data)
+        stock_data = compute_vol_ratio_and_aty(stock_data, report)
 
         # ===== Step 4: Generate Buy-Sell signals based on Volatility =====
-        stock_data = compute_buy_sell_on_vol(stock_data)
+        stock_data = compute_buy_sell_on_vol(stock_data, report)
 
         # ===== Step 5: Calculate KPIs =====
-        calculate_kpis(stock_data)
+        calculate_kpis(stock_data, report)
+        print('Report written to %s' % report.write())
 
     except BaseException, e:
         # Casting a wide net to catch all exceptions
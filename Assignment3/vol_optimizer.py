@@ -0,0 +1,209 @@
+"""
+Optimizer for the Volatility Ratio strategy of a3.
+
+Searches (upper, lower, ATR window, volatility window) for the values of the Volatility Ratio with the greatest
+predictive power. The ratio is computed once per pair of windows, then all of the threshold pairs of a chunk are
+evaluated together as one (date x parameter) array. Chunks are spread over a process pool, and the Pareto front of
+Sharpe ratio vs. max drawdown is reported
+"""
+# Some Metadata about the script
+__author__ = 'Osama Iqbal (iqbal.osama@icloud.com)'
+__license__ = 'MIT'
+__vcs_id__ = '$Id$'
+__version__ = '1.0.0'  # Versioning: http://www.python.org/dev/peps/pep-0386/
+
+import datetime
+import itertools
+import logging  # Logging class for logging in the case of an error, makes debugging easier
+import multiprocessing
+import os
+import sys  # For gracefully notifying whether the script has ended or not
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))  # For the shared modules
+from common.indicators import rolling_sum, sma  # Shared indicators
+from common.market_data import default_store  # Local store of the daily bars
+from common.signals import threshold_positions  # Threshold crossing signals
+
+TRADING_DAYS = 252
+RESULT_COLUMNS = ['upper', 'lower', 'atr_window', 'vol_window', 'sharpe', 'max_drawdown', 'total_return']
+
+
+def vol_ratio(high, low, atr_window=5, vol_window=1):
+    """
+    The Volatility Ratio of a3 for any pair of windows: the average range of the last vol_window days over the
+    ATR of the last atr_window days (summed and divided by atr_window - 1, like ATR5 in a3)
+    :param high: ndarray of High prices
+    :param low: ndarray of Low prices
+    :param atr_window: The window of the ATR, at least 2
+    :param vol_window: The number of recent days whose range is compared to the ATR, 1 for the day itself
+    :return: ndarray - the Volatility Ratio
+    """
+    if atr_window < 2:
+        raise ValueError('The ATR window must be at least 2 days, got %d' % atr_window)
+    true_range = np.abs(np.asarray(high, dtype=np.float64) - np.asarray(low, dtype=np.float64))
+    atr = rolling_sum(true_range, atr_window, min_periods=1) / (atr_window - 1)
+    recent = sma(true_range, vol_window, min_periods=1)
+    return recent / atr
+
+
+def evaluate_thresholds(ratio, market_return, uppers, lowers, lag=1):
+    """
+    Evaluates many threshold pairs on a single Volatility Ratio series at once
+    :param ratio: ndarray (date,) of the Volatility Ratio
+    :param market_return: ndarray (date,) of the daily log returns
+    :param uppers: ndarray (parameter,) of upper thresholds
+    :param lowers: ndarray (parameter,) of lower thresholds
+    :param lag: Days between a signal and the return it earns, a3 uses the same day (0)
+    :return: dict - sharpe, max_drawdown and total_return ndarrays of shape (parameter,)
+    """
+    positions = threshold_positions(ratio[:, np.newaxis], uppers[np.newaxis, :], lowers[np.newaxis, :],
+                                    upper_state=1, lower_state=0)
+    if lag:
+        positions = np.concatenate([np.full((lag, positions.shape[1]), np.nan), positions[:-lag]])
+    returns = np.nan_to_num(positions * market_return[:, np.newaxis])
+
+    mean = returns.mean(axis=0)
+    std = returns.std(axis=0, ddof=1)
+    sharpe = np.divide(mean, std, out=np.zeros_like(mean), where=std > 0) * np.sqrt(TRADING_DAYS)
+    equity = np.cumsum(returns, axis=0)
+    drawdown = np.exp(equity - np.maximum.accumulate(np.maximum(equity, 0), axis=0)) - 1
+    return {'sharpe': sharpe, 'max_drawdown': drawdown.min(axis=0), 'total_return': np.exp(equity[-1]) - 1}
+
+
+# Volatility Ratios and returns shared by all the chunks, set once per worker process
+_OPTIMIZER_STATE = {}
+
+
+def _init_optimizer_worker(state):
+    """
+    Pool initializer, so that the ratios are sent to each worker only once
+    """
+    _OPTIMIZER_STATE.update(state)
+
+
+def _evaluate_chunk(chunk):
+    """
+    :param chunk: tuple - (atr window, vol window, uppers, lowers)
+    :return: pd.DataFrame - the results of the chunk
+    """
+    atr_window, vol_window, uppers, lowers = chunk
+    state = _OPTIMIZER_STATE
+    metrics = evaluate_thresholds(state['ratios'][(atr_window, vol_window)], state['market_return'], uppers, lowers,
+                                  state['lag'])
+    result = pd.DataFrame(metrics)
+    result['upper'] = uppers
+    result['lower'] = lowers
+    result['atr_window'] = atr_window
+    result['vol_window'] = vol_window
+    return result[RESULT_COLUMNS]
+
+
+def grid(uppers, lowers, atr_windows=(5,), vol_windows=(1,)):
+    """
+    All the combinations of the given values, keeping only lower < upper
+    :return: list of (upper, lower, atr window, vol window) tuples
+    """
+    return [(upper, lower, atr_window, vol_window)
+            for upper, lower, atr_window, vol_window in itertools.product(uppers, lowers, atr_windows, vol_windows)
+            if lower < upper]
+
+
+def random_search(count, upper_range=(1.0, 3.0), lower_range=(0.1, 1.0), atr_windows=(3, 5, 10, 20),
+                  vol_windows=(1, 2, 3), seed=None):
+    """
+    Random combinations of thresholds and windows, keeping only lower < upper
+    :param count: The number of combinations to draw
+    :return: list of (upper, lower, atr window, vol window) tuples
+    """
+    random = np.random.RandomState(seed)
+    uppers = random.uniform(upper_range[0], upper_range[1], count)
+    lowers = random.uniform(lower_range[0], lower_range[1], count)
+    atr_draws = random.choice(atr_windows, count)
+    vol_draws = random.choice(vol_windows, count)
+    return [(upper, lower, int(atr_window), int(vol_window))
+            for upper, lower, atr_window, vol_window in zip(uppers, lowers, atr_draws, vol_draws) if lower < upper]
+
+
+def pareto_front(results):
+    """
+    Flags the combinations that no other one beats on both Sharpe ratio and max drawdown
+    :param results: pd.DataFrame with sharpe and max_drawdown columns (drawdowns are negative)
+    :return: pd.Series of bool
+    """
+    # Best drawdown at each Sharpe ratio, and the best one among all of the greater Sharpe ratios
+    by_sharpe = results['max_drawdown'].groupby(results['sharpe']).max().sort_index(ascending=False)
+    better_sharpe = by_sharpe.cummax().shift(1).fillna(-np.inf)
+    drawdown = results['max_drawdown']
+    return (drawdown == by_sharpe.reindex(results['sharpe']).values) & \
+        (drawdown > better_sharpe.reindex(results['sharpe']).values)
+
+
+def optimize(stock_data, combinations, lag=1, chunk_size=2000, processes=None):
+    """
+    Evaluates every combination on the stock data
+    :param stock_data: pd.DataFrame with High, Low and Close columns
+    :param combinations: list of (upper, lower, atr window, vol window), see grid and random_search
+    :param lag: Days between a signal and the return it earns
+    :param chunk_size: The number of threshold pairs evaluated together
+    :param processes: Number of worker processes, None for one per CPU and 1 to run in this process
+    :return: pd.DataFrame - one row per combination, with a pareto column flagging the Pareto front
+    """
+    close = stock_data['Close'].values.astype(np.float64)
+    market_return = np.zeros(len(close))
+    market_return[1:] = np.log(close[1:] / close[:-1])
+
+    by_windows = {}
+    for upper, lower, atr_window, vol_window in combinations:
+        by_windows.setdefault((atr_window, vol_window), []).append((upper, lower))
+    state = {
+        'ratios': dict((windows, vol_ratio(stock_data['High'].values, stock_data['Low'].values, *windows))
+                       for windows in by_windows),
+        'market_return': np.nan_to_num(market_return),
+        'lag': lag,
+    }
+    chunks = []
+    for (atr_window, vol_window), thresholds in sorted(by_windows.items()):
+        thresholds = np.asarray(thresholds, dtype=np.float64)
+        for first in range(0, len(thresholds), chunk_size):
+            part = thresholds[first:first + chunk_size]
+            chunks.append((atr_window, vol_window, part[:, 0], part[:, 1]))
+
+    if processes == 1:
+        _init_optimizer_worker(state)
+        results = [_evaluate_chunk(chunk) for chunk in chunks]
+    else:
+        pool = multiprocessing.Pool(processes, initializer=_init_optimizer_worker, initargs=(state,))
+        try:
+            results = pool.map(_evaluate_chunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+
+    results = pd.concat(results, ignore_index=True) if results else pd.DataFrame(columns=RESULT_COLUMNS)
+    results['pareto'] = pareto_front(results)
+    return results
+
+
+def main():
+    """
+    Optimizes the Volatility Ratio thresholds of a ticker (AAPL by default) and prints the Pareto front
+    :return: int - Return 0 or 1, which is used as the exist code, depending on successful or erroneous flow
+    """
+    ticker = sys.argv[1] if len(sys.argv) > 1 else 'AAPL'
+    stock_data = default_store(auto_adjust=True).get(ticker, datetime.datetime(2007, 6, 1), datetime.datetime(2018, 1, 1))
+    if stock_data.empty:
+        print('No Data found for Ticker %s. The ticker does not exist' % ticker)
+        return 1
+    combinations = grid(np.round(np.arange(1.0, 3.01, 0.05), 2), np.round(np.arange(0.1, 1.01, 0.05), 2),
+                        atr_windows=(3, 5, 10, 20), vol_windows=(1, 2, 3))
+    results = optimize(stock_data, combinations)
+    print('Evaluated %d combinations for %s' % (len(results), ticker))
+    print(results[results['pareto']].sort_values('sharpe', ascending=False).to_string(index=False))
+    return 0
+
+
+if __name__ == '__main__':
+    # Initialize Logger
+    logging.basicConfig(format='%(asctime)s %(message)s: ')
+    sys.exit(main())
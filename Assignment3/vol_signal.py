@@ -0,0 +1,104 @@
+"""
+The Volatility Ratio of a3 for any number of tickers, without side effects.
+
+The log returns, the annualized volatility, the daily range (ATR), its sum over a few days (ATR5) and the Volatility
+Ratio are computed with array operations on a whole (date x ticker) block, and returned as new arrays or frames: the
+inputs are never modified. The results can be kept in float32 to halve their memory, the sums themselves are always
+computed in float64. VolRatioSignal carries on from the last date seen, one date or a block of dates at a time, for
+a live loop; compute_vol_ratio is a fresh one fed the whole history, with an optional hook to plot the results
+"""
+import numpy as np
+import pandas as pd
+from common.indicators import RollingSum, RollingVolatility  # Shared indicators
+
+COLUMNS = ['Log_Ret', 'Volatility', 'ATR', 'ATR5', 'VolRatio']
+
+
+class VolRatioSignal(object):
+    """
+    The Volatility Ratio and the series it is built from, fed a block of dates at a time
+    """
+
+    def __init__(self, columns=1, window=252, periods=252, atr_window=5, dtype=np.float64):
+        """
+        :param columns: The number of tickers
+        :param window: The number of returns in the volatility window
+        :param periods: The number of periods per year, for annualizing the volatility
+        :param atr_window: The number of days summed into ATR5, which is divided by atr_window - 1 as in a3
+        :param dtype: The dtype of the results, np.float32 to halve their memory
+        """
+        if atr_window < 2:
+            raise ValueError('The ATR window must be at least 2 days, got %d' % atr_window)
+        self.columns = columns
+        self.atr_window = atr_window
+        self.dtype = np.dtype(dtype)
+        self._close = np.full((1, columns), np.nan)
+        self._volatility = RollingVolatility(window, periods, columns=columns)
+        self._atr = RollingSum(atr_window, 1, columns)
+        self.value = np.full(columns, np.nan)
+
+    def append(self, close, high, low):
+        """
+        Consumes a block of dates
+        :param close: ndarray (date,) of Close prices for a single ticker or (date x ticker)
+        :param high: ndarray of High prices, same shape
+        :param low: ndarray of Low prices, same shape
+        :return: dict - COLUMNS to ndarrays of the same shape as close, in dtype
+        """
+        shape = np.shape(close)
+        close, high, low = [np.asarray(prices, dtype=np.float64).reshape(-1, self.columns)
+                            for prices in (close, high, low)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_ret = np.log(close / np.concatenate([self._close, close[:-1]]))
+            atr = np.abs(high - low)
+            atr5 = self._atr.append(atr) / (self.atr_window - 1)
+            ratio = atr / atr5
+        results = {'Log_Ret': log_ret, 'Volatility': self._volatility.append(close), 'ATR': atr, 'ATR5': atr5,
+                   'VolRatio': ratio}
+        if len(close):
+            self._close = close[-1:]
+            self.value = ratio[-1]
+        return dict((name, result.astype(self.dtype, copy=False).reshape(shape)) for name, result in results.items())
+
+    def update(self, close, high, low):
+        """
+        Consumes one date
+        :param close: The Close price of each ticker, a scalar for a single ticker
+        :return: The Volatility Ratio after the date, a float for a single ticker
+        """
+        self.append(*[np.reshape(prices, (1, self.columns)) for prices in (close, high, low)])
+        return self.value[0] if self.columns == 1 else self.value.copy()
+
+
+def _like(template, values, name):
+    """
+    :return: values in the same kind of container as template (ndarray, pd.Series or pd.DataFrame)
+    """
+    if isinstance(template, pd.DataFrame):
+        return pd.DataFrame(values, index=template.index, columns=template.columns)
+    if isinstance(template, pd.Series):
+        return pd.Series(values, index=template.index, name=name)
+    return values
+
+
+def compute_vol_ratio(close, high, low, window=252, periods=252, atr_window=5, dtype=np.float64, plot=None):
+    """
+    The Volatility Ratio of a3 over the whole history of any number of tickers
+    :param close: Close prices - pd.Series or ndarray (date,) for a single ticker, pd.DataFrame or ndarray
+                  (date x ticker) for many
+    :param high: High prices, same shape and labels as close
+    :param low: Low prices, same shape and labels as close
+    :param window: The number of returns in the volatility window
+    :param periods: The number of periods per year, for annualizing the volatility
+    :param atr_window: The number of days summed into ATR5
+    :param dtype: The dtype of the results, np.float32 to halve their memory
+    :param plot: Optional hook, called as plot(close, results) once they are computed, e.g. to add figures to a
+                 Report. Its return value is ignored
+    :return: dict - COLUMNS to new results of the same kind and shape as close
+    """
+    columns = 1 if np.ndim(close) < 2 else np.shape(close)[1]
+    arrays = VolRatioSignal(columns, window, periods, atr_window, dtype).append(close, high, low)
+    results = dict((name, _like(close, arrays[name], name)) for name in COLUMNS)
+    if plot is not None:
+        plot(close, results)
+    return results
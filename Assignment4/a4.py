@@ -25,76 +25,28 @@ __vcs_id__ = '$Id$'
 __version__ = '1.0.0'  # Versioning: http://www.python.org/dev/peps/pep-0386/
 
 import logging  # Logging class for logging in the case of an error, makes debugging easier
+import os
 import sys  # For gracefully notifying whether the script has ended or not
 import warnings  # For removing Deprecation Warning w.r.t. Yahoo Finance Fix
-import csv
-import re
-import codecs
-import requests
 import pandas as pd
 import logging
 import numpy as np
-import datetime
-import matplotlib.pyplot as plt
 import seaborn as sns
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))  # For the shared modules
+from common.report import Report  # Figures rendered in the background into an HTML report
+from intraday import download_intraday  # Concurrent download of the intraday bars
+from pair_selection import index_correlations  # Correlations with the index, block by block
+from pairs_engine import batch_pairs  # Positions of the pairs strategy, see PairsEngine for live bars
 
 
-def get_google_finance_intraday(ticker, period=60, days=1, exchange='NASD', index=False):
+def plot_spread(figure, distance):
     """
-    Retrieve intraday stock data from Google Finance.
-
-    Parameters
-    ----------------
-    ticker : str
-        Company ticker symbol.
-    period : int
-        Interval between stock values in seconds.
-        i = 60 corresponds to one minute tick data
-        i = 86400 corresponds to daily data
-    days : int
-        Number of days of data to retrieve.
-    exchange : str
-        Exchange from which the quotes should be fetched
-
-    Returns
-    ---------------
-    df : pandas.DataFrame
-        DataFrame containing the opening price, high price, low price,
-        closing price, and volume. The index contains the times associated with
-        the retrieved price values.
+    Draws the deviation of the pair from its moving average
+    :param figure: matplotlib.figure.Figure to draw on
+    :param distance: pd.Series of the distance of the pair from its SMA
+    :return: None
     """
-
-    # build url
-    if index is not True:
-        url = 'https://finance.google.com/finance/getprices' + \
-          '?p={days}d&f=d,o,h,l,c,v&q={ticker}&i={period}&x={exchange}'.format(ticker=ticker,
-                                                                               period=period,
-                                                                               days=days,
-                                                                               exchange=exchange)
-    else:
-        url = 'https://finance.google.com/finance/getprices' + \
-              '?p={days}d&f=d,o,h,l,c,v&q={ticker}&i={period}'.format(ticker=ticker,
-                                                                                   period=period,
-                                                                                   days=days,
-                                                                                   exchange=exchange)
-
-    page = requests.get(url)
-    reader = csv.reader(codecs.iterdecode(page.content.splitlines(), "utf-8"))
-    columns = ['Open', 'High', 'Low', 'Close', 'Volume']
-    rows = []
-    times = []
-    for row in reader:
-        if re.match('^[a\d]', row[0]):
-            if row[0].startswith('a'):
-                start = datetime.datetime.fromtimestamp(int(row[0][1:]))
-                times.append(start)
-            else:
-                times.append(start + datetime.timedelta(seconds=period * int(row[0])))
-            rows.append(map(float, row[1:]))
-    if len(rows):
-        return pd.DataFrame(rows, index=pd.DatetimeIndex(times, name='Date'), columns=columns)
-    else:
-        return pd.DataFrame(rows, index=pd.DatetimeIndex(times, name='Date'))
+    sns.tsplot(data=distance, condition="Deviation", value="Spread", ax=figure.add_subplot(1, 1, 1))
 
 
 def main():
@@ -108,66 +60,34 @@ def main():
         # ===== Step 1: Get Intraday data =====
         # input data
         tickers = pd.read_csv('20151117-master.csv', header=None)
-        main_data = pd.DataFrame()
         period = 60
         days = 1
-        dju_data = get_google_finance_intraday('DJU', period=period, days=days, index=True)
-        main_data = main_data.append(dju_data['Open']).T
-        main_data.columns = ['DJU']
-        for index, ticker in tickers.iterrows():
-            print('Downloading data for: %s' % ticker.values.tolist()[0])
-            the_data = get_google_finance_intraday(ticker.values.tolist()[0], period=period, days=days, index=True)
-            main_data = main_data.join(the_data['Open'])
-            main_data.columns = main_data.columns.values.tolist()[:-1] + ticker.values.tolist()
+        # Download the index and all of its constituents at once, aligned on the union of their times
+        main_data = download_intraday(['DJU'] + tickers[0].tolist(), field='Open', period=period, days=days,
+                                      index=True)
         data = main_data
         data = data.sort_index(axis=0, ascending=True)
+        report = Report('Assignment 4 - Pairs Trading')
 
         # ===== Step 2: Get the highly co-related stock =====
-        stock = data.corr().abs()['DJU'].sort_values(ascending=False).index[1]
+        stock = index_correlations(data, 'DJU').abs().idxmax()
         # ===== Step 3: Get Pairs =====
-        data['pair'] = data['DJU'] - data[stock]
-
-        data = data['pair']
-        data = pd.DataFrame(data)
-
-        data['returns'] = np.log(data / data.shift(1))
-        data['SMA'] = data['pair'].rolling(window=50, center=False).mean()
         threshold = 0.0
-        data['distance'] = data['pair'] - data['SMA']
-        data = data.dropna()
-        data = pd.DataFrame(data)
-        data.head()
-
-        sns.tsplot(data=data['distance'],
-                   condition="Deviation", value="Spread")
-        plt.show()
-        plt.close()
-
-        data['position'] = np.where(data['distance'] > threshold, -1, np.nan)
-        data['position'] = np.where(data['distance'] < -threshold, 1, data['position'])
-        data['position'] = np.where(data['distance'] * data['distance'].shift(1) < 0, 0, data['position'])
-        data['position'] = data['position'].ffill().fillna(0)
-        data['position'].plot(figsize=(10, 6))
-        plt.show()
-        plt.close()
-
-        data['strategy'] = data['position'].shift(1) * data['returns']
-        data[['returns', 'strategy']].dropna().cumsum().apply(np.exp).plot(figsize=(10, 6))
-        plt.show()
-        plt.close()
+        data = batch_pairs(data['DJU'], data[stock], window=50, threshold=threshold)
+
+        report.figure('Spread', plot_spread, data['distance'].values)
+        report.plot('Position', data['position'], figsize=(10, 6))
+        report.plot('Strategy', data[['returns', 'strategy']].dropna().cumsum().apply(np.exp), figsize=(10, 6))
 
         import ffn
         df_portfolio_value = data['strategy']
         perf = df_portfolio_value.calc_stats()
-        perf.plot()
-        plt.show()
-        plt.close()
+        report.plot('Strategy Value', perf.prices, figsize=(15, 5))
 
         print perf.display()
 
-        ax = perf.prices.to_drawdown_series().plot()
-        plt.show()
-        plt.close()
+        report.plot('Drawdown', perf.prices.to_drawdown_series())
+        print('Report written to %s' % report.write())
 
     except BaseException, e:
         # Casting a wide net to catch all exceptions
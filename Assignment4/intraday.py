@@ -0,0 +1,121 @@
+"""
+Concurrent download of intraday bars from the Google Finance getprices endpoint.
+
+All the tickers of a universe are requested by a bounded pool of threads sharing one HTTP session, so connections
+to the host are pooled and reused. The series of every ticker are collected first and then aligned once, with a
+single concat on the union of their minute indexes
+"""
+import logging  # Logging class for logging in the case of an error, makes debugging easier
+from multiprocessing.pool import ThreadPool
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from getprices import getprices_frame  # Bulk parser of the getprices payloads
+
+GETPRICES_URL = 'https://finance.google.com/finance/getprices'
+
+
+def make_session(max_workers=8):
+    """
+    :param max_workers: The number of threads sharing the session
+    :return: requests.Session - keeping up to max_workers connections open per host
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_google_finance_intraday(ticker, period=60, days=1, exchange='NASD', index=False, session=None,
+                                base_url=GETPRICES_URL):
+    """
+    Retrieve intraday stock data from Google Finance.
+
+    Parameters
+    ----------------
+    ticker : str
+        Company ticker symbol.
+    period : int
+        Interval between stock values in seconds.
+        i = 60 corresponds to one minute tick data
+        i = 86400 corresponds to daily data
+    days : int
+        Number of days of data to retrieve.
+    exchange : str
+        Exchange from which the quotes should be fetched
+    index : bool
+        Whether the ticker is an index, which is requested without an exchange
+    session : requests.Session
+        Session to make the request with, so that connections are reused
+    base_url : str
+        URL of the getprices endpoint
+
+    Returns
+    ---------------
+    df : pandas.DataFrame
+        DataFrame containing the opening price, high price, low price,
+        closing price, and volume. The index contains the times associated with
+        the retrieved price values.
+    """
+
+    # build url
+    if index is not True:
+        url = base_url + '?p={days}d&f=d,o,h,l,c,v&q={ticker}&i={period}&x={exchange}'.format(ticker=ticker,
+                                                                                            period=period,
+                                                                                            days=days,
+                                                                                            exchange=exchange)
+    else:
+        url = base_url + '?p={days}d&f=d,o,h,l,c,v&q={ticker}&i={period}'.format(ticker=ticker,
+                                                                               period=period,
+                                                                               days=days)
+
+    page = (session or requests).get(url)
+    page.raise_for_status()
+    return getprices_frame(page.content, period)
+
+
+def download_intraday(tickers, field='Open', period=60, days=1, exchange='NASD', index=False, max_workers=8,
+                      session=None, base_url=GETPRICES_URL):
+    """
+    Downloads the intraday bars of many tickers concurrently
+    :param tickers: List of tickers
+    :param field: The field kept for each ticker, e.g. 'Open'
+    :param period: Interval between the bars in seconds
+    :param days: Number of days of data to retrieve
+    :param exchange: Exchange from which the quotes should be fetched
+    :param index: Whether the tickers are requested without an exchange, see get_google_finance_intraday
+    :param max_workers: The number of tickers downloaded at once
+    :param session: requests.Session shared by all the downloads, a pooled one by default
+    :param base_url: URL of the getprices endpoint
+    :return: pd.DataFrame - time x ticker, on the union of the times of all the tickers. Tickers that could not be
+             downloaded or have no data are left out
+    """
+    # Each ticker is downloaded once, in the order given
+    seen = set()
+    tickers = [ticker for ticker in tickers if not (ticker in seen or seen.add(ticker))]
+    if session is None:
+        session = make_session(max_workers)
+
+    def download(ticker):
+        try:
+            return ticker, get_google_finance_intraday(ticker, period, days, exchange, index, session, base_url)
+        except (IOError, ValueError) as e:
+            logging.info('Could not download %s: %s' % (ticker, str(e)))
+            return ticker, None
+
+    series = []
+    pool = ThreadPool(max(1, min(max_workers, len(tickers))))
+    try:
+        for number, (ticker, data) in enumerate(pool.imap(download, tickers)):
+            if data is None or data.empty:
+                print('No data for: %s' % ticker)
+                continue
+            print('Downloaded data for %s (%d out of %d)' % (ticker, number + 1, len(tickers)))
+            series.append(data[field].rename(ticker))
+    finally:
+        pool.close()
+        pool.join()
+    if not series:
+        return pd.DataFrame()
+    return pd.concat(series, axis=1).sort_index()
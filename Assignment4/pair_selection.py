@@ -0,0 +1,239 @@
+"""
+Pair discovery over large universes of minute bars.
+
+Correlations are computed block by block: for each pair of column blocks, the sums needed by a pairwise-complete
+correlation are accumulated over chunks of rows with a few matrix products. The dense (symbol x symbol) matrix is
+never held in memory, only one (block x block) tile and the best pairs found so far. Candidate pairs can then
+be tested for cointegration (Engle-Granger, with an ADF test of the residuals) in parallel
+"""
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+# Critical values of the Engle-Granger test with a constant and two variables (MacKinnon, 2010)
+EG_CRITICAL_VALUES = {'1%': -3.90, '5%': -3.34, '10%': -3.04}
+
+
+def _blocks(count, block_size):
+    return [(start, min(start + block_size, count)) for start in range(0, count, block_size)]
+
+
+def _block_sums(first, second):
+    """
+    The sums of a pairwise-complete correlation between the columns of two blocks of rows
+    :param first: ndarray (row x column) with NaN for the missing values
+    :param second: ndarray (row x column) with NaN for the missing values
+    :return: tuple of (first column x second column) ndarrays - n, sum x, sum y, sum xx, sum yy, sum xy
+    """
+    first_known = (~np.isnan(first)).astype(np.float64)
+    second_known = (~np.isnan(second)).astype(np.float64)
+    x = np.where(first_known > 0, first, 0)
+    y = np.where(second_known > 0, second, 0)
+    return (first_known.T.dot(second_known), x.T.dot(second_known), first_known.T.dot(y),
+            (x * x).T.dot(second_known), first_known.T.dot(y * y), x.T.dot(y))
+
+
+def _correlation(sums, min_periods):
+    n, sum_x, sum_y, sum_xx, sum_yy, sum_xy = sums
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariance = n * sum_xy - sum_x * sum_y
+        variance = (n * sum_xx - sum_x * sum_x) * (n * sum_yy - sum_y * sum_y)
+        correlation = covariance / np.sqrt(variance)
+    correlation[(n < min_periods) | ~(variance > 0)] = np.nan
+    return np.clip(correlation, -1, 1), n
+
+
+def _streamed_sums(values, first_columns, second_columns, shift, chunk_rows):
+    """
+    Accumulates the sums of _block_sums over chunks of rows
+    """
+    totals = None
+    for start in range(0, len(values), chunk_rows):
+        rows = values[start:start + chunk_rows]
+        sums = _block_sums(rows[:, first_columns[0]:first_columns[1]] - shift[first_columns[0]:first_columns[1]],
+                           rows[:, second_columns[0]:second_columns[1]] - shift[second_columns[0]:second_columns[1]])
+        totals = sums if totals is None else tuple(total + part for total, part in zip(totals, sums))
+    return totals
+
+
+def _prepare(prices, returns):
+    values = prices.values
+    if returns:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = np.diff(np.log(values.astype(np.float64)), axis=0)
+    # Correlations do not depend on a shift of each column, shifting by a typical value keeps the sums accurate
+    known = ~np.isnan(values)
+    first_known = np.where(known.any(axis=0), known.argmax(axis=0), 0)
+    shift = np.nan_to_num(values[first_known, np.arange(values.shape[1])].astype(np.float64))
+    return values, shift
+
+
+def index_correlations(prices, index_column, returns=False, min_periods=2, block_size=256, chunk_rows=65536):
+    """
+    Correlation of every constituent with the index, pairwise-complete like pd.DataFrame.corr
+    :param prices: pd.DataFrame - time x symbol, the index included
+    :param index_column: The column of the index
+    :param returns: Whether the log returns are correlated instead of the prices
+    :param min_periods: The number of common observations below which the correlation is NaN
+    :param block_size: The number of constituents processed at once
+    :param chunk_rows: The number of rows processed at once
+    :return: pd.Series - the correlation of each constituent, the index itself left out
+    """
+    values, shift = _prepare(prices, returns)
+    position = prices.columns.get_loc(index_column)
+    correlations = np.full(len(prices.columns), np.nan)
+    for block in _blocks(len(prices.columns), block_size):
+        sums = _streamed_sums(values, (position, position + 1), block, shift, chunk_rows)
+        correlations[block[0]:block[1]] = _correlation(sums, min_periods)[0][0]
+    result = pd.Series(correlations, index=prices.columns, name=index_column)
+    return result.drop(index_column)
+
+
+def correlated_pairs(prices, top=100, returns=False, min_periods=2, block_size=256, chunk_rows=65536):
+    """
+    The most correlated pairs of symbols, by absolute correlation, without building the full correlation matrix
+    :param prices: pd.DataFrame - time x symbol
+    :param top: The number of pairs kept
+    :param returns: Whether the log returns are correlated instead of the prices
+    :param min_periods: The number of common observations below which a pair is left out
+    :param block_size: The number of symbols per block, the memory used grows with its square
+    :param chunk_rows: The number of rows processed at once
+    :return: pd.DataFrame - first, second, correlation and observations, most correlated first
+    """
+    values, shift = _prepare(prices, returns)
+    symbols = np.asarray(prices.columns)
+    best = None
+    blocks = _blocks(len(symbols), block_size)
+    for number, first in enumerate(blocks):
+        for second in blocks[number:]:
+            correlation, n = _correlation(_streamed_sums(values, first, second, shift, chunk_rows), min_periods)
+            rows, columns = np.nonzero(~np.isnan(correlation))
+            rows = rows + first[0]
+            columns = columns + second[0]
+            # Each pair once, and not a symbol with itself
+            keep = rows < columns
+            rows, columns = rows[keep], columns[keep]
+            found = pd.DataFrame({
+                'first': symbols[rows],
+                'second': symbols[columns],
+                'correlation': correlation[rows - first[0], columns - second[0]],
+                'observations': n[rows - first[0], columns - second[0]].astype(np.int64),
+            })
+            found = found.loc[found['correlation'].abs().sort_values(ascending=False).index[:top]]
+            best = found if best is None else pd.concat([best, found], ignore_index=True)
+            best = best.loc[best['correlation'].abs().sort_values(ascending=False, kind='mergesort').index[:top]]
+    if best is None:
+        return pd.DataFrame(columns=['first', 'second', 'correlation', 'observations'])
+    return best.reset_index(drop=True)[['first', 'second', 'correlation', 'observations']]
+
+
+def engle_granger(first, second, lags=1):
+    """
+    Engle-Granger cointegration test: regresses first on second, then runs an ADF test (without a constant) on the
+    residuals
+    :param first: ndarray of the prices of the first symbol
+    :param second: ndarray of the prices of the second symbol, on the same times
+    :param lags: The number of lagged differences in the ADF regression
+    :return: tuple - (hedge ratio, ADF t-statistic, number of observations used)
+    """
+    known = ~(np.isnan(first) | np.isnan(second))
+    y = first[known]
+    x = second[known]
+    if len(y) < lags + 10:
+        return np.nan, np.nan, len(y)
+    design = np.column_stack([np.ones(len(x)), x])
+    coefficients = np.linalg.lstsq(design, y, rcond=-1)[0]
+    residuals = y - design.dot(coefficients)
+
+    differences = np.diff(residuals)
+    target = differences[lags:]
+    regressors = [residuals[lags:-1]] + [differences[lags - lag:-lag] for lag in range(1, lags + 1)]
+    regressors = np.column_stack(regressors)
+    estimates, squared_errors = np.linalg.lstsq(regressors, target, rcond=-1)[:2]
+    degrees = len(target) - regressors.shape[1]
+    if not len(squared_errors) or degrees <= 0:
+        return coefficients[1], np.nan, len(y)
+    variance = squared_errors[0] / degrees
+    standard_error = np.sqrt(variance * np.linalg.inv(regressors.T.dot(regressors))[0, 0])
+    return coefficients[1], estimates[0] / standard_error, len(y)
+
+
+# Prices shared by the cointegration tests, set once per worker process
+_SELECTION_STATE = {}
+
+
+def _init_selection_worker(state):
+    """
+    Pool initializer, so that the prices are sent to each worker only once
+    """
+    _SELECTION_STATE.update(state)
+
+
+def _test_pair(pair):
+    first, second = pair
+    values = _SELECTION_STATE['values']
+    columns = _SELECTION_STATE['columns']
+    return engle_granger(values[:, columns[first]], values[:, columns[second]], _SELECTION_STATE['lags'])
+
+
+def cointegration_tests(prices, pairs, lags=1, processes=None):
+    """
+    Engle-Granger tests of many pairs in parallel
+    :param prices: pd.DataFrame - time x symbol
+    :param pairs: pd.DataFrame with first and second columns, e.g. from correlated_pairs
+    :param lags: The number of lagged differences in the ADF regressions
+    :param processes: Number of worker processes, None for one per CPU and 1 to run in this process
+    :return: pd.DataFrame - pairs with hedge_ratio, adf_stat and cointegrated (at 5%) columns added
+    """
+    tasks = list(zip(pairs['first'], pairs['second']))
+    state = {'values': prices.values.astype(np.float64), 'lags': lags,
+             'columns': dict((symbol, number) for number, symbol in enumerate(prices.columns))}
+    if processes == 1:
+        _init_selection_worker(state)
+        results = [_test_pair(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(processes, initializer=_init_selection_worker, initargs=(state,))
+        try:
+            results = pool.map(_test_pair, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    tested = pairs.copy()
+    tested['hedge_ratio'] = [result[0] for result in results]
+    tested['adf_stat'] = [result[1] for result in results]
+    tested['cointegrated'] = tested['adf_stat'] < EG_CRITICAL_VALUES['5%']
+    return tested
+
+
+def select_pairs(prices, index_column=None, top=20, cointegration=False, returns=False, lags=1, processes=None,
+                 block_size=256, chunk_rows=65536):
+    """
+    Ranked table of candidate pairs
+    :param prices: pd.DataFrame - time x symbol
+    :param index_column: If given, only the pairs of the index with a constituent are considered
+    :param top: The number of candidate pairs, by absolute correlation
+    :param cointegration: Whether the candidates are tested for cointegration and ranked by the ADF statistic
+    :param returns: Whether the log returns are correlated instead of the prices
+    :param lags: The number of lagged differences in the ADF regressions
+    :param processes: Number of worker processes for the cointegration tests
+    :param block_size: The number of symbols per block
+    :param chunk_rows: The number of rows processed at once
+    :return: pd.DataFrame - first, second, correlation and observations (and hedge_ratio, adf_stat, cointegrated),
+             best pair first
+    """
+    if index_column is None:
+        pairs = correlated_pairs(prices, top, returns, block_size=block_size, chunk_rows=chunk_rows)
+    else:
+        correlations = index_correlations(prices, index_column, returns, block_size=block_size,
+                                          chunk_rows=chunk_rows).dropna()
+        correlations = correlations.loc[correlations.abs().sort_values(ascending=False).index[:top]]
+        known = (~prices.isnull()).astype(np.int64)
+        pairs = pd.DataFrame({'first': index_column, 'second': correlations.index,
+                              'correlation': correlations.values,
+                              'observations': [int((known[index_column] * known[symbol]).sum())
+                                               for symbol in correlations.index]})
+        pairs = pairs[['first', 'second', 'correlation', 'observations']]
+    if not cointegration or pairs.empty:
+        return pairs
+    tested = cointegration_tests(prices, pairs, lags, processes)
+    return tested.sort_values('adf_stat', kind='mergesort').reset_index(drop=True)
@@ -0,0 +1,202 @@
+"""
+Streaming pairs trading engine for the 1 minute bars of a4.
+
+The pair is the index minus the stock, and a position is taken against the distance of the pair from its simple
+moving average: short above it, long below it, and flat on the bar where the distance changes sign. The engine
+consumes bars one at a time (or in micro-batches) keeping O(1) state: a ring buffer with a running sum for the
+moving average, the previous pair and distance, and the current position. Replayed over a history, it skips the
+same bars and takes the same positions as the batch computation of a4 (batch_pairs), with the moving average and
+returns equal up to rounding. The two paths sum the window differently, so where the distance is within rounding of
+0 or of the threshold, both recompute the moving average from the exact (correctly rounded) sum of the window and
+take their side from the same value
+"""
+import math
+import os
+import sys
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))  # For the shared modules
+from common.indicators import sma  # Moving average of the pair
+
+BATCH_COLUMNS = ['pair', 'returns', 'SMA', 'distance', 'position', 'strategy']
+# Relative to the moving average, how close to 0 or to the threshold a distance must be to be recomputed exactly
+TOLERANCE = 1e-9
+
+
+def _exact_mean(values):
+    """
+    :return: float - the mean of a window, from its correctly rounded sum
+    """
+    return math.fsum(values) / len(values)
+
+
+def _near_boundary(distance, sma, threshold):
+    """
+    Whether the sign tests of a distance could depend on how its moving average was summed
+    :return: bool, or ndarray of bool for arrays
+    """
+    tolerance = TOLERANCE * (abs(sma) + 1)
+    return (abs(distance) <= tolerance) | (abs(abs(distance) - threshold) <= tolerance)
+
+
+def batch_pairs(index_prices, stock_prices, window=50, threshold=0.0):
+    """
+    The batch computation of the pairs strategy over a whole history
+    :param index_prices: pd.Series of the index
+    :param stock_prices: pd.Series of the stock, on the same times
+    :param window: The window of the moving average of the pair
+    :param threshold: How far the pair must be from its moving average to take a position
+    :return: pd.DataFrame - pair, returns, SMA, distance, position and strategy on the bars where all of the pair,
+             its log return and its moving average are known
+    """
+    data = pd.DataFrame({'pair': index_prices - stock_prices})
+    with np.errstate(divide='ignore', invalid='ignore'):
+        data['returns'] = np.log(data['pair'] / data['pair'].shift(1))
+    pairs = data['pair'].values
+    averages = sma(pairs, window)
+    with np.errstate(invalid='ignore'):
+        near = _near_boundary(pairs - averages, averages, threshold)
+    for row in np.flatnonzero(near):
+        averages[row] = _exact_mean(pairs[row - window + 1:row + 1].tolist())
+    data['SMA'] = averages
+    data['distance'] = data['pair'] - data['SMA']
+    data = data.dropna()
+
+    data['position'] = np.where(data['distance'] > threshold, -1, np.nan)
+    data['position'] = np.where(data['distance'] < -threshold, 1, data['position'])
+    data['position'] = np.where(data['distance'] * data['distance'].shift(1) < 0, 0, data['position'])
+    data['position'] = data['position'].ffill().fillna(0)
+    data['strategy'] = data['position'].shift(1) * data['returns']
+    return data[BATCH_COLUMNS]
+
+
+def _log_ratio(value, previous):
+    """
+    log(value / previous) with the float semantics of numpy: infinite or NaN instead of an error
+    """
+    if previous != 0:
+        ratio = value / previous
+    elif value == 0 or value != value:
+        ratio = float('nan')
+    else:
+        ratio = math.copysign(float('inf'), value) * math.copysign(1.0, previous)
+    if ratio != ratio or ratio < 0:
+        return float('nan')
+    if ratio == 0:
+        return float('-inf')
+    return math.log(ratio)
+
+
+class PairsEngine(object):
+    """
+    Incremental pairs trading strategy, fed one bar at a time
+    """
+
+    def __init__(self, window=50, threshold=0.0):
+        """
+        :param window: The window of the moving average of the pair
+        :param threshold: How far the pair must be from its moving average to take a position
+        """
+        self.window = window
+        self.threshold = threshold
+        # Ring buffer of the last window pairs, with their running (compensated) sum and how many are NaN
+        self._buffer = [float('nan')] * window
+        self._next = 0
+        self._sum = 0.0
+        self._compensation = 0.0
+        self._missing = window
+        self._previous_pair = float('nan')
+        self._previous_distance = None
+        self.position = 0.0
+        self.changed = False
+        self.sma = float('nan')
+        self.distance = float('nan')
+        self.returns = float('nan')
+        self.strategy = float('nan')
+        self._traded = False
+
+    def _add(self, value):
+        # Kahan summation, so that the running sum does not drift away from the sum of the window
+        corrected = value - self._compensation
+        total = self._sum + corrected
+        self._compensation = (total - self._sum) - corrected
+        self._sum = total
+
+    def _push(self, pair):
+        """
+        Adds a pair to the ring buffer, dropping the oldest one
+        :return: float - the moving average, NaN unless the window is full of known pairs
+        """
+        oldest = self._buffer[self._next]
+        if oldest == oldest:
+            self._add(-oldest)
+        else:
+            self._missing -= 1
+        if pair == pair:
+            self._add(pair)
+        else:
+            self._missing += 1
+        self._buffer[self._next] = pair
+        self._next = (self._next + 1) % self.window
+        if self._missing:
+            return float('nan')
+        if self._next == 0:
+            # Once per window, restart the sum from the buffer so that no error builds up over a long session
+            self._sum = math.fsum(self._buffer)
+            self._compensation = 0.0
+        return self._sum / self.window
+
+    def update(self, index_price, stock_price):
+        """
+        Consumes one bar
+        :param index_price: The price of the index
+        :param stock_price: The price of the stock
+        :return: float - the position after the bar, or None if the bar is skipped (like the batch dropna) because
+                 the pair, its log return or its moving average is unknown
+        """
+        pair = float(index_price) - float(stock_price)
+        returns = _log_ratio(pair, self._previous_pair)
+        self._previous_pair = pair
+        sma = self._push(pair)
+        self.changed = False
+        if pair != pair or returns != returns or sma != sma:
+            return None
+
+        distance = pair - sma
+        if _near_boundary(distance, sma, self.threshold):
+            sma = _exact_mean(self._buffer)
+            distance = pair - sma
+        position = None
+        if distance > self.threshold:
+            position = -1.0
+        if distance < -self.threshold:
+            position = 1.0
+        if self._previous_distance is not None and distance * self._previous_distance < 0:
+            position = 0.0
+        self._previous_distance = distance
+
+        self.strategy = self.position * returns if self._traded else float('nan')
+        self._traded = True
+        if position is not None:
+            self.changed = position != self.position
+            self.position = position
+        self.sma = sma
+        self.distance = distance
+        self.returns = returns
+        return self.position
+
+    def run(self, index_prices, stock_prices):
+        """
+        Consumes a micro-batch of bars
+        :param index_prices: pd.Series of the index
+        :param stock_prices: pd.Series of the stock, on the same times
+        :return: pd.DataFrame - the same columns as batch_pairs, for the bars that were not skipped
+        """
+        rows = []
+        times = []
+        for time, index_price, stock_price in zip(index_prices.index, index_prices.values, stock_prices.values):
+            if self.update(index_price, stock_price) is not None:
+                rows.append((index_price - stock_price, self.returns, self.sma, self.distance, self.position,
+                             self.strategy))
+                times.append(time)
+        return pd.DataFrame(rows, index=pd.Index(times, name=index_prices.index.name), columns=BATCH_COLUMNS)
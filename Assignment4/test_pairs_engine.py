@@ -0,0 +1,34 @@
+"""
+Replay of the pairs engine against the batch computation of a4
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from pairs_engine import PairsEngine, batch_pairs
+
+
+def minute_bars(seed, bars=5000):
+    """
+    :return: tuple - (index, stock) pd.Series of cent-rounded prices, with long stretches of unchanged bars and a gap
+    """
+    random = np.random.RandomState(seed)
+    times = pd.date_range('2015-11-17 09:30', periods=bars, freq='min')
+    moves = random.randn(2, bars) * 0.05 * (random.rand(2, bars) < 0.3)
+    index = pd.Series(np.round(600 + np.cumsum(moves[0]), 2), index=times)
+    stock = pd.Series(np.round(45 + np.cumsum(moves[1]), 2), index=times)
+    index.iloc[1000:1010] = np.nan
+    return index, stock
+
+
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('threshold', [0.0, 0.05])
+def test_replay_matches_batch(seed, threshold):
+    index, stock = minute_bars(seed)
+    expected = batch_pairs(index, stock, window=50, threshold=threshold)
+    engine = PairsEngine(window=50, threshold=threshold)
+    replayed = pd.concat([engine.run(index.iloc[first:first + 700], stock.iloc[first:first + 700])
+                          for first in range(0, len(index), 700)])
+    assert replayed.index.equals(expected.index)
+    np.testing.assert_array_equal(replayed['position'].values, expected['position'].values)
+    np.testing.assert_allclose(replayed['SMA'].values, expected['SMA'].values, rtol=1e-12)
+    np.testing.assert_allclose(replayed['strategy'].values, expected['strategy'].values, rtol=1e-9, atol=1e-15)
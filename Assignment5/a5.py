@@ -21,13 +21,18 @@ __vcs_id__ = '$Id$'
 __version__ = '1.0.0'  # Versioning: http://www.python.org/dev/peps/pep-0386/
 
 import logging  # Logging class for logging in the case of an error, makes debugging easier
+import os
 import sys  # For gracefully notifying whether the script has ended or not
-from pandas_datareader import data as pdr  # The pandas Data Module used for fetching data from a Data Source
 import pandas as pd
 import warnings  # For removing Deprication Warning w.r.t. Yahoo Finance Fix
 import datetime  # For setting correct dates from today up to a year in the past to get data from YF
 import numpy as np  # For numerical operations
-import matplotlib.pyplot as plt
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))  # For the shared modules
+from common.market_data import default_store  # Local store of the daily bars
+from common.report import Report  # Figures rendered in the background into an HTML report
+from delta_sweep import delta_sweep  # Mean Reversion and Breakout for many deltas at once
+from sizing import bootstrap, kelly, trade_returns  # Optimal F from the per-trade returns
+from walk_forward import walk_forward  # Rolling out-of-sample evaluation
 
 with warnings.catch_warnings():
     warnings.simplefilter("ignore")
@@ -61,7 +66,7 @@ def get_data_from_yahoo_finance(stock_ticker):
     """
     today = datetime.datetime.now().date() - datetime.timedelta(1)
     previous_years = today.replace(year=today.year - 5)
-    data = pdr.get_data_yahoo(stock_ticker, start=str(previous_years), end=str(today), auto_adjust=True)
+    data = default_store(auto_adjust=True).get(stock_ticker, previous_years, today)
     if data.empty:
         print('No Data found for Ticker %s. The ticker does not exist' % stock_ticker)
         raise ValueError('No Data found for Ticker %s. The ticker does not exist' % stock_ticker)
@@ -91,89 +96,71 @@ def main():
         data = get_data_from_yahoo_finance(str(stock_ticker))
         data = pd.DataFrame(data['Open'])
         data = data.sort_index(axis=0, ascending=True)
+        report = Report('Assignment 5 - %s' % stock_ticker)
 
         # Calculate daily differences
         data['diff'] = data.diff(periods=1)
         ## Calcultate the cumulative returns
         data['cum'] = data['diff'].cumsum()
 
-        #Meanreversion
-        # Setting position long = 1 and short = -1 based on previous day move
-        delta = 0.005
-        # If previous day price difference was less than or equal then delta, we go long
+        # Mean Reversion (delta = 0.005) and Breakout (delta = -0.01, a negative delta switches the strategy to
+        # Breakout) are evaluated together
+        # If previous day price difference was less than or equal then -delta, we go long
         # If previous day price difference was more than or equal then delta, we go short
-        data['position_mr'] = np.where(data['diff'].shift(1) <= -delta,1, np.where(data['diff'].shift(1) >= delta, -1, 0))
-        data['result_mr'] = (data['diff'] * data['position_mr']).cumsum()
-
         # We will filter execution of our strategy by only executing if our result are above it's 200 day moving average
         win = 200
-        data['ma_mr'] = pd.rolling_mean(data['result_mr'], window=win)
-        filtering_mr = data['result_mr'].shift(1) > data['ma_mr'].shift(1)
-        data['filteredresult_mr'] = np.where(filtering_mr, data['diff'] * data['position_mr'], 0).cumsum()
-        # if we do not want to filter we use below line of code
-        # df['filteredresult_mr'] = (df['diff'] * df['position_mr']).cumsum()
-        data[['ma_mr', 'result_mr', 'filteredresult_mr']].plot(figsize=(10, 8))
-        plt.show()
-        plt.close()
-
-        # Breakout
-        # Setting position long = 1 and short = -1 based on previous day move
-        # By setting the delta to negative we are switching the strategy to Breakout
-        delta = -0.01
-        # If previous day price difference was less than or equal then delta, we go long
-        # If previous day price difference was more than or equal then delta, we go short
-        data['position_bo'] = np.where(data['diff'].shift(1) <= -delta, 1,
-                                       np.where(data['diff'].shift(1) >= delta, -1, 0))
-        data['result_bo'] = (data['diff'] * data['position_bo']).cumsum()
+        sweep = delta_sweep(data['diff'].values, [0.005, -0.01], [win])
+        for number, name in enumerate(['mr', 'bo']):
+            data['position_%s' % name] = sweep['position'][:, number]
+            data['result_%s' % name] = sweep['result'][:, number]
+            data['ma_%s' % name] = sweep['ma'][:, number]
+            data['filteredresult_%s' % name] = sweep['filtered'][:, number]
+            # if we do not want to filter we use result_%s instead of filteredresult_%s
+            report.plot(name.upper(), data[['ma_%s' % name, 'result_%s' % name, 'filteredresult_%s' % name]],
+                        figsize=(10, 8))
 
-        # We will filter execution of our strategy by only executing if our result are above it's 200 day moving average
-        win = 200
-        data['ma_bo'] = pd.rolling_mean(data['result_bo'], window=win)
-        filtering_bo = data['result_bo'].shift(1) > data['ma_bo'].shift(1)
-        data['filteredresult_bo'] = np.where(filtering_bo, data['diff'] * data['position_bo'], 0).cumsum()
-        # df['filteredresult_bo'] = (df['diff'] * df['position_bo']).cumsum()
-        data[['ma_bo', 'result_bo', 'filteredresult_bo']].plot(figsize=(10, 8))
-        plt.show()
-        plt.close()
         # Here we combine the Meanreversion and the Breakout strategy results
         data['combi'] = data['filteredresult_mr'] + data['filteredresult_bo']
-        data[['combi', 'filteredresult_mr', 'filteredresult_bo']].plot(figsize=(10, 8))
-
-        # get 80% data
-        data['sel'] = range(int(len(data)))
-        eighty_data = data.loc[:data.index[data['sel'] == int(0.8 * len(data))].strftime('%Y%m%d').tolist()[0]]
-        # Calculate Optimal F for 80% data FOR MOVING AVERAGE
-        p_mr = float(len(eighty_data[eighty_data['result_mr'] > 0])) / float(len(data))
-        plr_mr = eighty_data[eighty_data['result_mr'] > 0]['result_mr'].mean() / eighty_data[eighty_data['result_mr'] < 0]['result_mr'].mean()
-        op_f_mr = p_mr * (plr_mr + 1) - 1 / plr_mr
-        print('Optimal F for MR is: %s' % str(op_f_mr))
-
-        # Calculate Optimal F for 80% data FOR BREAKOUT
-        p_bo = float(len(eighty_data[eighty_data['result_bo'] > 0])) / float(len(data))
-        plr_bo = eighty_data[eighty_data['result_bo'] > 0]['result_bo'].mean() / \
-                 eighty_data[eighty_data['result_bo'] < 0]['result_bo'].mean()
-        op_f_bo = p_bo * (plr_bo + 1) - 1 / plr_bo
-        print('Optimal F for BO is: %s' % str(op_f_bo))
-
-        # Calculate KPIs on 20% data
-        twenty_data = data.loc[:data.index[data['sel'] == int(0.2 * len(data))].strftime('%Y%m%d').tolist()[0]]
+        report.plot('Combined', data[['combi', 'filteredresult_mr', 'filteredresult_bo']], figsize=(10, 8))
+
+        # get 80% data, by position so that the in-sample and out-of-sample data never overlap
+        split = int(0.8 * len(data))
+        eighty_data = data.iloc[:split]
+        # Calculate Optimal F for 80% data from the returns of the trades of each strategy, with a bootstrap
+        # confidence interval
+        for name in ['mr', 'bo']:
+            returns = trade_returns(eighty_data['position_%s' % name].values, eighty_data['Open'].values)
+            op_f = bootstrap(returns, kelly)
+            print('Optimal F for %s is: %s (95%% confidence: %s to %s, %d trades)' % (
+                name.upper(), op_f['estimate'], op_f['low'], op_f['high'], len(returns)))
+
+        # Calculate KPIs on the last 20% data
+        twenty_data = data.iloc[split:]
         import ffn
         # FOR Moving Average
         df_portfolio_value_mr = twenty_data['result_mr']
         perf = df_portfolio_value_mr.calc_stats()
-        perf.plot()
-        plt.show()
-        plt.close()
+        report.plot('Mean Reversion Out-of-Sample', perf.prices, figsize=(15, 5))
         print perf.display()
 
         # FOR Breakout
         df_portfolio_value_bo = twenty_data['result_bo']
         perf_bo = df_portfolio_value_bo.calc_stats()
-        perf_bo.plot()
-        plt.show()
-        plt.close()
+        report.plot('Breakout Out-of-Sample', perf_bo.prices, figsize=(15, 5))
         print perf_bo.display()
 
+        # Walk forward: fit the deltas and optimal F on a year, score the following quarter, and roll forward
+        # A single ticker has only a few folds, a process pool would cost more than it saves
+        folds = walk_forward(data['Open'], train_size=252, test_size=63, processes=1)
+        if folds.empty:
+            print('Not enough data for a walk-forward: %d dates, at least %d needed' % (len(data), 252 + 63))
+        else:
+            print(folds[['test_from', 'test_to', 'delta_mr', 'f_mr', 'result_mr', 'delta_bo', 'f_bo',
+                         'result_bo']].to_string(index=False))
+            print('Out-of-sample result MR: %s, BO: %s' % (folds['result_mr'].sum(), folds['result_bo'].sum()))
+            report.table('Walk Forward', folds)
+        print('Report written to %s' % report.write())
+
     except BaseException, e:
         # Casting a wide net to catch all exceptions
         print('\n%s' % str(e))
@@ -0,0 +1,82 @@
+"""
+Delta sweep of the Mean Reversion and Breakout strategies of a5.
+
+Both strategies are the same rule with a different sign of delta, so a whole vector of deltas is evaluated at once
+as a (date x delta) array. The moving average filter of the results is then computed for every filter window from
+a single cumulative sum, giving a (date x combination) array of the filtered results of every (delta, window)
+"""
+import numpy as np
+import pandas as pd
+
+
+def delta_positions(diff, deltas):
+    """
+    Positions of the a5 strategies, long after a move down of at least delta and short after a move up of at least
+    delta. A positive delta is Mean Reversion, a negative one Breakout
+    :param diff: ndarray (date,) of the daily price differences, the position of a date uses the previous one
+    :param deltas: The deltas, a scalar or a vector
+    :return: ndarray (date x delta) of the positions, flat on the first date
+    """
+    previous = np.empty(len(diff))
+    previous[0] = np.nan
+    previous[1:] = diff[:-1]
+    previous = previous[:, np.newaxis]
+    deltas = np.atleast_1d(np.asarray(deltas, dtype=np.float64))[np.newaxis, :]
+    return np.where(previous <= -deltas, 1, np.where(previous >= deltas, -1, 0))
+
+
+def rolling_mean(values, windows):
+    """
+    Rolling means of the columns of values for several windows, from one cumulative sum
+    :param values: ndarray (date x column), NaN only on the first dates
+    :param windows: The windows
+    :return: ndarray (date x column x window) - NaN until a window has as many values as its length, like
+             pd.rolling_mean
+    """
+    valid = ~np.isnan(values)
+    counts = np.cumsum(valid, axis=0)
+    sums = np.zeros((len(values) + 1,) + values.shape[1:])
+    np.cumsum(np.where(valid, values, 0), axis=0, out=sums[1:])
+    means = np.full(values.shape + (len(windows),), np.nan)
+    for number, window in enumerate(windows):
+        if window > len(values):
+            continue
+        window_sums = sums[window:] - sums[:-window]
+        full = counts[window - 1:] - np.concatenate([np.zeros((1,) + values.shape[1:]), counts[:-window]]) == window
+        means[window - 1:, :, number] = np.where(full, window_sums / window, np.nan)
+    return means
+
+
+def delta_sweep(diff, deltas, windows=(200,)):
+    """
+    Evaluates every delta and moving average filter window at once
+    :param diff: ndarray (date,) of the daily price differences
+    :param deltas: The deltas to evaluate, positive for Mean Reversion and negative for Breakout
+    :param windows: The windows of the moving average filter of the results
+    :return: dict - 'position', 'result': ndarray (date x delta) of the positions and cumulative results
+                    'ma', 'filtered': ndarray (date x combination) of the moving average of the results, and the
+                    cumulative result when only trading while the result is above its moving average
+                    'combinations': pd.MultiIndex of the (delta, window) of each combination
+    """
+    diff = np.asarray(diff, dtype=np.float64)
+    deltas = np.atleast_1d(np.asarray(deltas, dtype=np.float64))
+    position = delta_positions(diff, deltas)
+    pnl = diff[:, np.newaxis] * position
+    result = np.cumsum(np.nan_to_num(pnl), axis=0)
+    result[np.isnan(pnl)] = np.nan
+
+    ma = rolling_mean(result, windows)
+    # Trade only if yesterday's result was above yesterday's moving average
+    above = np.zeros(ma.shape, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        above[1:] = result[:-1, :, np.newaxis] > ma[:-1]
+    filtered = np.cumsum(np.where(above, pnl[:, :, np.newaxis], 0), axis=0)
+
+    combinations = pd.MultiIndex.from_product([deltas, list(windows)], names=['delta', 'window'])
+    return {
+        'position': position,
+        'result': result,
+        'ma': ma.reshape(len(diff), -1),
+        'filtered': filtered.reshape(len(diff), -1),
+        'combinations': combinations,
+    }
@@ -0,0 +1,98 @@
+"""
+Kelly / optimal F position sizing from per-trade returns.
+
+A trade is a run of days holding the same non-zero position. The per-trade results are extracted from any position
+series with array operations, and the sizing estimators work along the last axis, so a bootstrap evaluates all of
+its resamples as one (resample x trade) array
+"""
+import numpy as np
+
+
+def trade_results(position, pnl):
+    """
+    Sums the daily results of every trade
+    :param position: ndarray (date,) of the positions, the position of a date earns the result of that date
+    :param pnl: ndarray (date,) of the daily results of the position, NaN counts as 0
+    :return: tuple - (ndarray of the result of each trade, ndarray of the date on which each trade starts)
+    """
+    position = np.asarray(position, dtype=np.float64)
+    previous = np.concatenate([[0], position[:-1]])
+    starts = (position != 0) & (position != previous)
+    trade = np.cumsum(starts) - 1
+    held = position != 0
+    results = np.bincount(trade[held], weights=np.nan_to_num(np.asarray(pnl, dtype=np.float64))[held],
+                          minlength=starts.sum())
+    return results, np.flatnonzero(starts)
+
+
+def trade_returns(position, prices):
+    """
+    Per-trade returns of a position series, relative to the price the trade was entered at
+    :param position: ndarray (date,) of the positions, the position of a date earns the price change into that date
+    :param prices: ndarray (date,) of the prices
+    :return: ndarray of the return of each trade
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    diff = np.concatenate([[np.nan], np.diff(prices)])
+    results, starts = trade_results(position, diff * np.asarray(position, dtype=np.float64))
+    # A trade is entered at the close of the date before its first one
+    return results / prices[np.maximum(starts - 1, 0)]
+
+
+def kelly(returns):
+    """
+    Kelly fraction of the returns along the last axis
+    :param returns: ndarray (trade,) or (resample x trade)
+    :return: float or ndarray (resample,) - p - (1 - p) / (average win / average loss), NaN without both wins
+             and losses
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    wins = returns > 0
+    losses = returns < 0
+    win_count = wins.sum(axis=-1)
+    loss_count = losses.sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = win_count / (win_count + loss_count).astype(np.float64)
+        average_win = np.where(wins, returns, 0).sum(axis=-1) / win_count
+        average_loss = -np.where(losses, returns, 0).sum(axis=-1) / loss_count
+        fraction = p - (1 - p) / (average_win / average_loss)
+    return np.where((win_count > 0) & (loss_count > 0), fraction, np.nan)[()]
+
+
+def optimal_f(returns, fractions=np.linspace(0.01, 1, 100)):
+    """
+    Vince's optimal F: the fraction of the largest loss to risk on each trade that maximizes the terminal wealth
+    :param returns: ndarray (trade,) or (resample x trade)
+    :param fractions: The candidate fractions
+    :return: float or ndarray (resample,) - the best fraction, NaN without any loss
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    largest_loss = -returns.min(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scaled = returns / largest_loss[..., np.newaxis]
+        # The log of the terminal wealth relative of every fraction, (fraction x ...)
+        growth = np.array([np.log1p(fraction * scaled).sum(axis=-1) for fraction in fractions])
+    best = np.asarray(fractions)[np.argmax(np.where(np.isnan(growth), -np.inf, growth), axis=0)]
+    return np.where(largest_loss > 0, best, np.nan)[()]
+
+
+def bootstrap(returns, estimator=kelly, resamples=5000, confidence=0.95, seed=None):
+    """
+    Bootstrap confidence interval of a sizing estimator, all the resamples are drawn and evaluated at once
+    :param returns: ndarray of the per-trade returns
+    :param estimator: kelly or optimal_f, or any function of a (resample x trade) array
+    :param resamples: The number of resamples
+    :param confidence: The confidence of the interval
+    :param seed: Seed of the random resampling
+    :return: dict - 'estimate' on the returns, 'low' and 'high' bounds of the interval, and 'std' of the resamples
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    if not len(returns):
+        return {'estimate': np.nan, 'low': np.nan, 'high': np.nan, 'std': np.nan}
+    random = np.random.RandomState(seed)
+    estimates = estimator(returns[random.randint(0, len(returns), (resamples, len(returns)))])
+    estimates = estimates[~np.isnan(estimates)]
+    if not len(estimates):
+        return {'estimate': estimator(returns), 'low': np.nan, 'high': np.nan, 'std': np.nan}
+    low, high = np.percentile(estimates, [50 * (1 - confidence), 50 * (1 + confidence)])
+    return {'estimate': estimator(returns), 'low': low, 'high': high, 'std': estimates.std()}
@@ -0,0 +1,166 @@
+"""
+Walk-forward (rolling out-of-sample) evaluation of the Mean Reversion and Breakout strategies of a5.
+
+The train and test windows of every fold are defined by index position. In each fold the MR / BO deltas and the
+optimal F are fitted on the train slice only, and then scored on the test slice that follows it. The prices and
+price differences of every ticker are computed once and each fold works on array views of them, so the folds of a
+whole universe can be spread over a process pool without copying the data per fold
+"""
+import multiprocessing
+import numpy as np
+import pandas as pd
+from delta_sweep import delta_positions
+from sizing import bootstrap, kelly, trade_returns
+
+TRADING_DAYS = 252
+MR_DELTAS = (0.0025, 0.005, 0.01, 0.02, 0.05)
+BO_DELTAS = (-0.0025, -0.005, -0.01, -0.02, -0.05)
+
+
+def make_folds(length, train_size, test_size, step=None, expanding=False):
+    """
+    Train / test windows by index position
+    :param length: The number of dates
+    :param train_size: The number of dates of each train window (of the first one if expanding)
+    :param test_size: The number of dates of each test window
+    :param step: How far each fold moves forward, test_size by default so that the test windows do not overlap
+    :param expanding: Whether the train windows all start at the first date instead of rolling forward
+    :return: list of (train start, train end, test start, test end) positions, the ends being exclusive
+    """
+    if train_size < 1 or test_size < 1:
+        raise ValueError('The train and test windows need at least one date each')
+    step = test_size if step is None else step
+    folds = []
+    train_end = train_size
+    while train_end + test_size <= length:
+        folds.append((0 if expanding else train_end - train_size, train_end, train_end, train_end + test_size))
+        train_end += step
+    return folds
+
+
+def score(pnl):
+    """
+    :param pnl: ndarray of the daily results
+    :return: tuple - (total result, annualized Sharpe ratio, max drawdown of the cumulative result)
+    """
+    std = pnl.std(ddof=1) if len(pnl) > 1 else 0
+    sharpe = pnl.mean() / std * np.sqrt(TRADING_DAYS) if std > 0 else np.nan
+    cumulative = np.cumsum(pnl)
+    drawdown = cumulative - np.maximum.accumulate(np.maximum(cumulative, 0))
+    return cumulative[-1], sharpe, drawdown.min()
+
+
+def fit_and_score(diff, prices, fold, mr_deltas=MR_DELTAS, bo_deltas=BO_DELTAS):
+    """
+    Fits the deltas and optimal F of both strategies on the train window of a fold, and scores the test window.
+    The optimal F is the Kelly fraction of the per-trade returns, as in a5
+    :param diff: ndarray (date,) of the daily price differences of a ticker
+    :param prices: ndarray (date,) of the prices of the ticker, which diff is the difference of
+    :param fold: tuple - (train start, train end, test start, test end)
+    :param mr_deltas: The candidate Mean Reversion deltas
+    :param bo_deltas: The candidate Breakout deltas
+    :return: dict - the fitted parameters and the out-of-sample KPIs
+    """
+    train_start, train_end, test_start, test_end = fold
+    # Views including the date before each window, whose difference sets the position of the first date
+    train = diff[max(train_start - 1, 0):train_end]
+    train_prices = prices[max(train_start - 1, 0):train_end]
+    test = diff[test_start - 1:test_end]
+    result = {}
+    for name, deltas in (('mr', mr_deltas), ('bo', bo_deltas)):
+        train_positions = delta_positions(train, deltas)[1:]
+        train_pnl = np.nan_to_num(train[1:, np.newaxis] * train_positions)
+        best = int(np.argmax(train_pnl.sum(axis=0)))
+        delta = deltas[best]
+        # The date before the window is flat, a trade starting on the first date is entered at its price
+        returns = trade_returns(np.concatenate([[0], train_positions[:, best]]), train_prices)
+        sizing = bootstrap(returns, kelly, resamples=1000, seed=0)
+        test_pnl = np.nan_to_num(test[1:] * delta_positions(test, delta)[1:, 0])
+        total, sharpe, drawdown = score(test_pnl)
+        result.update({
+            'delta_%s' % name: delta,
+            'f_%s' % name: sizing['estimate'],
+            'f_low_%s' % name: sizing['low'],
+            'f_high_%s' % name: sizing['high'],
+            'in_sample_%s' % name: train_pnl[:, best].sum(),
+            'result_%s' % name: total,
+            'sharpe_%s' % name: sharpe,
+            'drawdown_%s' % name: drawdown,
+        })
+    return result
+
+
+# Prices and price differences of every ticker, set once per worker process
+_WALK_STATE = {}
+
+
+def _init_walk_worker(state):
+    """
+    Pool initializer, so that the prices and their differences are sent to each worker only once
+    """
+    _WALK_STATE.update(state)
+
+
+def _run_fold(task):
+    """
+    :param task: tuple - (ticker, fold number, fold)
+    :return: dict - one row of the walk-forward results
+    """
+    ticker, number, fold = task
+    row = fit_and_score(_WALK_STATE['diffs'][ticker], _WALK_STATE['prices'][ticker], fold, _WALK_STATE['mr_deltas'],
+                        _WALK_STATE['bo_deltas'])
+    row.update({'ticker': ticker, 'fold': number, 'train_start': fold[0], 'train_end': fold[1],
+                'test_start': fold[2], 'test_end': fold[3]})
+    return row
+
+
+def walk_forward(prices, train_size, test_size, step=None, expanding=False, mr_deltas=MR_DELTAS,
+                 bo_deltas=BO_DELTAS, processes=None):
+    """
+    Walk-forward evaluation of every ticker
+    :param prices: pd.Series of a single ticker or pd.DataFrame (date x ticker) of prices, e.g. the Open
+    :param train_size: The number of dates of each train window, see make_folds
+    :param test_size: The number of dates of each test window
+    :param step: How far each fold moves forward, test_size by default
+    :param expanding: Whether the train windows all start at the first date instead of rolling forward
+    :param mr_deltas: The candidate Mean Reversion deltas
+    :param bo_deltas: The candidate Breakout deltas
+    :param processes: Number of worker processes, None for one per CPU and 1 to run in this process
+    :return: pd.DataFrame - one row per (ticker, fold) with the fitted parameters, the out-of-sample KPIs and the
+             dates of the test window
+    """
+    if isinstance(prices, pd.Series):
+        prices = prices.to_frame(prices.name if prices.name is not None else 'price')
+    diffs = {}
+    values_by_ticker = {}
+    dates = {}
+    tasks = []
+    for ticker in prices.columns:
+        series = prices[ticker].dropna().sort_index()
+        values = series.values.astype(np.float64)
+        diffs[ticker] = np.concatenate([[np.nan], np.diff(values)])
+        values_by_ticker[ticker] = values
+        dates[ticker] = series.index
+        for number, fold in enumerate(make_folds(len(values), train_size, test_size, step, expanding)):
+            tasks.append((ticker, number, fold))
+    state = {'diffs': diffs, 'prices': values_by_ticker, 'mr_deltas': tuple(mr_deltas),
+             'bo_deltas': tuple(bo_deltas)}
+
+    if processes == 1:
+        _init_walk_worker(state)
+        rows = [_run_fold(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(processes, initializer=_init_walk_worker, initargs=(state,))
+        try:
+            rows = pool.map(_run_fold, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    results = pd.DataFrame(rows)
+    if results.empty:
+        return results
+    results['test_from'] = [dates[ticker][start] for ticker, start in zip(results['ticker'], results['test_start'])]
+    results['test_to'] = [dates[ticker][end - 1] for ticker, end in zip(results['ticker'], results['test_end'])]
+    first = ['ticker', 'fold', 'train_start', 'train_end', 'test_start', 'test_end', 'test_from', 'test_to']
+    return results[first + sorted(column for column in results.columns if column not in first)]
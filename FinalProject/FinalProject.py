@@ -4,17 +4,28 @@ __license__ = 'MIT'
 __vcs_id__ = '$Id$'
 __version__ = '1.0.0'  # Versioning: http://www.python.org/dev/peps/pep-0386/
 
-from pandas_datareader import data as pdr  # The pandas Data Module used for fetching data from a Data Source
-import ffn
 import pandas as pd
+import os
+import sys
 import warnings  # For removing Deprication Warning w.r.t. Yahoo Finance Fix
+import multiprocessing  # For running the policy sweep in parallel
 import numpy as np  # For numerical operations
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))  # For the shared modules
+from common.indicators import ema, true_range  # Indicators of all the tickers at once
+from common.kpi import compute_kpis  # KPIs of all the tickers at once
+from common.market_data import default_store  # Local store of the daily bars
+from portfolio_array import FieldArray, PortfolioArray, PRICE_FIELDS, DIRECTION_SELL, DIRECTION_BUY
 
 
 with warnings.catch_warnings():
     warnings.simplefilter("ignore")
     from fix_yahoo_finance import pdr_override  # For overriding Pandas DataFrame Reader not connecting to YF
 
+try:
+    import numba  # Optional, compiles the PnL weighted sizing scan
+except ImportError:
+    numba = None
+
 
 def yahoo_finance_bridge():
     """
@@ -25,85 +36,93 @@ def yahoo_finance_bridge():
     pdr_override()
 
 
-def portfolio_calculations(port, prices_panel, period_policy, stages):
+# Zones of the yesterday's close w.r.t. the EMA band
+# 0 => below avg - band, 1 => between avg - band and avg
+# 2 => between avg and avg + band, 3 => everything else (above the band or on a boundary)
+ZONE_BELOW_BAND = 0
+ZONE_LOWER_BAND = 1
+ZONE_UPPER_BAND = 2
+ZONE_ABOVE_BAND = 3
+
+# Whether the stage progress carries on, indexed by [zone, old_direction + 1]
+# columns are old direction sell / none / buy
+_PROGRESS_CONTINUES = np.array([[True, False, False],
+                                [True, True, False],
+                                [False, True, True],
+                                [False, False, True]])
+
+
+def classify_zones(close, ema, atr):
+    """
+    Classify yesterday's close into one of the four zones around the EMA +/- 0.5 ATR band
+    :param close: ndarray (date x ticker) of Close prices
+    :param ema: ndarray (date x ticker) of the EMA
+    :param atr: ndarray (date x ticker) of the true range
+    :return: ndarray of int8 zone codes
+    """
+    yest_close = np.concatenate([close[:1], close[:-1]])
+    band = 0.5 * atr
+    zones = np.full(close.shape, ZONE_ABOVE_BAND, dtype=np.int8)
+    zones[(ema < yest_close) & (yest_close < ema + band)] = ZONE_UPPER_BAND
+    zones[(ema - band < yest_close) & (yest_close < ema)] = ZONE_LOWER_BAND
+    zones[yest_close < ema - band] = ZONE_BELOW_BAND
+    return zones
+
+
+def pyramid_states(zones, last_stage, init_direction=None, init_progress=None):
+    """
+    Runs the direction / progress state machine of the pyramid strategy for all tickers at once.
+    The direction only depends on the zone, and the progress is a run length of the days on which
+    the progress carries on, capped at the last stage of the pyramid
+    :param zones: ndarray (date x ticker) of zone codes from classify_zones
+    :param last_stage: The index of the last stage of the pyramid
+    :param init_direction: Direction codes of each ticker before the first date (defaults to none)
+    :param init_progress: Progress of each ticker before the first date (defaults to 0)
+    :return: tuple - (direction codes, progress) ndarrays of the same shape as zones
+    """
+    n_dates, n_tickers = zones.shape
+    if init_direction is None:
+        init_direction = np.zeros(n_tickers, dtype=np.int8)
+    if init_progress is None:
+        init_progress = np.zeros(n_tickers, dtype=np.int64)
+
+    direction = np.where(zones <= ZONE_LOWER_BAND, DIRECTION_SELL, DIRECTION_BUY).astype(np.int8)
+    old_direction = np.concatenate([np.asarray(init_direction, dtype=np.int8)[np.newaxis], direction[:-1]])
+    continues = _PROGRESS_CONTINUES[zones, old_direction + 1]
+
+    # position (1 based) of the last day the progress was reset to 0, or 0 if it never was
+    day = np.arange(1, n_dates + 1)[:, np.newaxis]
+    last_reset = np.maximum.accumulate(np.where(continues, 0, day), axis=0)
+    run = day - last_reset + np.where(last_reset == 0, np.asarray(init_progress, dtype=np.int64), 0)
+    progress = np.minimum(run, last_stage)
+    return direction, progress
+
+
+def portfolio_calculations(port, prices, period_policy, stages):
     """
     This function generates ema and atr and decisions to buy or sell based on those parameters
     """
 
     # period_policy 1 => ema of 21
     if period_policy == 1:
-        ema = prices_panel['Close'].ewm(21).mean()
+        port['ema'] = ema(prices['Close'], 21)
 
     # period_policy 2 or all other imply ema of 45 days
     else:
-        ema = prices_panel['Close'].ewm(45).mean()
-
-    port['ema'] = ema
-
-    # calcualte each cell direction and progress in stage of pyramid strategy
-    for ticker in prices_panel.minor_axis:
-        prev_date = prices_panel.major_axis[0]
-        for date in prices_panel.major_axis:
-            port.loc['atr', date, ticker] = \
-                max(prices_panel['High', date, ticker] - prices_panel['Low', date, ticker],
-                    abs(prices_panel['High', date, ticker] - prices_panel['Close', prev_date, ticker]),
-                    abs(prices_panel['Low', date, ticker] - prices_panel['Close', prev_date, ticker]))
-
-            yest_close = prices_panel['Close', prev_date, ticker]
-            avg = port['ema', date, ticker]
-            band = 0.5 * port['atr', date, ticker]
-
-            direction = 0
-            progress = 0
-            old_direction = port.loc['direction', prev_date, ticker]
-            old_progress = port.loc['progress', prev_date, ticker]
-
-            # if we are in lowest zone, we need to start selling
-            # if we are already selling, progress in stage
-            if yest_close < avg - band:
-                direction = 'sell'
-                if old_direction == 'sell':
-                    if old_progress < 4:
-                        progress = old_progress + 1
-                    else:
-                        progress = old_progress
-
-
-            # case where we should should stop buying
-            elif avg - band < yest_close < avg:
-                direction = 'sell'
-                if old_direction == 'buy':
-                    progress = 0  # by default but making it explicit
-
-                # if we were selling, increment progress
-                elif old_progress < 4:
-                    progress = old_progress + 1
-                else:
-                    progress = old_progress
-
-            # case when we should stop selling
-            elif avg < yest_close < avg + band:
-                direction = 'buy'
-                if old_direction == 'sell':
-                    progress = 0
-                elif old_progress < 4:
-                    progress = old_progress + 1
-                else:
-                    progress = old_progress
-
-            # case where we should start buying
-            else:
-                direction = 'buy'
-                if old_direction == 'buy':
-                    if old_progress < 4:
-                        progress = old_progress + 1
-                    else:
-                        progress = old_progress
-
-            port.loc['direction', date, ticker] = direction
-            port.loc['progress', date, ticker] = progress
-            port.loc['progress_percent', date, ticker] = stages[progress] / 100
-            prev_date = date
+        port['ema'] = ema(prices['Close'], 45)
+
+    # calculate direction and progress in stage of pyramid strategy for all tickers at once
+    atr = true_range(prices['High'], prices['Low'], prices['Close'])
+    zones = classify_zones(prices['Close'], port['ema'], atr)
+
+    # carry on from whatever state the first date holds (none for a fresh portfolio)
+    direction, progress = pyramid_states(zones, len(stages) - 1, port.direction[0],
+                                         port['progress'][0].astype(np.int64))
+
+    port['atr'] = atr
+    port.direction[:] = direction
+    port['progress'] = progress
+    port['progress_percent'] = np.asarray(stages)[progress] / 100.
 
     return port
 
@@ -143,26 +162,89 @@ def generate_portfolio():
 
     # Fix Pandas Datareader's Issues with Yahoo Finance (Since yahoo abandoned it's API)
     yahoo_finance_bridge()
-    prices_panel = pdr.get_data_yahoo(stock_list, start_date, end_date, as_panel=True, auto_adjust=False).fillna(0)
-    position = pd.DataFrame(data=0, index=prices_panel.major_axis, columns=prices_panel.minor_axis)
-    atr = pd.DataFrame(data=0, index=prices_panel.major_axis, columns=prices_panel.minor_axis)
-    direction = pd.DataFrame(data=0, index=prices_panel.major_axis, columns=prices_panel.minor_axis)
-    progress = pd.DataFrame(data=0, index=prices_panel.major_axis, columns=prices_panel.minor_axis)
-    progress_percent = pd.DataFrame(data=0, index=prices_panel.major_axis, columns=prices_panel.minor_axis)
-    target = pd.DataFrame(data=0, index=prices_panel.major_axis, columns=prices_panel.minor_axis)
-
-    port = pd.Panel({'price': prices_panel['Adj Close'],
-                     'pos': position,
-                     'atr': atr,
-                     'direction': direction,
-                     'progress': progress,
-                     'progress_percent': progress_percent,
-                     'target': target,
-                     })
-    return [port, prices_panel]
+    raw_prices = default_store(auto_adjust=False).get(stock_list, start_date, end_date).fillna(0)
+    prices = FieldArray.from_frames(raw_prices, PRICE_FIELDS)
 
+    port = PortfolioArray(prices.dates, prices.tickers)
+    port['price'] = prices['Adj Close']
+    return [port, prices]
 
-def position_sizing(port, policy):
+
+def _pnl_weighted_scan_numpy(price, atr, progress_percent, base_risk, pnl_risk_factor, num_instruments,
+                             target, pos):
+    """
+    Pure NumPy version of the PnL weighted sizing scan, it walks the dates once and updates all tickers at each step
+    """
+    cum_pnl = np.zeros(price.shape[1])
+    for date in range(price.shape[0]):
+        account_risk = base_risk + cum_pnl * pnl_risk_factor
+        risk_per_instrument = account_risk / num_instruments
+        target[date] = risk_per_instrument / atr[date]
+        pos[date] = target[date] * progress_percent[date]
+        cum_pnl += pos[date] * (price[date] - price[0])
+
+
+def _pnl_weighted_scan_loop(price, atr, progress_percent, base_risk, pnl_risk_factor, num_instruments,
+                            target, pos):
+    """
+    Scalar version of the PnL weighted sizing scan, only used when it can be compiled by Numba
+    """
+    for ticker in range(price.shape[1]):
+        cum_pnl = 0.0
+        for date in range(price.shape[0]):
+            account_risk = base_risk + cum_pnl * pnl_risk_factor
+            risk_per_instrument = account_risk / num_instruments
+            target[date, ticker] = risk_per_instrument / atr[date, ticker]
+            pos[date, ticker] = target[date, ticker] * progress_percent[date, ticker]
+            cum_pnl += pos[date, ticker] * (price[date, ticker] - price[0, ticker])
+
+
+if numba is not None:
+    _pnl_weighted_scan_kernel = numba.njit(cache=True, error_model='numpy')(_pnl_weighted_scan_loop)
+else:
+    _pnl_weighted_scan_kernel = _pnl_weighted_scan_numpy
+
+
+def pnl_weighted_scan(price, atr, progress_percent, base_risk, pnl_risk_factor, num_instruments, chunk_size=4096):
+    """
+    Constant risk sizing where the account risk grows with the cumulative PnL of each ticker.
+    The PnL feeds back into the size, so this is a linear recurrence along the dates, run as a single scan
+    (compiled with Numba when it is installed). Tickers are scanned in chunks so that the working memory stays
+    bounded however large the universe is
+    :param price: ndarray (date x ticker) of Adj Close prices
+    :param atr: ndarray (date x ticker) of the true range
+    :param progress_percent: ndarray (date x ticker) of the percentage of the target reached in the pyramid
+    :param base_risk: The account risk before any PnL
+    :param pnl_risk_factor: The weight of the cumulative PnL in the account risk
+    :param num_instruments: The number of instruments the account risk is split across
+    :param chunk_size: The number of tickers scanned at once
+    :return: tuple - (target, pos) ndarrays
+    """
+    target = np.empty(price.shape)
+    pos = np.empty(price.shape)
+    for first in range(0, price.shape[1], chunk_size):
+        columns = slice(first, first + chunk_size)
+        chunk_target = np.empty(price[:, columns].shape)
+        chunk_pos = np.empty(price[:, columns].shape)
+        _pnl_weighted_scan_kernel(np.ascontiguousarray(price[:, columns], dtype=np.float64),
+                                  np.ascontiguousarray(atr[:, columns], dtype=np.float64),
+                                  np.ascontiguousarray(progress_percent[:, columns], dtype=np.float64),
+                                  float(base_risk), float(pnl_risk_factor), float(num_instruments),
+                                  chunk_target, chunk_pos)
+        target[:, columns] = chunk_target
+        pos[:, columns] = chunk_pos
+    return target, pos
+
+
+def size_positions(price, atr, progress_percent, policy):
+    """
+    Computes the target and the position sizes for (date x ticker) arrays
+    :param price: ndarray of Adj Close prices
+    :param atr: ndarray of the true range
+    :param progress_percent: ndarray of the percentage of the target reached in the pyramid
+    :param policy: The position sizing policy (1, 2 or 3)
+    :return: tuple - (target, pos) ndarrays
+    """
     # policy 1 => constant risk sizing, seems to be no cap on AUM
     if policy == 1:
         AUM = 1000000
@@ -170,8 +252,8 @@ def position_sizing(port, policy):
         account_risk = AUM * aum_risk_factor
         num_instruments = 10
         risk_per_instrument = account_risk / num_instruments
-        port['target'] = risk_per_instrument / port['atr']
-        port['pos'] = port['target'] * port['progress_percent']
+        target = risk_per_instrument / atr
+        pos = target * progress_percent
 
     # policy 2 => constant risk sizing
     # with different weight to PNL
@@ -179,18 +261,10 @@ def position_sizing(port, policy):
         AUM = 1000000
         aum_risk_factor = 0.20
         pnl_risk_factor = 0.50
+        num_instruments = 10
 
-        for ticker in port.minor_axis:
-            prev_date = port.major_axis[0]
-            cum_pnl = 0
-            for date in port.major_axis:
-                account_risk = AUM * aum_risk_factor + cum_pnl * pnl_risk_factor
-                num_instruments = 10
-                risk_per_instrument = account_risk / num_instruments
-                port['target', date, ticker] = risk_per_instrument / port['atr', date, ticker]
-                port['pos', date, ticker] = port['target', date, ticker] * port['progress_percent', date, ticker]
-                cum_pnl += port['pos', date, ticker] * \
-                           (port['price', date, ticker] - port['price', prev_date, ticker])
+        target, pos = pnl_weighted_scan(price, atr, progress_percent, AUM * aum_risk_factor, pnl_risk_factor,
+                                        num_instruments)
 
     # policy 3 => combination of constant risk and fixed weight
     else:
@@ -199,21 +273,129 @@ def position_sizing(port, policy):
         account_risk = AUM * aum_risk_factor
         num_instruments = 10
         risk_per_instrument = account_risk / num_instruments
-        atr_target = risk_per_instrument / port['atr']
-        price_target = risk_per_instrument / port['price']
-        port['target'] = atr_target.where(price_target < atr_target, price_target).fillna(atr_target)
-        port['pos'] = port['target'] * port['progress_percent']
+        atr_target = risk_per_instrument / atr
+        price_target = risk_per_instrument / price
+        target = np.where(price_target < atr_target, atr_target, price_target)
+        target = np.where(np.isnan(target), atr_target, target)
+        pos = target * progress_percent
+
+    return target, pos
 
+
+def position_sizing(port, policy):
+    """
+    Sizes the positions of the portfolio in place, see size_positions for the policies
+    """
+    port['target'], port['pos'] = size_positions(port['price'], port['atr'], port['progress_percent'], policy)
     return port
 
 
 def find_kpi(port_new):
     """ Find KPIs of the portfolio"""
-    p = port_new['pos']
-    for col in p.columns:
+    kpis = position_kpis(port_new.frame('pos'))
+    for col in kpis.index:
         print('Calculating for %s' % col)
-        print(p[col].replace(0, np.nan).dropna(how='all').calc_stats().display())
-        print('Max Drawdown: %s' % str(p[col].replace(0, np.nan).dropna(how='all').calc_max_drawdown()))
+        print(kpis.loc[col].to_string())
+        print('Max Drawdown: %s' % str(kpis.loc[col, 'max_drawdown']))
+
+
+def position_kpis(pos):
+    """
+    KPIs of the positions of every ticker, the dates without a position are left out
+    :param pos: pd.DataFrame - date x ticker of the positions
+    :return: pd.DataFrame - one row of KPIs per ticker (all NaN if the ticker never had a position)
+    """
+    return compute_kpis(pos.replace(0, np.nan))
+
+
+# Intermediates shared by all the configurations of a sweep, set once per worker process
+_SWEEP_STATE = {}
+
+
+def _init_sweep_worker(state):
+    """
+    Pool initializer, so that the shared intermediates are sent to each worker only once
+    """
+    _SWEEP_STATE.update(state)
+
+
+def precompute_sweep(prices, ema_periods, last_stage):
+    """
+    Computes everything that does not depend on the pyramid or the sizing policy. The true range is computed
+    once, the EMA, zones and progress of the pyramid once per EMA period
+    :param prices: The prices from generate_portfolio
+    :param ema_periods: The EMA periods to sweep over
+    :param last_stage: The index of the last stage of the longest pyramid in the sweep
+    :return: dict - the shared state of the sweep
+    """
+    atr = true_range(prices['High'], prices['Low'], prices['Close'])
+    progress = {}
+    for period in ema_periods:
+        _, progress[period] = pyramid_states(classify_zones(prices['Close'], ema(prices['Close'], period), atr),
+                                             last_stage)
+    return {
+        'dates': prices.dates,
+        'tickers': prices.tickers,
+        'price': prices['Adj Close'],
+        'atr': atr,
+        'progress': progress,
+    }
+
+
+def _evaluate_config(config):
+    """
+    Sizes the positions of a single (EMA period, pyramid, sizing policy) configuration and finds its KPIs
+    :param config: tuple - (period, pyramid name, stages, policy)
+    :return: list - one dict of KPIs per ticker
+    """
+    period, pyramid, stages, policy = config
+    state = _SWEEP_STATE
+    # progress was capped at the longest pyramid, which caps the same way for the shorter ones
+    progress = np.minimum(state['progress'][period], len(stages) - 1)
+    _, pos = size_positions(state['price'], state['atr'], np.asarray(stages)[progress] / 100., policy)
+
+    kpis = position_kpis(pd.DataFrame(pos, index=state['dates'], columns=state['tickers']))
+    rows = []
+    for ticker, ticker_kpis in kpis.iterrows():
+        row = {'period': period, 'pyramid': pyramid, 'sizing': policy, 'ticker': ticker}
+        row.update(ticker_kpis.to_dict())
+        rows.append(row)
+    return rows
+
+
+def run_sweep(prices, pyramids, ema_periods=(21, 45), sizing_policies=(1, 2, 3), processes=None):
+    """
+    Runs the grid of pyramid x EMA period x position sizing configurations.
+    Shared intermediates are computed once, then the configurations are fanned out over a process pool
+    :param prices: The prices from generate_portfolio
+    :param pyramids: dict - pyramid name => stages (see generate_pyramid)
+    :param ema_periods: The EMA periods to sweep over
+    :param sizing_policies: The position sizing policies to sweep over (see size_positions)
+    :param processes: Number of worker processes, None for one per CPU and 1 to run in this process
+    :return: pd.DataFrame - one row of KPIs per configuration and ticker
+    """
+    last_stage = max(len(stages) for stages in pyramids.values()) - 1
+    state = precompute_sweep(prices, ema_periods, last_stage)
+    configs = [(period, pyramid, stages, policy)
+               for pyramid, stages in pyramids.items()
+               for period in ema_periods
+               for policy in sizing_policies]
+
+    if processes == 1:
+        _init_sweep_worker(state)
+        results = [_evaluate_config(config) for config in configs]
+    else:
+        pool = multiprocessing.Pool(processes, initializer=_init_sweep_worker, initargs=(state,))
+        try:
+            results = pool.map(_evaluate_config, configs)
+        finally:
+            pool.close()
+            pool.join()
+
+    rows = [row for config_rows in results for row in config_rows]
+    table = pd.DataFrame(rows)
+    keys = ['pyramid', 'period', 'sizing', 'ticker']
+    return table[keys + [column for column in table.columns if column not in keys]]
 
 
 def main():
@@ -227,31 +409,29 @@ def main():
         60% insample to determine above cases, 20% out of sample for KPIs
     :return: nothing
     """
-    [port, prices_panel] = generate_portfolio()
+    prices = generate_portfolio()[1]
     pyramid_dict = {
         1: 'Upright Pyramid',
         2: 'Inverted Pyramid',
         3: 'Reflective Pyramid'
     }
     period_policy_dict = {
-        1: 'EMA of 21',
-        2: 'EMA of 45'
+        21: 'EMA of 21',
+        45: 'EMA of 45'
     }
     position_sizing_dict = {
         1: 'Constant Risk Sizing, No cap to AUM',
         2: 'Constant Risk Sizing, Different Weight to PNL',
         3: 'Combination of Constant Risk and Fixed Weight'
     }
-    for pyramid_policy in range(1, 4):
-        stages = generate_pyramid(pyramid_policy)
-        for period_policy in range(1, 3):
-            port_new = portfolio_calculations(port, prices_panel, period_policy, stages)
-            for positions_policy in range(1, 4):
-                port_new = position_sizing(port_new, positions_policy)
-                print('\n')
-                print("Pyramid type = %s, Period type = %s, Position sizing type = %s" %
-                      (pyramid_dict[pyramid_policy], period_policy_dict[period_policy], position_sizing_dict[positions_policy]))
-                find_kpi(port_new)
+    pyramids = dict((pyramid_dict[pyramid_policy], generate_pyramid(pyramid_policy)) for pyramid_policy in range(1, 4))
+    results = run_sweep(prices, pyramids, ema_periods=sorted(period_policy_dict),
+                        sizing_policies=sorted(position_sizing_dict))
+    for (pyramid, period, sizing), kpis in results.groupby(['pyramid', 'period', 'sizing']):
+        print('\n')
+        print("Pyramid type = %s, Period type = %s, Position sizing type = %s" %
+              (pyramid, period_policy_dict[period], position_sizing_dict[sizing]))
+        print(kpis.drop(['pyramid', 'period', 'sizing'], axis=1).set_index('ticker').T.to_string())
 
 
 if __name__ == '__main__':
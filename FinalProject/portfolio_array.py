@@ -0,0 +1,120 @@
+# Some Metadata about the script
+__author__ = 'Osama Iqbal (iqbal.osama@icloud.com)'
+__license__ = 'MIT'
+__vcs_id__ = '$Id$'
+__version__ = '1.0.0'  # Versioning: http://www.python.org/dev/peps/pep-0386/
+
+import numpy as np  # For numerical operations
+import pandas as pd
+
+# Direction codes of the pyramid strategy, stored as int8
+DIRECTION_SELL = -1
+DIRECTION_NONE = 0
+DIRECTION_BUY = 1
+DIRECTION_LABELS = {DIRECTION_SELL: 'sell', DIRECTION_NONE: '', DIRECTION_BUY: 'buy'}
+
+PRICE_FIELDS = ('Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume')
+PORTFOLIO_FIELDS = ('price', 'pos', 'atr', 'ema', 'progress', 'progress_percent', 'target')
+
+
+class FieldArray(object):
+    """
+    A (field x date x ticker) block of float64 values with named field and ticker lookups.
+    This replaces the pandas Panel, each field is a contiguous (date x ticker) slice of the block
+    """
+
+    def __init__(self, fields, dates, tickers, values=None):
+        """
+        :param fields: The names of the fields
+        :param dates: The dates, i.e. the rows of each field
+        :param tickers: The tickers, i.e. the columns of each field
+        :param values: Optional ndarray of shape (field, date, ticker), zeros by default
+        """
+        self.fields = tuple(fields)
+        self.dates = pd.Index(dates)
+        self.tickers = pd.Index(tickers)
+        self._field_index = dict((field, index) for index, field in enumerate(self.fields))
+        shape = (len(self.fields), len(self.dates), len(self.tickers))
+        if values is None:
+            self.values = np.zeros(shape)
+        else:
+            self.values = np.ascontiguousarray(values, dtype=np.float64)
+            if self.values.shape != shape:
+                raise ValueError('Values of shape %s do not match %s' % (str(self.values.shape), str(shape)))
+
+    @classmethod
+    def from_frames(cls, frames, fields=None):
+        """
+        Builds the block from (date x ticker) DataFrames, aligned on the dates and tickers of the first one
+        :param frames: dict-like of field => pd.DataFrame (a dict, a Panel or a DataFrame with field columns)
+        :param fields: The fields to take from frames, all of the keys of a dict by default
+        :return: FieldArray
+        """
+        if fields is None:
+            fields = list(frames.keys())
+        first = frames[fields[0]]
+        values = np.empty((len(fields), len(first.index), len(first.columns)))
+        for index, field in enumerate(fields):
+            values[index] = frames[field].reindex(index=first.index, columns=first.columns).values
+        return cls(fields, first.index, first.columns, values)
+
+    def field(self, field):
+        """
+        :param field: The name of the field
+        :return: int - The position of the field in the block
+        """
+        try:
+            return self._field_index[field]
+        except KeyError:
+            raise KeyError('Unknown field %s, expected one of %s' % (field, ', '.join(self.fields)))
+
+    def ticker(self, ticker):
+        """
+        :param ticker: The ticker symbol
+        :return: int - The column of the ticker in each field
+        """
+        return self.tickers.get_loc(ticker)
+
+    def __getitem__(self, field):
+        """
+        :return: ndarray - A (date x ticker) view of the field
+        """
+        return self.values[self.field(field)]
+
+    def __setitem__(self, field, value):
+        if isinstance(value, pd.DataFrame):
+            value = value.values
+        self.values[self.field(field)] = value
+
+    def frame(self, field):
+        """
+        A DataFrame over the field for reporting, it shares its memory with the block
+        :param field: The name of the field
+        :return: pd.DataFrame
+        """
+        return pd.DataFrame(self[field], index=self.dates, columns=self.tickers, copy=False)
+
+    def series(self, field, ticker):
+        """
+        :return: pd.Series - The values of a single ticker, a view into the block
+        """
+        return pd.Series(self[field][:, self.ticker(ticker)], index=self.dates, name=ticker, copy=False)
+
+
+class PortfolioArray(FieldArray):
+    """
+    The portfolio of the pyramid strategy: the float fields in the block plus the int8 coded direction
+    """
+
+    def __init__(self, dates, tickers, fields=PORTFOLIO_FIELDS):
+        super(PortfolioArray, self).__init__(fields, dates, tickers)
+        self.direction = np.zeros((len(self.dates), len(self.tickers)), dtype=np.int8)
+
+    def direction_frame(self):
+        """
+        The direction decoded to 'buy' / 'sell' labels, for reporting
+        :return: pd.DataFrame
+        """
+        labels = np.array([DIRECTION_LABELS[DIRECTION_SELL], DIRECTION_LABELS[DIRECTION_NONE],
+                           DIRECTION_LABELS[DIRECTION_BUY]], dtype=object)
+        return pd.DataFrame(labels[self.direction + 1], index=self.dates, columns=self.tickers)
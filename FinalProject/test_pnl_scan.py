@@ -0,0 +1,80 @@
+"""
+Regression test of the PnL weighted sizing scan (policy 2) against the per-cell loop it replaced
+"""
+import numpy as np
+import pytest
+import FinalProject
+
+BASE_RISK = 1000000 * 0.20
+PNL_RISK_FACTOR = 0.50
+NUM_INSTRUMENTS = 10
+
+
+def legacy_scan(price, atr, progress_percent):
+    """
+    The per-cell loop of size_positions before the scan, kept as the reference
+    """
+    AUM = 1000000
+    aum_risk_factor = 0.20
+    pnl_risk_factor = 0.50
+    num_instruments = 10
+
+    target = np.empty(price.shape)
+    pos = np.empty(price.shape)
+    for ticker in range(price.shape[1]):
+        prev_date = 0
+        cum_pnl = 0
+        for date in range(price.shape[0]):
+            account_risk = AUM * aum_risk_factor + cum_pnl * pnl_risk_factor
+            risk_per_instrument = account_risk / num_instruments
+            target[date, ticker] = risk_per_instrument / atr[date, ticker]
+            pos[date, ticker] = target[date, ticker] * progress_percent[date, ticker]
+            cum_pnl += pos[date, ticker] * (price[date, ticker] - price[prev_date, ticker])
+    return target, pos
+
+
+def random_inputs(dates=300, tickers=11, seed=0):
+    """
+    :return: tuple - (price, atr, progress_percent) with a zero ATR and NaN prices in some of the tickers
+    """
+    random = np.random.RandomState(seed)
+    price = 100 * np.exp(np.cumsum(random.randn(dates, tickers) * 0.01, axis=0))
+    atr = np.abs(random.randn(dates, tickers)) + 0.1
+    progress_percent = random.choice([0.0, 0.25, 0.5, 0.75, 1.0], size=(dates, tickers))
+    atr[10, 1] = 0
+    atr[20:25, 2] = 0
+    price[50:60, 3] = np.nan
+    price[0, 4] = np.nan
+    return price, atr, progress_percent
+
+
+def kernels():
+    """
+    :return: list - the NumPy scan, and the Numba kernel when Numba is installed
+    """
+    found = [pytest.param(FinalProject._pnl_weighted_scan_numpy, id='numpy')]
+    if FinalProject.numba is not None:
+        found.append(pytest.param(FinalProject._pnl_weighted_scan_kernel, id='numba'))
+    return found
+
+
+@pytest.mark.parametrize('kernel', kernels())
+@pytest.mark.parametrize('chunk_size', [4096, 4])
+def test_scan_matches_legacy_loop(monkeypatch, kernel, chunk_size):
+    price, atr, progress_percent = random_inputs()
+    monkeypatch.setattr(FinalProject, '_pnl_weighted_scan_kernel', kernel)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected_target, expected_pos = legacy_scan(price, atr, progress_percent)
+        target, pos = FinalProject.pnl_weighted_scan(price, atr, progress_percent, BASE_RISK, PNL_RISK_FACTOR,
+                                                     NUM_INSTRUMENTS, chunk_size=chunk_size)
+    np.testing.assert_allclose(target, expected_target, rtol=1e-12)
+    np.testing.assert_allclose(pos, expected_pos, rtol=1e-12)
+
+
+def test_size_positions_policy_2_matches_legacy_loop():
+    price, atr, progress_percent = random_inputs(dates=50, tickers=5, seed=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected_target, expected_pos = legacy_scan(price, atr, progress_percent)
+        target, pos = FinalProject.size_positions(price, atr, progress_percent, 2)
+    np.testing.assert_allclose(target, expected_target, rtol=1e-12)
+    np.testing.assert_allclose(pos, expected_pos, rtol=1e-12)
@@ -0,0 +1,3 @@
+"""
+Modules shared by the assignments and the final project
+"""
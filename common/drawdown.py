@@ -0,0 +1,158 @@
+"""
+Rolling drawdowns of many portfolios and window lengths, in time linear in the number of dates.
+
+The rolling maximum (and minimum) over a window is computed with the van Herk / Gil-Werman algorithm: the dates are
+cut into blocks of the window length, and the running maximum is accumulated forward and backward inside each block.
+Every window then spans the end of one block and the start of the next, so its maximum is the larger of one backward
+and one forward running maximum. That is three comparisons per date whatever the window, done with array operations
+on all the columns at once. The position of each maximum is tracked alongside it, which gives the start (the peak)
+and the trough of the drawdowns. Like pandas' rolling(window, min_periods=1), NaNs are skipped and the first windows
+are truncated at the first date
+"""
+import numpy as np
+
+
+def _latest_record(values, running, strict):
+    """
+    Within each block, the latest position where the running maximum was set
+    :param values: ndarray (block x date x column)
+    :param running: ndarray - the running maximum of values along the date axis
+    :param strict: Whether a value equal to the running maximum before it sets a new one
+    :return: ndarray of int - the position in the block, -1 while there is no known value
+    """
+    dates = np.arange(values.shape[1]).reshape(1, -1, 1)
+    if strict:
+        before = np.full(running.shape, -np.inf)
+        before[:, 1:] = np.where(np.isnan(running[:, :-1]), -np.inf, running[:, :-1])
+        records = values > before
+    else:
+        records = values == running
+    return np.maximum.accumulate(np.where(records, dates, -1), axis=1)
+
+
+def rolling_max(values, window):
+    """
+    Maximum over a trailing window, with its position
+    :param values: ndarray (date x column) with NaN for the missing values
+    :param window: The number of dates in the window, the current one included
+    :return: tuple of ndarrays (date x column) - the maximum (NaN if the window has no known value), and the row of
+             its latest occurrence (-1 if the window has no known value)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    dates, columns = values.shape
+    blocks = -(-dates // window)
+    padded = np.full((blocks * window, columns), np.nan)
+    padded[:dates] = values
+    padded = padded.reshape(blocks, window, columns)
+    offsets = (np.arange(blocks) * window).reshape(-1, 1, 1)
+
+    # Running maximum from the start of each block up to each date
+    forward = np.fmax.accumulate(padded, axis=1)
+    forward_at = _latest_record(padded, forward, strict=False)
+    forward_at = np.where(forward_at < 0, -1, forward_at + offsets).reshape(-1, columns)[:dates]
+    forward = forward.reshape(-1, columns)[:dates]
+
+    # Running maximum from each date to the end of its block. On the reversed block, the first occurrence of the
+    # maximum is the latest one in date order
+    backward = np.fmax.accumulate(padded[:, ::-1], axis=1)
+    backward_at = _latest_record(padded[:, ::-1], backward, strict=True)
+    backward_at = np.where(backward_at < 0, -1, window - 1 - backward_at + offsets)[:, ::-1]
+    backward_at = backward_at.reshape(-1, columns)[:dates]
+    backward = backward[:, ::-1].reshape(-1, columns)[:dates]
+
+    # The first window - 1 dates see a truncated window, which is the start of the first block
+    maximum = forward.copy()
+    maximum_at = forward_at.copy()
+    if dates >= window:
+        ends = np.arange(window - 1, dates)
+        head = backward[ends - window + 1]
+        tail = forward[ends]
+        # On a tie the forward part holds the latest occurrence
+        use_tail = (tail >= head) | np.isnan(head)
+        maximum[ends] = np.where(use_tail, tail, head)
+        maximum_at[ends] = np.where(use_tail, forward_at[ends], backward_at[ends - window + 1])
+    return maximum, maximum_at
+
+
+def rolling_min(values, window):
+    """
+    Minimum over a trailing window, with its position
+    :param values: ndarray (date x column) with NaN for the missing values
+    :param window: The number of dates in the window, the current one included
+    :return: tuple of ndarrays (date x column) - see rolling_max
+    """
+    maximum, maximum_at = rolling_max(-np.asarray(values, dtype=np.float64), window)
+    return -maximum, maximum_at
+
+
+def rolling_drawdown(values, windows=(252,)):
+    """
+    Drawdowns from the peak of a trailing window, and the worst of them over the same window
+    :param values: ndarray (date,) or (date x portfolio) of the portfolio values, NaN where unknown
+    :param windows: The window lengths, in dates
+    :return: dict of ndarrays (date x portfolio x window):
+             drawdown - the value over the highest value of the window, minus 1
+             peak - the row of that highest value, where the drawdown started
+             max_drawdown - the lowest drawdown of the window
+             trough - the row of that lowest drawdown
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1:
+        values = values.reshape(-1, 1)
+    shape = values.shape + (len(windows),)
+    result = {
+        'drawdown': np.empty(shape),
+        'peak': np.empty(shape, dtype=np.int64),
+        'max_drawdown': np.empty(shape),
+        'trough': np.empty(shape, dtype=np.int64),
+    }
+    for number, window in enumerate(windows):
+        peaks, result['peak'][:, :, number] = rolling_max(values, window)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            drawdown = values / peaks - 1.0
+        result['drawdown'][:, :, number] = drawdown
+        result['max_drawdown'][:, :, number], result['trough'][:, :, number] = rolling_min(drawdown, window)
+    return result
+
+
+def worst_drawdowns(values, windows=(252,), drawdowns=None):
+    """
+    The worst rolling drawdown of each portfolio over the whole history, with its start, trough and recovery
+    :param values: ndarray (date,) or (date x portfolio) of the portfolio values, NaN where unknown
+    :param windows: The window lengths, in dates
+    :param drawdowns: The result of rolling_drawdown for the same values and windows, computed if not given
+    :return: dict of ndarrays (portfolio x window):
+             max_drawdown - the worst drawdown, NaN if the portfolio has no known value
+             start - the row of the peak it is measured from
+             trough - the row where it is reached
+             recovery - the first row after the trough where the value is back at the peak, -1 if it never is
+             The rows are -1 if the portfolio has no known value
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1:
+        values = values.reshape(-1, 1)
+    if drawdowns is None:
+        drawdowns = rolling_drawdown(values, windows)
+    dates, portfolios = values.shape
+    shape = (portfolios, len(windows))
+    result = {
+        'max_drawdown': np.full(shape, np.nan),
+        'start': np.full(shape, -1, dtype=np.int64),
+        'trough': np.full(shape, -1, dtype=np.int64),
+        'recovery': np.full(shape, -1, dtype=np.int64),
+    }
+    columns = np.arange(portfolios)
+    rows = np.arange(dates).reshape(-1, 1)
+    for number in range(len(windows)):
+        drawdown = drawdowns['drawdown'][:, :, number]
+        known = ~np.isnan(drawdown)
+        found = known.any(axis=0)
+        trough = np.where(known, drawdown, np.inf).argmin(axis=0)
+        start = drawdowns['peak'][trough, columns, number]
+        back = (rows > trough) & (values >= values[start, columns])
+        recovered = found & back.any(axis=0)
+        result['max_drawdown'][found, number] = drawdown[trough, columns][found]
+        result['start'][found, number] = start[found]
+        result['trough'][found, number] = trough[found]
+        result['recovery'][recovered, number] = back.argmax(axis=0)[recovered]
+    return result
@@ -0,0 +1,439 @@
+"""
+Streaming indicators shared by the assignments and the final project: SMA, rolling sum and standard deviation,
+EMA, true range, ATR and rolling volatility.
+
+Each indicator is an object holding just the state it needs to carry on: the last window - 1 rows for the rolling
+ones, the running sums for the EMA, the previous close or price for the others. New bars are appended to it, one
+date at a time (update) or as a block of dates (append), and each append costs O(new bars + window) whatever the
+length of the history already seen. All the objects work on many tickers at once, a (date x ticker) block is
+computed with array operations on every column, and the batch functions (sma, ema, ...) are a fresh object fed the
+whole history. The results are those of the pandas equivalents (rolling, ewm) up to rounding
+"""
+import numpy as np
+import pandas as pd
+from common.signals import forward_fill
+
+CHUNK_ROWS = 65536
+SHORT_BLOCK = 16
+
+
+def _as_block(values, columns):
+    """
+    :return: tuple - (ndarray (date x column), the shape the results are returned in)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 2:
+        return values, values.shape
+    return values.reshape(-1, columns), values.shape
+
+
+def _last(results, columns):
+    """
+    The results of the last date, a float for a single column
+    """
+    return results[-1, 0] if columns == 1 else results[-1]
+
+
+class _Rolling(object):
+    """
+    Base of the indicators computed from the sums of a trailing window
+    """
+
+    def __init__(self, window, min_periods=None, columns=1, chunk_rows=CHUNK_ROWS):
+        """
+        :param window: The number of dates in the window, the current one included
+        :param min_periods: The number of known values needed in the window, window by default
+        :param columns: The number of tickers
+        :param chunk_rows: Appends are computed over chunks of at most this many dates, which bounds the rounding
+                           error of the running sums
+        """
+        self.window = window
+        self.min_periods = window if min_periods is None else min_periods
+        self.columns = columns
+        self.chunk_rows = max(chunk_rows, window)
+        self._tail = np.empty((0, columns))
+        self.value = np.full(columns, np.nan)
+
+    def _sums(self, block):
+        """
+        The count, sum and sum of squares of the known values of the window ending on each date of a block
+        :param block: ndarray (date x column)
+        :return: tuple - (count, sum, sum of squares, shift) where the sums are of the values minus shift
+        """
+        data = np.concatenate([self._tail, block])
+        self._tail = data[max(len(data) - self.window + 1, 0):] if self.window > 1 else data[:0]
+        rows, columns = data.shape
+        window = self.window
+        known = ~np.isnan(data)
+
+        # The values are summed around a reference per piece of window dates (the first known value of the piece),
+        # so that the sums stay small even when the values drift far over the history
+        pieces = -(-rows // window)
+        padded = np.full((pieces * window, columns), np.nan)
+        padded[:rows] = data
+        padded = padded.reshape(pieces, window, columns)
+        first = (~np.isnan(padded)).argmax(axis=1)
+        reference = padded[np.arange(pieces).reshape(-1, 1), first, np.arange(columns)]
+        shift = np.repeat(np.nan_to_num(forward_fill(reference)), window, axis=0)[:rows]
+        centered = np.where(known, data - shift, 0)
+        running = []
+        for part in (known, centered, centered * centered):
+            total = np.zeros((rows + 1, columns))
+            np.cumsum(part, axis=0, out=total[1:])
+            running.append(total)
+
+        # A window spans the end of one piece (A) and the start of the next (B), the sums of A are moved to the
+        # reference of B
+        ends = np.arange(rows - len(block), rows)
+        starts = np.maximum(ends - window + 1, 0)
+        boundary = np.maximum(ends // window * window, starts)
+        count_a, sum_a, squares_a = [total[boundary] - total[starts] for total in running]
+        count_b, sum_b, squares_b = [total[ends + 1] - total[boundary] for total in running]
+        gap = shift[starts] - shift[ends]
+        count = count_a + count_b
+        sums = sum_b + sum_a + count_a * gap
+        squares = squares_b + squares_a + 2 * gap * sum_a + count_a * gap * gap
+        return count, sums, squares, shift[ends]
+
+    def _compute(self, count, sums, squares, shift):
+        raise NotImplementedError
+
+    def append(self, values):
+        """
+        Consumes a block of dates
+        :param values: ndarray (date,) for a single ticker or (date x ticker)
+        :return: ndarray of the same shape - the indicator on each of the dates
+        """
+        block, shape = _as_block(values, self.columns)
+        results = np.empty(block.shape)
+        for first in range(0, len(block), self.chunk_rows):
+            chunk = block[first:first + self.chunk_rows]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                results[first:first + len(chunk)] = self._compute(*self._sums(chunk))
+        if len(results):
+            self.value = results[-1]
+        return results.reshape(shape)
+
+    def update(self, values):
+        """
+        Consumes one date
+        :param values: The value of each ticker, a scalar for a single ticker
+        :return: The indicator after the date, a float for a single ticker
+        """
+        return _last(self.append(np.reshape(values, (1, self.columns))), self.columns)
+
+
+class SMA(_Rolling):
+    """
+    Simple moving average, like rolling(window, min_periods).mean()
+    """
+
+    def _compute(self, count, sums, squares, shift):
+        return np.where(count >= max(self.min_periods, 1), sums / count + shift, np.nan)
+
+
+class RollingSum(_Rolling):
+    """
+    Sum over a trailing window, like rolling(window, min_periods).sum()
+    """
+
+    def _compute(self, count, sums, squares, shift):
+        return np.where(count >= max(self.min_periods, 1), sums + count * shift, np.nan)
+
+
+class RollingStd(_Rolling):
+    """
+    Standard deviation over a trailing window, like rolling(window, min_periods).std()
+    """
+
+    def __init__(self, window, min_periods=None, columns=1, ddof=1, chunk_rows=CHUNK_ROWS):
+        """
+        :param ddof: The delta degrees of freedom, the variance is divided by the count minus ddof
+        """
+        _Rolling.__init__(self, window, min_periods, columns, chunk_rows)
+        self.ddof = ddof
+
+    def _compute(self, count, sums, squares, shift):
+        variance = np.maximum(squares - sums * sums / count, 0) / (count - self.ddof)
+        return np.where((count >= max(self.min_periods, 1)) & (count > self.ddof), np.sqrt(variance), np.nan)
+
+
+def _decayed_sums(terms, start, alpha):
+    """
+    The recurrence s = (1 - alpha) * s + term along the dates, run as one exponentially weighted mean
+    :param terms: ndarray (date x column) without NaN
+    :param start: ndarray (column,) - the sums before the first date
+    :param alpha: The smoothing factor
+    :return: ndarray (date x column)
+    """
+    if len(terms) <= SHORT_BLOCK:
+        # A few new dates are cheaper to step through than to hand over to pandas
+        sums = np.empty(terms.shape)
+        for date in range(len(terms)):
+            start = (1 - alpha) * start + terms[date]
+            sums[date] = start
+        return sums
+    scaled = np.concatenate([start.reshape(1, -1), terms / alpha])
+    return pd.DataFrame(scaled).ewm(alpha=alpha, adjust=False).mean().values[1:]
+
+
+def _recursive_means(block, average, decay, alpha):
+    """
+    The recursive (adjust=False) average of pandas ewm, stepped through the dates. On each known value
+    average = (decay * average + alpha * value) / (decay + alpha), where decay is 1 - alpha to the power of the number
+    of dates since the previous known value, so the weight of the past is reset after each known value
+    :param block: ndarray (date x column)
+    :param average: ndarray (column,) - the average before the first date, NaN before the first known value
+    :param decay: ndarray (column,) - the decay of the average since its last known value
+    :return: tuple - (ndarray (date x column) of the averages, the average and the decay after the last date)
+    """
+    results = np.empty(block.shape)
+    for date in range(len(block)):
+        values = block[date]
+        known = ~np.isnan(values)
+        started = ~np.isnan(average)
+        decay = np.where(started, decay * (1 - alpha), decay)
+        changed = known & started & (average != values)
+        with np.errstate(invalid='ignore'):
+            average = np.where(changed, (decay * average + alpha * values) / (decay + alpha), average)
+        average = np.where(known & ~started, values, average)
+        decay = np.where(known, 1.0, decay)
+        results[date] = average
+    return results, average, decay
+
+
+class EMA(object):
+    """
+    Exponential moving average, like ewm(com=com, adjust=adjust).mean(), including after unknown values
+    """
+
+    def __init__(self, com, adjust=True, columns=1):
+        """
+        :param com: The center of mass, alpha = 1 / (1 + com)
+        :param adjust: Whether the average is of all the weighted values (True) or the recursive one (False)
+        :param columns: The number of tickers
+        """
+        self.alpha = 1.0 / (1 + com)
+        self.adjust = adjust
+        self.columns = columns
+        # The average is the ratio of the weighted sum of the values to the sum of their weights
+        self._values = np.zeros(columns)
+        self._weights = np.zeros(columns)
+        # The recursive average and how much it has decayed since its last known value
+        self._average = np.full(columns, np.nan)
+        self._decay = np.ones(columns)
+        self.value = np.full(columns, np.nan)
+
+    def append(self, values):
+        """
+        Consumes a block of dates, the unknown values decay the weights of the known ones but add nothing
+        :param values: ndarray (date,) for a single ticker or (date x ticker)
+        :return: ndarray of the same shape - the EMA on each of the dates, NaN before the first known value
+        """
+        block, shape = _as_block(values, self.columns)
+        if not self.adjust:
+            results, self._average, self._decay = _recursive_means(block, self._average, self._decay, self.alpha)
+            if len(results):
+                self.value = results[-1]
+            return results.reshape(shape)
+        known = ~np.isnan(block)
+        weights = known.astype(np.float64)
+        weighted = _decayed_sums(np.where(known, block, 0) * weights, self._values, self.alpha)
+        weights = _decayed_sums(weights, self._weights, self.alpha)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            results = np.where(weights > 0, weighted / weights, np.nan)
+        if len(results):
+            self._values = weighted[-1]
+            self._weights = weights[-1]
+            self.value = results[-1]
+        return results.reshape(shape)
+
+    def update(self, values):
+        """
+        Consumes one date
+        :param values: The value of each ticker, a scalar for a single ticker
+        :return: The EMA after the date, a float for a single ticker
+        """
+        return _last(self.append(np.reshape(values, (1, self.columns))), self.columns)
+
+
+class TrueRange(object):
+    """
+    The greatest of high - low, |high - previous close| and |low - previous close|. The first date has no previous
+    close, so it uses the same date's close
+    """
+
+    def __init__(self, columns=1):
+        """
+        :param columns: The number of tickers
+        """
+        self.columns = columns
+        self._close = None
+        self.value = np.full(columns, np.nan)
+
+    def append(self, high, low, close):
+        """
+        Consumes a block of dates
+        :param high: ndarray (date,) for a single ticker or (date x ticker) of High prices
+        :param low: ndarray of Low prices, same shape
+        :param close: ndarray of Close prices, same shape
+        :return: ndarray of the same shape - the true range on each of the dates
+        """
+        high, shape = _as_block(high, self.columns)
+        low = _as_block(low, self.columns)[0]
+        close = _as_block(close, self.columns)[0]
+        if not len(close):
+            return np.empty(shape)
+        previous = np.concatenate([close[:1] if self._close is None else self._close, close[:-1]])
+        self._close = close[-1:]
+        results = np.maximum(np.maximum(high - low, np.abs(high - previous)), np.abs(low - previous))
+        self.value = results[-1]
+        return results.reshape(shape)
+
+    def update(self, high, low, close):
+        """
+        Consumes one date
+        :return: The true range of the date, a float for a single ticker
+        """
+        block = [np.reshape(prices, (1, self.columns)) for prices in (high, low, close)]
+        return _last(self.append(*block), self.columns)
+
+
+class ATR(object):
+    """
+    Average true range, the simple moving average of the true range
+    """
+
+    def __init__(self, window, min_periods=None, columns=1):
+        """
+        :param window: The number of dates averaged
+        :param min_periods: The number of known true ranges needed, window by default
+        :param columns: The number of tickers
+        """
+        self.columns = columns
+        self._true_range = TrueRange(columns)
+        self._average = SMA(window, min_periods, columns)
+        self.value = np.full(columns, np.nan)
+
+    def append(self, high, low, close):
+        """
+        Consumes a block of dates
+        :return: ndarray of the same shape as close - the ATR on each of the dates
+        """
+        results = self._average.append(self._true_range.append(high, low, close))
+        self.value = self._average.value
+        return results
+
+    def update(self, high, low, close):
+        """
+        Consumes one date
+        :return: The ATR after the date, a float for a single ticker
+        """
+        block = [np.reshape(prices, (1, self.columns)) for prices in (high, low, close)]
+        return _last(self.append(*block), self.columns)
+
+
+class RollingVolatility(object):
+    """
+    Annualized volatility of the log returns over a trailing window, like
+    np.log(prices / prices.shift(1)).rolling(window).std() * np.sqrt(periods)
+    """
+
+    def __init__(self, window=252, periods=252, min_periods=None, columns=1):
+        """
+        :param window: The number of returns in the window
+        :param periods: The number of periods per year, for annualizing
+        :param min_periods: The number of known returns needed, window by default
+        :param columns: The number of tickers
+        """
+        self.columns = columns
+        self.periods = periods
+        self._price = None
+        self._std = RollingStd(window, min_periods, columns)
+        self.value = np.full(columns, np.nan)
+
+    def append(self, values):
+        """
+        Consumes a block of prices
+        :param values: ndarray (date,) for a single ticker or (date x ticker)
+        :return: ndarray of the same shape - the volatility on each of the dates
+        """
+        block, shape = _as_block(values, self.columns)
+        if not len(block):
+            return np.empty(shape)
+        previous = np.concatenate([np.full((1, self.columns), np.nan) if self._price is None else self._price,
+                                   block[:-1]])
+        self._price = block[-1:]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = np.log(block / previous)
+        results = self._std.append(returns) * np.sqrt(self.periods)
+        self.value = results[-1]
+        return results.reshape(shape)
+
+    def update(self, values):
+        """
+        Consumes one date
+        :return: The volatility after the date, a float for a single ticker
+        """
+        return _last(self.append(np.reshape(values, (1, self.columns))), self.columns)
+
+
+def _columns(values):
+    return 1 if np.ndim(values) < 2 else np.shape(values)[1]
+
+
+def sma(values, window, min_periods=None):
+    """
+    :param values: ndarray (date,) or (date x ticker)
+    :return: ndarray of the same shape - see SMA
+    """
+    return SMA(window, min_periods, _columns(values)).append(values)
+
+
+def rolling_sum(values, window, min_periods=None):
+    """
+    :param values: ndarray (date,) or (date x ticker)
+    :return: ndarray of the same shape - see RollingSum
+    """
+    return RollingSum(window, min_periods, _columns(values)).append(values)
+
+
+def rolling_std(values, window, min_periods=None, ddof=1):
+    """
+    :param values: ndarray (date,) or (date x ticker)
+    :return: ndarray of the same shape - see RollingStd
+    """
+    return RollingStd(window, min_periods, _columns(values), ddof).append(values)
+
+
+def ema(values, com, adjust=True):
+    """
+    :param values: ndarray (date,) or (date x ticker)
+    :return: ndarray of the same shape - see EMA
+    """
+    return EMA(com, adjust, _columns(values)).append(values)
+
+
+def true_range(high, low, close):
+    """
+    :param high: ndarray (date,) or (date x ticker) of High prices
+    :param low: ndarray of Low prices, same shape
+    :param close: ndarray of Close prices, same shape
+    :return: ndarray of the same shape - see TrueRange
+    """
+    return TrueRange(_columns(close)).append(high, low, close)
+
+
+def atr(high, low, close, window, min_periods=None):
+    """
+    :return: ndarray of the same shape as close - see ATR
+    """
+    return ATR(window, min_periods, _columns(close)).append(high, low, close)
+
+
+def volatility(values, window=252, periods=252, min_periods=None):
+    """
+    :param values: ndarray (date,) or (date x ticker) of prices
+    :return: ndarray of the same shape - see RollingVolatility
+    """
+    return RollingVolatility(window, periods, min_periods, _columns(values)).append(values)
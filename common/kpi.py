@@ -0,0 +1,139 @@
+"""
+Vectorized KPIs of many strategies at once, replacing one ffn calc_stats object per series.
+
+The input is a (date x strategy) matrix of prices or portfolio values. Like ffn, missing values are skipped: the
+returns of a strategy are taken between its consecutive known values, so each column can start, stop and have gaps
+on its own. Every KPI is then a single array operation along the date axis. The definitions follow ffn's (daily
+Sharpe and Sortino ratios annualized with 252 periods, CAGR over the years between the first and last value)
+"""
+import numpy as np
+import pandas as pd
+from common.signals import forward_fill
+
+KPI_COLUMNS = ['start', 'end', 'observations', 'total_return', 'cagr', 'daily_mean', 'daily_vol', 'daily_sharpe',
+               'daily_sortino', 'best_day', 'worst_day', 'win_rate', 'max_drawdown', 'max_drawdown_duration',
+               'calmar']
+SECONDS_PER_YEAR = 31557600.0  # 365.25 days, as in ffn's year_frac
+
+
+def _first_and_last(known):
+    """
+    :param known: ndarray of bool (date x strategy)
+    :return: tuple of ndarrays (strategy,) - the rows of the first and last known values, 0 for empty columns
+    """
+    first = known.argmax(axis=0)
+    last = len(known) - 1 - known[::-1].argmax(axis=0)
+    return first, np.where(known.any(axis=0), last, 0)
+
+
+def _longest_run(flags, counted):
+    """
+    The longest run of True flags along the date axis, only counting the rows that are counted
+    :param flags: ndarray of bool (date x strategy)
+    :param counted: ndarray of bool (date x strategy), rows that are not counted neither extend nor break a run
+    :return: ndarray (strategy,) of the lengths
+    """
+    steps = np.cumsum(counted, axis=0)
+    resets = np.maximum.accumulate(np.where(counted & ~flags, steps, 0), axis=0)
+    return np.where(flags & counted, steps - resets, 0).max(axis=0) if len(flags) else np.zeros(flags.shape[1])
+
+
+def compute_kpis(prices, risk_free=0.0, periods=252):
+    """
+    KPIs of every column of a price matrix
+    :param prices: pd.DataFrame (date x strategy) or pd.Series of prices or portfolio values, NaN where unknown
+    :param risk_free: The annual risk free rate of the Sharpe and Sortino ratios
+    :param periods: The number of periods per year, for annualizing
+    :return: pd.DataFrame - one row per strategy, one column per KPI (see KPI_COLUMNS)
+    """
+    if isinstance(prices, pd.Series):
+        prices = prices.to_frame()
+    values = prices.values.astype(np.float64)
+    known = ~np.isnan(values)
+    count = known.sum(axis=0)
+    first, last = _first_and_last(known)
+    columns = np.arange(values.shape[1])
+
+    # Returns between consecutive known values
+    previous = np.full(values.shape, np.nan)
+    previous[1:] = forward_fill(values)[:-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = values / previous - 1
+        excess = returns - ((1 + risk_free) ** (1.0 / periods) - 1)
+        has_return = ~np.isnan(returns)
+        return_count = has_return.sum(axis=0)
+        mean = np.where(has_return, returns, 0).sum(axis=0) / return_count
+        excess_mean = np.where(has_return, excess, 0).sum(axis=0) / return_count
+        squares = np.where(has_return, returns - mean, 0) ** 2
+        vol = np.sqrt(squares.sum(axis=0) / (return_count - 1))
+        downside = np.where(has_return, np.minimum(excess, 0), 0)
+        downside_mean = downside.sum(axis=0) / return_count
+        downside_vol = np.sqrt((np.where(has_return, downside - downside_mean, 0) ** 2).sum(axis=0) /
+                               (return_count - 1))
+        wins = (returns > 0).sum(axis=0)
+        losses = (returns < 0).sum(axis=0)
+
+        start_values = values[first, columns]
+        end_values = values[last, columns]
+        total_return = end_values / start_values - 1
+        if isinstance(prices.index, pd.DatetimeIndex):
+            dates = prices.index.values.astype('datetime64[ns]').astype(np.int64) / 1e9
+            years = (dates[last] - dates[first]) / SECONDS_PER_YEAR
+        else:
+            years = (last - first) / float(periods)
+        cagr = (end_values / start_values) ** (1 / years) - 1
+
+        peaks = np.fmax.accumulate(values, axis=0)
+        drawdown = values / peaks - 1
+        max_drawdown = np.where(known, drawdown, np.inf).min(axis=0)
+
+        kpis = pd.DataFrame({
+            'start': prices.index[first],
+            'end': prices.index[last],
+            'observations': count,
+            'total_return': total_return,
+            'cagr': cagr,
+            'daily_mean': mean * periods,
+            'daily_vol': vol * np.sqrt(periods),
+            'daily_sharpe': excess_mean / vol * np.sqrt(periods),
+            'daily_sortino': excess_mean / downside_vol * np.sqrt(periods),
+            'best_day': np.where(has_return, returns, -np.inf).max(axis=0),
+            'worst_day': np.where(has_return, returns, np.inf).min(axis=0),
+            'win_rate': wins / (wins + losses).astype(np.float64),
+            'max_drawdown': max_drawdown,
+            'max_drawdown_duration': _longest_run(drawdown < 0, known),
+            'calmar': cagr / np.abs(max_drawdown),
+        }, index=prices.columns)
+    # Too little data for a KPI gives NaN, as ffn does
+    kpis.loc[count == 0, ['start', 'end']] = None
+    kpis.loc[return_count < 2, ['daily_mean', 'daily_vol', 'daily_sharpe', 'daily_sortino', 'best_day',
+                                'worst_day']] = np.nan
+    kpis.loc[count < 2, ['total_return', 'cagr', 'max_drawdown', 'max_drawdown_duration', 'calmar',
+                         'win_rate']] = np.nan
+    kpis = kpis.replace([np.inf, -np.inf], np.nan)
+    return kpis[KPI_COLUMNS]
+
+
+def compute_return_kpis(returns, risk_free=0.0, periods=252):
+    """
+    KPIs of a matrix of simple returns, compounded into values starting at 1 on the date before the first return
+    :param returns: pd.DataFrame (date x strategy) or pd.Series of returns, NaN where there is no return
+    :param risk_free: The annual risk free rate of the Sharpe and Sortino ratios
+    :param periods: The number of periods per year, for annualizing
+    :return: pd.DataFrame - see compute_kpis
+    """
+    if isinstance(returns, pd.Series):
+        returns = returns.to_frame()
+    growth = np.where(np.isnan(returns.values), np.nan, 1 + returns.values)
+    values = np.cumprod(np.where(np.isnan(growth), 1, growth), axis=0)
+    values[np.isnan(growth)] = np.nan
+    first, _ = _first_and_last(~np.isnan(growth))
+    # The first return of each strategy is measured against a value of 1 on the date before it
+    values = np.concatenate([np.full((1, values.shape[1]), np.nan), values])
+    values[first, np.arange(values.shape[1])] = 1
+    if isinstance(returns.index, pd.DatetimeIndex) and len(returns.index) > 1:
+        index = returns.index.insert(0, returns.index[0] - (returns.index[1] - returns.index[0]))
+    else:
+        # Without dates, the start and end are positions and the years are counted in periods
+        index = pd.Index(np.arange(-1, len(returns.index)))
+    return compute_kpis(pd.DataFrame(values, index=index, columns=returns.columns), risk_free, periods)
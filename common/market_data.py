@@ -0,0 +1,281 @@
+"""
+Local columnar store of daily bars, shared by the assignments and the final project.
+
+Each ticker is kept in its own directory as one .npy file per field (plus the dates), so that any slice of the
+history can be read through a memory map without copying. The store remembers which date range has already been
+fetched for each ticker, and only asks the fetcher for the missing part of a request
+"""
+# Some Metadata about the script
+__author__ = 'Osama Iqbal (iqbal.osama@icloud.com)'
+__license__ = 'MIT'
+__vcs_id__ = '$Id$'
+__version__ = '1.0.0'  # Versioning: http://www.python.org/dev/peps/pep-0386/
+
+import json
+import logging  # Logging class for logging in the case of an error, makes debugging easier
+import os
+import re
+import warnings  # For removing Deprecation Warning w.r.t. Yahoo Finance Fix
+import numpy as np  # For numerical operations
+import pandas as pd
+
+# Where the stores live unless told otherwise, can be overridden through the environment
+DEFAULT_ROOT = os.environ.get('ALPHADESIGN_MARKET_DATA',
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, '.market_data'))
+
+ONE_DAY = pd.Timedelta(days=1)
+
+
+class YahooFetcher(object):
+    """
+    Fetches daily bars of a single ticker from Yahoo Finance through pandas datareader
+    """
+
+    def __init__(self, auto_adjust=True):
+        """
+        :param auto_adjust: Whether the prices should be adjusted for splits and dividends
+        """
+        self.auto_adjust = auto_adjust
+        self._bridged = False
+
+    def __call__(self, ticker, start, end):
+        """
+        :param ticker: The Ticker symbol for which data needs to be fetched
+        :param start: pd.Timestamp - first date to fetch
+        :param end: pd.Timestamp - last date to fetch
+        :return: pd.DataFrame - The bars, indexed by date
+        """
+        from pandas_datareader import data as pdr  # The pandas Data Module used for fetching data from a Data Source
+        if not self._bridged:
+            # Fix Pandas Datareader's Issues with Yahoo Finance (Since yahoo abandoned it's API)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                from fix_yahoo_finance import pdr_override  # For overriding Pandas DataFrame Reader not connecting to YF
+            pdr_override()
+            self._bridged = True
+        # Yahoo's end date is exclusive
+        return pdr.get_data_yahoo(ticker, start=start.strftime('%Y-%m-%d'), end=(end + ONE_DAY).strftime('%Y-%m-%d'),
+                                  auto_adjust=self.auto_adjust)
+
+
+class FrameFetcher(object):
+    """
+    Serves bars from DataFrames held in memory. Used as a local fake provider, it keeps a log of every request
+    """
+
+    def __init__(self, frames):
+        """
+        :param frames: dict - ticker => pd.DataFrame of bars indexed by date
+        """
+        self.frames = frames
+        self.calls = []
+
+    def __call__(self, ticker, start, end):
+        self.calls.append((ticker, start, end))
+        frame = self.frames.get(ticker)
+        if frame is None:
+            return pd.DataFrame()
+        return frame.loc[(frame.index >= start) & (frame.index <= end)]
+
+
+def _replace(source, destination):
+    """
+    Atomically moves source over destination
+    """
+    if hasattr(os, 'replace'):
+        os.replace(source, destination)
+    else:
+        if os.path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
+
+
+class MarketDataStore(object):
+    """
+    Columnar, memory-mappable store of daily bars with incremental refresh
+    """
+
+    def __init__(self, root, fetcher):
+        """
+        :param root: Directory of the store, one sub directory per ticker
+        :param fetcher: callable(ticker, start, end) returning a pd.DataFrame of bars indexed by date
+        """
+        self.root = root
+        self.fetcher = fetcher
+        self._cache = {}
+
+    # ===== Layout on disk =====
+
+    def _ticker_dir(self, ticker):
+        return os.path.join(self.root, re.sub(r'[^A-Za-z0-9_.\-^=]', '_', ticker))
+
+    def _field_file(self, field):
+        return re.sub(r'\W', '_', field) + '.npy'
+
+    def _read_meta(self, ticker):
+        path = os.path.join(self._ticker_dir(ticker), 'meta.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as handle:
+            return json.load(handle)
+
+    def _load(self, ticker):
+        """
+        Memory maps the dates and the fields of a ticker
+        :return: tuple - (meta, dates, dict of field => array), meta is None if the ticker has never been fetched
+        """
+        if ticker in self._cache:
+            return self._cache[ticker]
+        meta = self._read_meta(ticker)
+        dates = np.array([], dtype='datetime64[ns]')
+        columns = {}
+        if meta is not None and meta['rows'] > 0:
+            directory = self._ticker_dir(ticker)
+            dates = np.load(os.path.join(directory, 'dates.npy'), mmap_mode='r')
+            for field in meta['fields']:
+                columns[field] = np.load(os.path.join(directory, self._field_file(field)), mmap_mode='r')
+        self._cache[ticker] = (meta, dates, columns)
+        return self._cache[ticker]
+
+    def _write(self, ticker, frame, start, end):
+        """
+        Writes all the bars of a ticker and the covered date range
+        """
+        self._cache.pop(ticker, None)
+        directory = self._ticker_dir(ticker)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        arrays = [('dates.npy', frame.index.values.astype('datetime64[ns]'))]
+        arrays += [(self._field_file(field), frame[field].values.astype(np.float64)) for field in frame.columns]
+        for name, values in arrays:
+            temp = os.path.join(directory, name + '.tmp')
+            with open(temp, 'wb') as handle:
+                np.save(handle, values)
+            _replace(temp, os.path.join(directory, name))
+        meta = {'start': str(start.date()), 'end': str(end.date()), 'rows': len(frame),
+                'fields': [str(field) for field in frame.columns]}
+        temp = os.path.join(directory, 'meta.json.tmp')
+        with open(temp, 'w') as handle:
+            json.dump(meta, handle)
+        _replace(temp, os.path.join(directory, 'meta.json'))
+
+    # ===== Refresh =====
+
+    def refresh(self, ticker, start, end):
+        """
+        Fetches the part of [start, end] that is not in the store yet
+        :param ticker: The Ticker symbol
+        :param start: First date needed
+        :param end: Last date needed
+        :return: bool - Whether the fetcher was called
+        """
+        start = pd.Timestamp(start).normalize()
+        end = pd.Timestamp(end).normalize()
+        today = pd.Timestamp.now().normalize()
+        meta, dates, columns = self._load(ticker)
+        if meta is None:
+            missing = [(start, end)]
+            covered_start, covered_end = None, None
+        else:
+            covered_start, covered_end = pd.Timestamp(meta['start']), pd.Timestamp(meta['end'])
+            missing = []
+            if start < covered_start:
+                missing.append((start, covered_start - ONE_DAY))
+            if end > covered_end:
+                missing.append((covered_end + ONE_DAY, end))
+        if not missing:
+            return False
+
+        frames = []
+        if len(dates):
+            frames.append(pd.DataFrame(dict((field, np.asarray(values)) for field, values in columns.items()),
+                                       index=pd.DatetimeIndex(np.asarray(dates)), columns=meta['fields']))
+        fetched_any = False
+        for missing_start, missing_end in missing:
+            logging.info('Fetching %s from %s to %s' % (ticker, missing_start.date(), missing_end.date()))
+            fetched = self.fetcher(ticker, missing_start, missing_end)
+            if fetched is None or fetched.empty:
+                continue
+            fetched.index = pd.DatetimeIndex(fetched.index).normalize()
+            fetched = fetched.loc[(fetched.index >= missing_start) & (fetched.index <= missing_end)]
+            if fetched.empty:
+                continue
+            frames.append(fetched)
+            fetched_any = True
+            # A fetched range is covered up to its end when that is in the past, the days after its last bar being
+            # weekends or holidays. From today on it only counts up to its last bar, as the rest may not be
+            # published yet. A range that fetched nothing may have failed, so it is asked for again next time
+            if covered_start is None or missing_start < covered_start:
+                covered_start = missing_start
+            last = missing_end if missing_end < today else fetched.index.max()
+            if covered_end is None or last > covered_end:
+                covered_end = last
+        if not fetched_any:
+            # Either the ticker does not exist or the fetch failed, the coverage is left as it was
+            return True
+
+        frame = pd.concat(frames).sort_index()
+        frame = frame[~frame.index.duplicated(keep='last')]
+        self._write(ticker, frame, covered_start, covered_end)
+        return True
+
+    # ===== Reads =====
+
+    def bars(self, ticker, start, end, fields=None):
+        """
+        Zero-copy read of the bars of a ticker, refreshing the store first if needed
+        :param ticker: The Ticker symbol
+        :param start: First date
+        :param end: Last date
+        :param fields: The fields to read, all by default
+        :return: tuple - (dates, dict of field => array), read-only views into the memory mapped files
+        """
+        self.refresh(ticker, start, end)
+        meta, dates, columns = self._load(ticker)
+        if meta is None:
+            return np.array([], dtype='datetime64[ns]'), {}
+        first = np.searchsorted(dates, np.datetime64(pd.Timestamp(start).normalize(), 'ns'), side='left')
+        last = np.searchsorted(dates, np.datetime64(pd.Timestamp(end).normalize(), 'ns'), side='right')
+        if fields is None:
+            fields = meta['fields']
+        return dates[first:last], dict((field, columns[field][first:last]) for field in fields)
+
+    def get(self, tickers, start, end, field=None):
+        """
+        Reads a (tickers, start, end, field) slice, in the same shapes as pandas datareader returns
+        :param tickers: A single Ticker symbol, or a list of them
+        :param start: First date
+        :param end: Last date
+        :param field: A single field to read, e.g. 'Close', all fields by default
+        :return: For a single ticker, a pd.DataFrame of the fields (or a pd.Series for a single field).
+                 For a list of tickers, a pd.DataFrame with (field, ticker) columns (or date x ticker for a single
+                 field)
+        """
+        fields = None if field is None else [field]
+        if isinstance(tickers, str):
+            dates, columns = self.bars(tickers, start, end, fields)
+            index = pd.DatetimeIndex(dates, name='Date')
+            if field is not None:
+                return pd.Series(columns.get(field, np.array([])), index=index, name=field, copy=False)
+            meta = self._load(tickers)[0]
+            return pd.DataFrame(columns, index=index, columns=[] if meta is None else meta['fields'])
+
+        frames = {}
+        for ticker in tickers:
+            dates, columns = self.bars(ticker, start, end, fields)
+            frames[ticker] = pd.DataFrame(columns, index=pd.DatetimeIndex(dates, name='Date'))
+        data = pd.concat(frames, axis=1).swaplevel(0, 1, axis=1).sort_index(axis=1)
+        if field is not None:
+            return data[field].reindex(columns=list(tickers))
+        return data
+
+
+def default_store(auto_adjust=True, root=DEFAULT_ROOT):
+    """
+    The store of Yahoo Finance bars used by the scripts, adjusted and raw prices are kept apart
+    :param auto_adjust: Whether the prices should be adjusted for splits and dividends
+    :param root: Directory holding the stores
+    :return: MarketDataStore
+    """
+    name = 'yahoo_adjusted' if auto_adjust else 'yahoo'
+    return MarketDataStore(os.path.join(root, name), YahooFetcher(auto_adjust=auto_adjust))
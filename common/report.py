@@ -0,0 +1,186 @@
+"""
+Headless reports of the scripts: figures rendered off the main process and written to one HTML page per run.
+
+The scripts hand their computed series to a Report instead of plotting them and blocking on plt.show(). Each figure
+is queued to a background worker process, which draws it on an Agg canvas and saves it as a PNG, so the computation
+carries on while the figures are rendered. Tables and text are kept as they are given. Writing the report waits for
+the pending figures and writes an index.html that shows everything in the order it was added. Rendering can be
+turned off entirely (render=False, or ALPHADESIGN_RENDER=0 in the environment), then adding a figure costs nothing
+"""
+import datetime
+import logging  # Logging class for logging in the case of an error, makes debugging easier
+import multiprocessing
+import os
+import re
+import sys
+import matplotlib
+try:
+    from html import escape
+except ImportError:
+    from cgi import escape  # Python 2
+if 'matplotlib.pyplot' not in sys.modules:
+    # Nothing is ever shown on screen
+    matplotlib.use('Agg')
+
+# Where the reports are written unless told otherwise, can be overridden through the environment
+DEFAULT_ROOT = os.environ.get('ALPHADESIGN_REPORTS',
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'reports'))
+RENDER = os.environ.get('ALPHADESIGN_RENDER', '1') != '0'
+DPI = 80
+
+
+def plot_frame(figure, data, subplots=False, **options):
+    """
+    Draws a pd.Series or pd.DataFrame with its plot method
+    :param figure: matplotlib.figure.Figure to draw on
+    :param data: pd.Series or pd.DataFrame
+    :param subplots: Whether each column gets its own axes, stacked vertically
+    :param options: Passed on to data.plot, e.g. title, ylim, color, kind
+    :return: None
+    """
+    if subplots and data.ndim == 2:
+        axes = [figure.add_subplot(data.shape[1], 1, number + 1) for number in range(data.shape[1])]
+        data.plot(subplots=True, ax=axes, **options)
+    else:
+        data.plot(ax=figure.add_subplot(1, 1, 1), **options)
+
+
+def _render(path, plotter, args, kwargs, figsize):
+    """
+    Draws one figure on an Agg canvas and saves it, runs in the worker process
+    :return: str - the path of the PNG
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    figure = Figure(figsize=figsize)
+    FigureCanvasAgg(figure)
+    plotter(figure, *args, **kwargs)
+    figure.savefig(path, dpi=DPI)
+    return path
+
+
+def _slug(name):
+    return re.sub(r'[^0-9A-Za-z]+', '_', name).strip('_').lower() or 'figure'
+
+
+class Report(object):
+    """
+    The figures, tables and text of a run, written as a single HTML page
+    """
+
+    def __init__(self, title, directory=None, render=None, background=True):
+        """
+        :param title: The title of the page, also the start of the name of its directory
+        :param directory: Where the page and its figures are written, a new directory under DEFAULT_ROOT by default
+        :param render: Whether the figures are rendered at all, RENDER by default
+        :param background: Whether the figures are rendered by a worker process (True) or when they are added
+        """
+        self.title = title
+        if directory is None:
+            directory = os.path.join(DEFAULT_ROOT, '%s_%s' % (_slug(title), datetime.datetime.now()
+                                                                 .strftime('%Y%m%d_%H%M%S')))
+        self.directory = directory
+        self.render = RENDER if render is None else render
+        self.background = background
+        self._items = []
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.write()
+        return False
+
+    def figure(self, name, plotter, *args, **kwargs):
+        """
+        Queues a figure, drawn by plotter(figure, *args, **kwargs)
+        :param name: The heading of the figure
+        :param plotter: A module level function that draws on a matplotlib.figure.Figure. It must be picklable,
+                        and so must its arguments, which are taken as they are now
+        :param kwargs: figsize is the size of the figure in inches, the others are passed on to plotter
+        :return: None
+        """
+        if not self.render:
+            return
+        figsize = kwargs.pop('figsize', (10, 6))
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = os.path.join(self.directory, '%02d_%s.png' % (len(self._items), _slug(name)))
+        task = (path, plotter, args, kwargs, figsize)
+        if not self.background:
+            self._items.append(('figure', name, task, self._safe_render(task)))
+            return
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(1)
+        self._items.append(('figure', name, task, self._pool.apply_async(_render, task)))
+
+    def plot(self, name, data, **options):
+        """
+        Queues a figure of a pd.Series or pd.DataFrame, see plot_frame
+        :param name: The heading of the figure
+        :param data: pd.Series or pd.DataFrame
+        :param options: figsize, subplots and the options of data.plot
+        :return: None
+        """
+        if self.render:
+            self.figure(name, plot_frame, data.copy(), **options)
+
+    def table(self, name, frame):
+        """
+        Adds a table
+        :param name: The heading of the table
+        :param frame: pd.DataFrame or pd.Series
+        :return: None
+        """
+        self._items.append(('table', name, frame.to_frame() if frame.ndim == 1 else frame.copy(), None))
+
+    def text(self, name, text):
+        """
+        Adds preformatted text, e.g. a printed summary
+        :return: None
+        """
+        self._items.append(('text', name, str(text), None))
+
+    def _safe_render(self, task):
+        try:
+            return _render(*task)
+        except Exception as e:
+            logging.info('Could not render %s: %s' % (task[0], str(e)))
+            return None
+
+    def write(self):
+        """
+        Waits for the figures still being rendered and writes the page
+        :return: str - the path of the page
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        sections = ['<html><head><meta charset="utf-8"><title>%s</title></head><body>' % escape(self.title),
+                    '<h1>%s</h1>' % escape(self.title)]
+        for kind, name, content, result in self._items:
+            sections.append('<h2>%s</h2>' % escape(name))
+            if kind == 'figure':
+                if result is not None and not isinstance(result, str):
+                    try:
+                        result = result.get()
+                    except Exception as e:
+                        logging.info('Could not render %s: %s' % (name, str(e)))
+                        result = None
+                if result is None:
+                    sections.append('<p>The figure could not be rendered</p>')
+                else:
+                    sections.append('<img src="%s">' % os.path.basename(result))
+            elif kind == 'table':
+                sections.append(content.to_html())
+            else:
+                sections.append('<pre>%s</pre>' % escape(content))
+        sections.append('</body></html>')
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        path = os.path.join(self.directory, 'index.html')
+        with open(path, 'w') as page:
+            page.write('\n'.join(sections))
+        return path
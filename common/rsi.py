@@ -0,0 +1,206 @@
+"""
+Relative Strength Index with Wilder's smoothing, for whole histories and for live bars.
+
+The averages of the gains and losses are seeded with the mean of the first period price changes, then smoothed with
+alpha = 1 / period, as in the RSI of a2. wilder_rsi computes the whole history of one series or of a (date x ticker)
+matrix in a single pass: the seeds are placed with cumulative sums, and the smoothing is one exponentially weighted
+mean over all the columns. WilderRSI keeps the same state for each ticker and updates it in O(1) per new bar, so a
+live feed can carry on from a history
+"""
+import time
+import numpy as np
+import pandas as pd
+
+
+def _changes(values):
+    changes = np.full(values.shape, np.nan)
+    changes[1:] = values[1:] - values[:-1]
+    return changes
+
+
+def _smoothed_averages(moves, known, period):
+    """
+    Wilder's averages of the gains (or losses) of every column
+    :param moves: ndarray (date x ticker) of the gains, 0 where the price did not move that way
+    :param known: ndarray of bool (date x ticker), whether the price change is known
+    :param period: The RSI period
+    :return: ndarray (date x ticker) - NaN until period changes are known, and carried over the unknown changes
+    """
+    count = np.cumsum(known, axis=0)
+    seeds = np.cumsum(np.where(known, moves, 0), axis=0) / period
+    # The seed is the mean of the first period changes, then the next changes are smoothed into it
+    smoothed = np.where(known & (count == period), seeds, np.where(known & (count > period), moves, np.nan))
+    return pd.DataFrame(smoothed).ewm(alpha=1.0 / period, adjust=False, ignore_na=True).mean().values
+
+
+def wilder_rsi(values, period=14):
+    """
+    RSI of a series or of every column of a matrix
+    :param values: ndarray (date,) or (date x ticker) of prices
+    :param period: The RSI period
+    :return: ndarray of the same shape - NaN until period changes are known, and where the change is unknown.
+             The changes that are unknown (because of a missing price) are skipped by the smoothing
+    """
+    values = np.asarray(values, dtype=np.float64)
+    matrix = values.reshape(len(values), -1)
+    changes = _changes(matrix)
+    known = ~np.isnan(changes)
+    average_gain = _smoothed_averages(np.where(changes > 0, changes, 0), known, period)
+    average_loss = _smoothed_averages(np.where(changes < 0, -changes, 0), known, period)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi = np.where(known, 100 - 100 / (1 + average_gain / average_loss), np.nan)
+    return rsi.reshape(values.shape)
+
+
+class WilderRSI(object):
+    """
+    Incremental RSI of one or many tickers, fed one bar at a time
+    """
+
+    def __init__(self, period=14, tickers=1):
+        """
+        :param period: The RSI period
+        :param tickers: The number of tickers updated together
+        """
+        self.period = period
+        self.alpha = 1.0 / period
+        self._last = np.full(tickers, np.nan)
+        self._count = np.zeros(tickers, dtype=np.int64)
+        # Sums of the gains and losses while seeding, their smoothed averages afterwards
+        self._gain = np.zeros(tickers)
+        self._loss = np.zeros(tickers)
+        self.rsi = np.full(tickers, np.nan)
+
+    @classmethod
+    def from_history(cls, values, period=14):
+        """
+        An RSI whose state is at the end of a history, ready for the next bar
+        :param values: ndarray (date,) or (date x ticker) of prices
+        :param period: The RSI period
+        :return: WilderRSI
+        """
+        matrix = np.asarray(values, dtype=np.float64)
+        matrix = matrix.reshape(len(matrix), -1)
+        rsi = cls(period, matrix.shape[1])
+        if not len(matrix):
+            return rsi
+        changes = _changes(matrix)
+        known = ~np.isnan(changes)
+        rsi._count = known.sum(axis=0)
+        rsi._last = matrix[-1].copy()
+        seeded = rsi._count >= period
+        for moves, state in ((np.where(changes > 0, changes, 0), rsi._gain),
+                             (np.where(changes < 0, -changes, 0), rsi._loss)):
+            state[~seeded] = np.where(known, moves, 0).sum(axis=0)[~seeded]
+            averages = _smoothed_averages(moves, known, period)
+            state[seeded] = averages[-1, seeded]
+        rsi.rsi = wilder_rsi(matrix, period)[-1]
+        return rsi
+
+    def update(self, prices):
+        """
+        Consumes one bar
+        :param prices: The price of each ticker, a scalar for a single ticker
+        :return: The RSI of each ticker after the bar (a float for a single ticker), NaN until period changes are
+                 known and when the price change is unknown
+        """
+        prices = np.asarray(prices, dtype=np.float64).reshape(self._last.shape)
+        changes = prices - self._last
+        self._last = prices
+        known = ~np.isnan(changes)
+        self._count += known
+        gains = np.where(changes > 0, changes, 0)
+        losses = np.where(changes < 0, -changes, 0)
+
+        # While seeding the gains and losses are summed, the sums become averages on the period-th change, and
+        # the later changes are smoothed in with the same arithmetic as the exponentially weighted mean of
+        # wilder_rsi, so both give the same values
+        old, new = 1 - self.alpha, self.alpha
+        seeding = known & (self._count <= self.period)
+        self._gain = np.where(seeding, self._gain + gains, self._gain)
+        self._loss = np.where(seeding, self._loss + losses, self._loss)
+        seeded = known & (self._count == self.period)
+        self._gain = np.where(seeded, self._gain / self.period, self._gain)
+        self._loss = np.where(seeded, self._loss / self.period, self._loss)
+        smoothing = known & (self._count > self.period)
+        self._gain = np.where(smoothing, (old * self._gain + new * gains) / (old + new), self._gain)
+        self._loss = np.where(smoothing, (old * self._loss + new * losses) / (old + new), self._loss)
+
+        ready = known & (self._count >= self.period)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.rsi = np.where(ready, 100 - 100 / (1 + self._gain / self._loss), np.nan)
+        return self.rsi[0] if self.rsi.shape == (1,) else self.rsi
+
+
+def _ewma(series, com):
+    if hasattr(pd, 'stats'):
+        return pd.stats.moments.ewma(series, com=com, adjust=False)
+    # pd.stats was removed from later versions of pandas
+    return series.ewm(com=com, adjust=False).mean()
+
+
+def rsi_legacy(series, period):
+    """
+    The original RSI of a2, kept as the reference of the benchmark
+    :param series: pd.Series of prices
+    :param period: The RSI period
+    :return: pd.Series - the RSI from the date of the period-th price change
+    """
+    delta = series.diff().dropna()
+    u = delta * 0
+    d = u.copy()
+    u[delta > 0] = delta[delta > 0]
+    d[delta < 0] = -delta[delta < 0]
+    u[u.index[period-1]] = np.mean( u[:period] ) #first value is sum of avg gains
+    u = u.drop(u.index[:(period-1)])
+    d[d.index[period-1]] = np.mean( d[:period] ) #first value is sum of avg losses
+    d = d.drop(d.index[:(period-1)])
+    rs = _ewma(u, com=period-1) / _ewma(d, com=period-1)
+    return 100 - 100 / (1 + rs)
+
+
+def benchmark(bars=10000000, period=14, tickers=500, live_bars=1000000):
+    """
+    Times the RSI kernel against the original a2 implementation on a synthetic random walk
+    :param bars: The number of bars of the series
+    :param period: The RSI period
+    :param tickers: The number of columns of the matrix runs, which have bars bars in total
+    :param live_bars: The number of bars fed to WilderRSI, one date of all the tickers at a time
+    :return: dict - the seconds taken, and the bars per second of each implementation
+    """
+    random = np.random.RandomState(0)
+    prices = 100 + np.cumsum(random.randn(bars) * 0.5)
+    series = pd.Series(prices, index=pd.date_range('2000-01-01', periods=bars, freq='min'))
+
+    begin = time.time()
+    reference = rsi_legacy(series, period)
+    result = {'bars': bars, 'legacy': time.time() - begin}
+    begin = time.time()
+    rsi = wilder_rsi(prices, period)
+    result['kernel'] = time.time() - begin
+    if not np.allclose(rsi[period:], reference.values, rtol=0, atol=1e-8):
+        raise AssertionError('The RSI kernel does not match the original RSI')
+
+    matrix = prices.reshape(-1, tickers)
+    begin = time.time()
+    rsi = wilder_rsi(matrix, period)
+    result['kernel_matrix'] = time.time() - begin
+
+    dates = live_bars // tickers
+    live = WilderRSI(period, tickers)
+    begin = time.time()
+    for row in matrix[:dates]:
+        live.update(row)
+    result['live'] = time.time() - begin
+    if not np.allclose(live.rsi, rsi[dates - 1], rtol=0, atol=1e-8, equal_nan=True):
+        raise AssertionError('The live RSI does not match the RSI kernel')
+    result['live_update'] = result['live'] / dates
+
+    for name in ('legacy', 'kernel', 'kernel_matrix', 'live'):
+        result[name + '_bars_per_second'] = (dates * tickers if name == 'live' else bars) / result[name]
+    result['speedup'] = result['legacy'] / result['kernel']
+    return result
+
+
+if __name__ == '__main__':
+    print(benchmark())
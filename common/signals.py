@@ -0,0 +1,76 @@
+"""
+Threshold crossing signals with hysteresis, shared by the RSI (a2) and Volatility Ratio (a3) strategies.
+
+A position is entered when the series crosses above the upper threshold, exited (or reversed) when it crosses below
+the lower one, and held in between. Everything is computed with array operations along the date axis, so a single
+call handles one series or a whole (date x ticker) matrix
+"""
+import numpy as np
+import pandas as pd
+
+
+def _previous(values):
+    """
+    The values shifted one date down, the first date has no previous value
+    """
+    previous = np.empty_like(values)
+    previous[0] = np.nan
+    previous[1:] = values[:-1]
+    return previous
+
+
+def cross_above(values, threshold):
+    """
+    :param values: ndarray (date,) or (date x ticker)
+    :param threshold: A scalar or anything that broadcasts against values
+    :return: ndarray of bool - True on the dates where values goes from below to above the threshold
+    """
+    values = np.asarray(values, dtype=np.float64)
+    return (values > threshold) & (_previous(values) < threshold)
+
+
+def cross_below(values, threshold):
+    """
+    :param values: ndarray (date,) or (date x ticker)
+    :param threshold: A scalar or anything that broadcasts against values
+    :return: ndarray of bool - True on the dates where values goes from above to below the threshold
+    """
+    values = np.asarray(values, dtype=np.float64)
+    return (values < threshold) & (_previous(values) > threshold)
+
+
+def forward_fill(values):
+    """
+    Forward fills the NaNs of values along the date axis
+    :param values: ndarray (date,) or (date x ticker)
+    :return: ndarray - the filled values, still NaN before the first valid value
+    """
+    values = np.asarray(values, dtype=np.float64)
+    dates = np.arange(len(values)).reshape((-1,) + (1,) * (values.ndim - 1))
+    last_valid = np.maximum.accumulate(np.where(np.isnan(values), 0, dates), axis=0)
+    if values.ndim == 1:
+        return values[last_valid]
+    return values[last_valid, np.arange(values.shape[1])]
+
+
+def threshold_positions(values, upper, lower, upper_state=1, lower_state=-1):
+    """
+    Positions from the crossings of an upper and a lower threshold
+    :param values: pd.Series, pd.DataFrame or ndarray - (date,) or (date x ticker)
+    :param upper: Crossing above it sets the position to upper_state
+    :param lower: Crossing below it sets the position to lower_state
+    :param upper_state: The position after crossing above upper
+    :param lower_state: The position after crossing below lower
+    :return: The positions, same type and shape as values, NaN until the first crossing
+    """
+    raw = np.asarray(values, dtype=np.float64)
+    signals = np.full(np.broadcast(raw, np.asarray(upper), np.asarray(lower)).shape, np.nan)
+    signals[np.broadcast_to(cross_above(raw, upper), signals.shape)] = upper_state
+    signals[np.broadcast_to(cross_below(raw, lower), signals.shape)] = lower_state
+    positions = forward_fill(signals)
+
+    if isinstance(values, pd.DataFrame):
+        return pd.DataFrame(positions, index=values.index, columns=values.columns)
+    if isinstance(values, pd.Series):
+        return pd.Series(positions, index=values.index, name=values.name)
+    return positions
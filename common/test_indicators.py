@@ -0,0 +1,30 @@
+"""
+Tests of the streaming indicators against their pandas equivalents
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from common.indicators import EMA, ema
+
+
+def prices_with_gaps(dates=1500, tickers=4, seed=0):
+    random = np.random.RandomState(seed)
+    prices = 100 + np.cumsum(random.randn(dates, tickers), axis=0)
+    prices[random.rand(dates, tickers) < 0.1] = np.nan
+    prices[:30, 1] = np.nan
+    prices[200:400, 2] = np.nan
+    return prices
+
+
+@pytest.mark.parametrize('adjust', [True, False])
+def test_ema_matches_pandas_after_gaps(adjust):
+    prices = prices_with_gaps()
+    expected = pd.DataFrame(prices).ewm(com=20, adjust=adjust).mean().values
+    np.testing.assert_allclose(ema(prices, 20, adjust=adjust), expected, rtol=1e-12)
+
+    # Fed in blocks and one date at a time
+    blocks = EMA(20, adjust, prices.shape[1])
+    np.testing.assert_allclose(np.vstack([blocks.append(prices[first:first + 97])
+                                          for first in range(0, len(prices), 97)]), expected, rtol=1e-12)
+    dates = EMA(20, adjust, prices.shape[1])
+    np.testing.assert_allclose(np.array([dates.update(row) for row in prices]), expected, rtol=1e-12)
@@ -0,0 +1,83 @@
+"""
+Tests of the refresh of MarketDataStore, with a FrameFetcher as the provider
+"""
+import numpy as np
+import pandas as pd
+from common.market_data import FrameFetcher, MarketDataStore
+
+
+def bars(start, end):
+    dates = pd.bdate_range(start, end)
+    return pd.DataFrame({'Open': np.arange(len(dates), dtype=np.float64)}, index=dates)
+
+
+def test_warm_refresh_makes_no_fetcher_calls(tmpdir):
+    fetcher = FrameFetcher({'AAPL': bars('2015-01-01', '2015-12-31')})
+    store = MarketDataStore(str(tmpdir), fetcher)
+    store.get('AAPL', '2015-01-01', '2015-12-31')
+    assert len(fetcher.calls) == 1
+
+    # A new store on the same directory, and a slice of the covered range
+    warm = MarketDataStore(str(tmpdir), fetcher)
+    assert not warm.refresh('AAPL', '2015-01-01', '2015-12-31')
+    assert len(warm.get('AAPL', '2015-03-01', '2015-06-30', 'Open')) == len(bars('2015-03-01', '2015-06-30'))
+    assert len(fetcher.calls) == 1
+
+
+def test_warm_refresh_up_to_a_holiday_makes_no_fetcher_calls(tmpdir):
+    # 2016-01-01 is a market holiday and 2016-01-03 a Sunday, the last bar is on 2015-12-31
+    fetcher = FrameFetcher({'AAPL': bars('2015-01-01', '2015-12-31')})
+    for end in ['2016-01-01', '2016-01-03']:
+        store = MarketDataStore(str(tmpdir.join(end)), fetcher)
+        store.get('AAPL', '2015-01-01', end)
+        calls = len(fetcher.calls)
+        for run in range(3):
+            warm = MarketDataStore(str(tmpdir.join(end)), fetcher)
+            assert warm.get('AAPL', '2015-01-01', end, 'Open').index[-1] == pd.Timestamp('2015-12-31')
+        assert len(fetcher.calls) == calls
+        assert store._read_meta('AAPL')['end'] == end
+
+
+def test_unpublished_days_are_not_covered(tmpdir):
+    # The provider has no bar yet for today
+    today = pd.Timestamp.now().normalize()
+    first = today - pd.Timedelta(days=30)
+    history = pd.DataFrame({'Open': np.arange(31, dtype=np.float64)}, index=pd.date_range(first, today))
+    fetcher = FrameFetcher({'AAPL': history.iloc[:-1]})
+    store = MarketDataStore(str(tmpdir), fetcher)
+    store.get('AAPL', first, today)
+    assert pd.Timestamp(store._read_meta('AAPL')['end']) == today - pd.Timedelta(days=1)
+
+    # Once it is published, the next request fetches it
+    fetcher.frames['AAPL'] = history
+    data = store.get('AAPL', first, today, 'Open')
+    assert fetcher.calls[-1][1:] == (today, today)
+    assert data.index[-1] == today
+    assert pd.Timestamp(store._read_meta('AAPL')['end']) == today
+
+
+def test_empty_fetch_leaves_the_coverage_unchanged(tmpdir):
+    history = bars('2015-01-01', '2015-12-31')
+    fetcher = FrameFetcher({'AAPL': history.loc[:'2015-06-30']})
+    store = MarketDataStore(str(tmpdir), fetcher)
+    store.get('AAPL', '2015-01-01', '2015-06-30')
+    meta = store._read_meta('AAPL')
+
+    # A failed fetch returns an empty frame instead of raising
+    fetcher.frames = {}
+    data = store.get('AAPL', '2015-01-01', '2015-12-31', 'Open')
+    assert store._read_meta('AAPL') == meta
+    assert len(data) == len(history.loc[:'2015-06-30'])
+
+    # The range is asked for again, and filled, once the provider answers
+    fetcher.frames = {'AAPL': history}
+    data = store.get('AAPL', '2015-01-01', '2015-12-31', 'Open')
+    np.testing.assert_array_equal(data.values, history['Open'].values)
+    assert store._read_meta('AAPL')['end'] == '2015-12-31'
+
+
+def test_unknown_ticker_is_not_remembered(tmpdir):
+    fetcher = FrameFetcher({})
+    store = MarketDataStore(str(tmpdir), fetcher)
+    assert store.get('NOPE', '2015-01-01', '2015-12-31').empty
+    assert store._read_meta('NOPE') is None